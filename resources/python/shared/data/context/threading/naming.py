@@ -56,8 +56,20 @@ class NamedThreadContexts(ThreadContexts):
 
 	@identifier.setter
 	def identifier(self, new_id):
+		"""
+		Rename the context, and every thread it tracks along with it.
+		
+		The threads are gathered from tracking rather than by name, since
+		they're still named with the old identifier until renamed here.
+		"""
+		tracked_threads = [
+			thread
+			for thread
+			in frozenset(self._thread_references.values())
+			if not self._is_thread_terminated(thread)
+		]
 		self._identifier = str(new_id)
-		for thread in frozenset(self._all_threads):
+		for thread in tracked_threads:
 			self._name_thread(thread)
 		#raise ValueError("No changing an identifier after init - too much stuff and contexts already know about it.")
 
@@ -51,7 +51,7 @@ def poll(role):
 				# decoractor indirection effectively leaves role_method unbound, so let's set that
 				@functools.wraps(role_method)
 				def role_method_partial(*args, **kwargs):
-					role_method(context, *args, **kwargs)
+					return role_method(context, *args, **kwargs)
 #               role_method_partial = functools.partial(role_method, context)
 #               functools.update_wrapper(role_method_partial, role_method)
 				try:
@@ -170,6 +170,8 @@ class EventLoop(ThreadContexts):
 		Follows the convention of __init__ somewhat: args passed in are also passed to
 		the _setup function
 		
+		If the method returns something truthy it's taken to mean it did work, and
+		the loop goes right back around instead of waiting (there may well be more).
 		"""
 		setup_method = getattr(self, role_method.__name__ + '_setup', None)
 		
@@ -186,13 +188,17 @@ class EventLoop(ThreadContexts):
 				self._method_polling_loop_pre_iter(role_method, *args, **kwargs)
 				
 				# iterate!
-				role_method(*args, **kwargs)
+				did_work = role_method(*args, **kwargs)
 				
 				# check if anything should be done after iterating
 				self._method_polling_loop_post_iter(role_method, *args, **kwargs)
 				
-				# wait a moment before iterating
-				sleep(self._event_loop_delay)
+				# wait a moment before iterating, unless busy
+				# (or the role method itself blocks while waiting)
+				if not did_work:
+					delay = self._event_loop_delay
+					if delay > 0:
+						sleep(delay)
 		
 		except StopIteration:
 			# silently and gracefully stop
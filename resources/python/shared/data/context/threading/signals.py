@@ -8,7 +8,9 @@ from uuid import uuid1
 import functools
 
 from datetime import datetime, timedelta
-from time import sleep
+from time import sleep, time
+
+from java.lang import Thread
 
 from shared.data.context.base import ContextManagementForContexts
 from shared.data.context.utility import async, JavaException, apply_jitter
@@ -157,50 +159,49 @@ class EventLoopStopSignal(EventLoopSignalProcessing):
 		return self._DEFAULT_ROLE_STOP_WAIT * 1.1
 
 
+	def _join_role_threads(self, roles, timeout):
+		"""
+		Wait for the roles' threads to end, up to timeout seconds all told.
+		
+		Returns the threads still running (never counting the calling thread,
+		which can't very well wait on itself).
+		"""
+		current_thread = Thread.currentThread()
+		threads = [thread
+				   for role in roles
+				   for thread in list(self._role_threads(role))
+				   if thread is not current_thread]
+		deadline = time() + timeout
+		for thread in threads:
+			remaining = deadline - time()
+			if remaining <= 0:
+				break
+			thread.join(max(1, int(remaining * 1000)))
+		return [thread for thread in threads if not self._is_thread_terminated(thread)]
+
 	def _stop_role(self, role):
-		self.signal(role, StopSignal)
-		now = datetime.now()
-		delay = timedelta(seconds=self._stop_wait_delay)
-		while datetime.now() < (now + delay):
-			# check if all the threads have terminated
-			if all([self._is_thread_terminated(thread) 
-					for thread
-					in self._role_threads(role)
-				   ]):
-				self.cancel_signal(role, StopSignal)
-				return
-			sleep(self._EVENT_LOOP_DELAY / 2.0)
-		raise StopTimeout("""Not all threads stopped: %r""" % (
-			[thread.getName() 
-			 for thread in self._role_threads(role)
-			 if not self._is_thread_terminated(thread)
-			],
-		))
+		self._stop_roles([role], self._stop_wait_delay)
 			
-	def _stop_roles(self):
-		roles_to_stop = self.active_roles
-		for role in roles_to_stop:
+	def _stop_roles(self, roles=None, timeout=None):
+		"""
+		Signal the roles to stop (all of them at once, so they wind down together) 
+		and join their threads. Raises StopTimeout if any are still running after timeout seconds.
+		"""
+		if roles is None:
+			roles = self.active_roles
+		if timeout is None:
+			timeout = self._stop_wait_max_delay
+		for role in roles:
 			self.signal(role, StopSignal)
-		now = datetime.now()
-		delay = timedelta(seconds=self._stop_wait_max_delay)
-		while datetime.now() < (now + delay):
-			# check if all the threads have terminated
-			if all([self._is_thread_terminated(thread)
-					for role, threads in self._all_role_threads.items()
-					for thread in threads
-					if role # skip main context handler, since that's probably what called for this
-				   ]):
-				for role in roles_to_stop:
-					self.cancel_signal(role, StopSignal)
-				return
-			sleep(self._EVENT_LOOP_DELAY / 2.0)
-		raise StopTimeout("""Not all threads stopped: %r""" % (
-			[thread.getName() 
-			 for role, threads in self._all_role_threads.items()
-			 for thread in threads
-			 if not self._is_thread_terminated(thread)
-			],
-		))
+		still_running = self._join_role_threads(roles, timeout)
+		if still_running:
+			raise StopTimeout("""Not all threads stopped: %r""" % (
+				[thread.getName() for thread in still_running],
+			))
+		for role in roles:
+			# (if the caller is one of the roles, it'll still need to see the signal)
+			if not self._has_threads(role):
+				self.cancel_signal(role, StopSignal)
 
 
 
@@ -168,6 +168,34 @@ from java.lang import Exception as JavaException, NoClassDefFoundError
 from java.util.jar import JarFile
 
 
+def jar_class_paths(jar_file):
+	"""Dotted paths of every class in the jar (a JarFile or its path, which is closed after)."""
+	opened = not isinstance(jar_file, JarFile)
+	if opened:
+		jar_file = JarFile(jar_file)
+	try:
+		for entry in jar_file.entries():
+			entry_name = str(entry)
+			if not entry_name.endswith('.class'):
+				continue # path, not class
+			yield entry_name[:-6].replace('/', '.')
+	finally:
+		if opened:
+			jar_file.close()
+
+
+def group_by_package(class_paths, packages=None):
+	"""Collect class names into a dict of package paths to the set of their class names."""
+	if packages is None:
+		packages = {}
+	for class_path in class_paths:
+		package_path, _, class_name = class_path.rpartition('.')
+		if not package_path in packages:
+			packages[package_path] = set()
+		packages[package_path].add(class_name)
+	return packages
+
+
 class JarClassLoader(object):
 	"""Load in jars via an alternate method from just injecting into sys.path
 
@@ -203,19 +231,16 @@ class JarClassLoader(object):
 		self.package_jars = {} # for knowing what the file path should be
 		
 		for jar_file_path, jarFile in zip(self.jar_file_paths, self.jarFiles):
-			for class_name in jarFile.entries():
-				if not str(class_name).endswith('.class'):
-					continue # path, not class
-				class_path = str(class_name)[:-6].replace('/', '.')
-				self.class_list.add(class_path)
-				
-				# module paperwork
-				package_path, _, class_name = class_path.rpartition('.')
+			jar_classes = set(jar_class_paths(jarFile))
+			self.class_list.update(jar_classes)
+			
+			# module paperwork
+			for package_path, class_names in group_by_package(jar_classes).items():
 				if not package_path in self.packages:
 					self.packages[package_path] = set()
 					self.package_jars[package_path] = jar_file_path
-				self.packages[package_path].add(class_name)
-				
+				self.packages[package_path].update(class_names)
+			
 		# grind over classes
 		self.load_in_all_classes()
 		
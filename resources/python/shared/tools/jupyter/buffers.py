@@ -0,0 +1,172 @@
+"""
+	Pack columns of values into binary buffers for the wire.
+
+	Jupyter messages can carry raw binary buffers after the signed JSON
+	sections. Comms and display_data can use them to ship bulk numeric
+	data (dataset columns, trend arrays, tag history) without a JSON
+	round-trip per sample.
+
+	Buffers are packed little-endian, which is what JavaScript typed
+	arrays and numpy expect by default. Each buffer gets a descriptor
+	so the frontend knows how to view it:
+
+		{'name': 't_stamp', 'dtype': 'float64', 'length': 1440, 'buffer': 0}
+
+	Columns that can't be packed (strings, mostly) are kept inline in
+	their descriptor as 'json' values instead.
+"""
+logger = shared.tools.jupyter.logging.Logger()
+
+
+__all__ = ['pack_column', 'pack_columns', 'buffer_view']
+
+
+from java.nio import ByteBuffer, ByteOrder
+from java.lang import Double, Float, Long, Integer, Short, Byte, Boolean, Number
+from java.math import BigDecimal, BigInteger
+from java.util import Date
+from com.inductiveautomation.ignition.common import BasicDataset
+from com.inductiveautomation.ignition.common.script.builtin.DatasetUtilities import PyDataSet
+
+from datetime import datetime
+import jarray
+
+
+# dtype -> (bytes per element, jarray typecode, ByteBuffer view method)
+PACKED_DTYPES = {
+	'float64': (8, 'd', 'asDoubleBuffer'),
+	'float32': (4, 'f', 'asFloatBuffer'),
+	'int64':   (8, 'l', 'asLongBuffer'),
+	'int32':   (4, 'i', 'asIntBuffer'),
+	'int16':   (2, 'h', 'asShortBuffer'),
+	'uint8':   (1, 'b', None),
+}
+
+# dataset column type -> dtype
+# Dates are packed as float64 epoch milliseconds, same as JavaScript Date.getTime()
+COLUMN_TYPE_DTYPES = {
+	Double:     'float64',
+	Float:      'float32',
+	BigDecimal: 'float64',
+	Long:       'int64',
+	BigInteger: 'int64',
+	Integer:    'int32',
+	Short:      'int16',
+	Byte:       'uint8',
+	Boolean:    'uint8',
+	Date:       'float64',
+}
+
+
+def _coerce_values(values, dtype):
+	"""Get the column into something jarray can pack directly."""
+	floating = dtype.startswith('float')
+	coerced = []
+	for value in values:
+		if value is None:
+			# no NaN for integers, so zero will have to do
+			value = Double.NaN if floating else 0
+		elif isinstance(value, Date):
+			value = value.getTime()
+		elif isinstance(value, datetime):
+			value = (value - datetime(1970, 1, 1)).total_seconds() * 1000.0
+		elif isinstance(value, Number):
+			value = value.doubleValue() if floating else value.longValue()
+		elif isinstance(value, bool):
+			value = int(value)
+		coerced.append(value)
+	return coerced
+
+
+def pack_column(values, dtype='float64'):
+	"""
+	Pack a sequence of numbers into a little-endian byte[].
+
+	Values are converted in bulk via jarray and put into a typed view
+	of the buffer, so there's no per-element call back into Java.
+	"""
+	try:
+		width, typecode, view_method = PACKED_DTYPES[dtype]
+	except KeyError:
+		raise ValueError('Can not pack dtype %r, must be one of %r' % (dtype, sorted(PACKED_DTYPES)))
+
+	values = _coerce_values(values, dtype)
+
+	if typecode == 'b':
+		values = [v & 0xFF for v in values]
+		return jarray.array([v - 256 if v > 127 else v for v in values], 'b')
+
+	packed = ByteBuffer.allocate(len(values) * width).order(ByteOrder.LITTLE_ENDIAN)
+	getattr(packed, view_method)().put(jarray.array(values, typecode))
+	return packed.array()
+
+
+def _dataset_columns(dataset):
+	if isinstance(dataset, PyDataSet):
+		dataset = dataset.getUnderlyingDataset()
+	columns = []
+	for cix, name in enumerate(dataset.getColumnNames()):
+		dtype = COLUMN_TYPE_DTYPES.get(dataset.getColumnType(cix))
+		columns.append((name, list(dataset.getColumnAsList(cix)), dtype))
+	return columns
+
+
+def pack_columns(columns, dtype=None):
+	"""
+	Pack columns into binary buffers. Returns (buffers, descriptors).
+
+	Columns may be a dataset, a dict of name: values, or a list of
+	(name, values) pairs. Dataset columns get their dtype from the
+	column type; otherwise it's dtype, defaulting to float64.
+	"""
+	if isinstance(columns, (BasicDataset, PyDataSet)):
+		columns = _dataset_columns(columns)
+	else:
+		if isinstance(columns, dict):
+			columns = sorted(columns.items())
+		columns = [(name, values, dtype or 'float64') for name, values in columns]
+
+	buffers = []
+	descriptors = []
+	for name, values, column_dtype in columns:
+		if column_dtype is None:
+			descriptors.append({
+				'name': name, 'dtype': 'json', 'length': len(values), 'values': list(values)})
+			continue
+		descriptors.append({
+			'name': name, 'dtype': column_dtype, 'length': len(values), 'buffer': len(buffers)})
+		buffers.append(pack_column(values, column_dtype))
+
+	return buffers, descriptors
+
+
+def buffer_view(buffer, dtype='float64'):
+	"""Read-only typed view over a little-endian buffer (the inverse of pack_column)."""
+	width, typecode, view_method = PACKED_DTYPES[dtype]
+	if not isinstance(buffer, ByteBuffer):
+		buffer = ByteBuffer.wrap(buffer)
+	buffer = buffer.asReadOnlyBuffer().order(ByteOrder.LITTLE_ENDIAN)
+	if view_method is None:
+		return buffer
+	return getattr(buffer, view_method)()
+
+
+
+def _run_tests():
+	from shared.tools.jupyter.buffers import pack_column, pack_columns, buffer_view
+
+	values = [0.0, 1.5, -2.25, None, 1e10]
+	view = buffer_view(pack_column(values), 'float64')
+	assert view.limit() == len(values)
+	assert [view.get(i) for i in range(3)] == [0.0, 1.5, -2.25]
+	assert Double.isNaN(view.get(3))
+
+	view = buffer_view(pack_column([1, -2, 2**40], 'int64'), 'int64')
+	assert [view.get(i) for i in range(3)] == [1, -2, 2**40]
+
+	assert list(pack_column([1, 255, 0], 'uint8')) == [1, -1, 0]
+
+	buffers, descriptors = pack_columns({'b': [1, 2], 'a': [3.0, 4.0]})
+	assert [d['name'] for d in descriptors] == ['a', 'b']
+	assert [d['buffer'] for d in descriptors] == [0, 1]
+	assert len(buffers[0]) == 16
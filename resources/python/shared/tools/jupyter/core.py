@@ -13,14 +13,20 @@ from uuid import uuid4
 from datetime import datetime, timedelta
 import string
 import json
-from time import sleep
+from time import sleep, time
 import re
 import sys
 import itertools
+from threading import Lock
+from collections import deque
+
+from java.lang import InterruptedException
+from java.util.concurrent import ConcurrentLinkedQueue, LinkedBlockingQueue, TimeUnit, FutureTask
 
 from org.apache.commons.lang3 import SystemUtils
 
 from shared.data.context.core import Context
+from shared.data.context.threading.signals import StopTimeout
 
 
 from shared.tools.jupyter.base import JupyterKernelBaseMixin
@@ -28,9 +34,11 @@ from shared.tools.jupyter.messages import KernelMessagingMixin
 from shared.tools.jupyter.comm import KernelCommMixin
 from shared.tools.jupyter.catch import *
 from shared.tools.jupyter.zmq import *
-from shared.tools.jupyter.wire import WireMessage
+from shared.tools.jupyter.wire import WireMessage, MessageSigner
 from shared.tools.jupyter.execution.context import ExecutionContext
-from shared.tools.jupyter.status import declare_busy, declare_idle, declare_starting
+from shared.tools.jupyter.execution.run import CompileCache
+from shared.tools.jupyter.execution.classpath import refresh_java_class_index
+from shared.tools.jupyter.status import declare_busy, declare_idle, declare_starting, StatusTracker
 
 
 def random_id(length=4):
@@ -120,6 +128,8 @@ class JupyterKernelCore(
 		'kernel_name',                 # generic description of kernel type
 		'kernel_id',                   # lookup key for reference in Ignition
 		'signature_scheme', 'key',     # id/key used by Jupyter (likely same as kernel_id)
+		'signer',                      # HMAC keyed once for the kernel's messages
+		'trusted_loopback',            # skip inbound signature checks on Curve secured sockets
 		'transport', 'ip', 'zcontext', 
 		'_server_public_key', '_server_secret_key', # for encrypting sockets
 		
@@ -132,6 +142,22 @@ class JupyterKernelCore(
 		'min_port_range', 'max_port_range',
 		'loop_delay', 'lingering_delay',
 		'interrupted',
+		'teardown_timeout', # seconds to wait on the kernel's threads to stop
+		'interrupt_grace_period', # seconds a cell gets to stop on its own when interrupted
+		
+		# execution results kept in memory, past which they're written to disk
+		'history_max_entries', 'history_max_bytes', 'history_folder',
+		# run cells with locals as globals (instead of copying locals over after each statement)
+		'merged_namespace',
+		
+		# compiled cells, so running one again skips parsing and compiling
+		'compile_cache', 'compile_cache_size',
+		
+		# indexed code of past sessions (most recent last), for history requests
+		'past_histories', 'history_past_sessions', '_session_numbers',
+		
+		'pooled',           # launched ahead of time, waiting to be adopted (see .pool)
+		'_bound_endpoints', # per role, as resolved by ZMQ (needed to unbind)
 		
 		'traps', # bucket for signals to trap debug loggers and such
 		
@@ -150,6 +176,22 @@ class JupyterKernelCore(
 		# zmq poller contexts to check sockets
 		'process_zpoller', 'execution_zpoller',
 		'zpoll_timeout_ms', 
+		'poll_drain_budget', # max messages handled per socket each poll iteration
+		
+		# event driven mode: the blocking zpoll is the only wait, and signals
+		# wake the role's poller via an inproc PAIR socket registered with it
+		'event_driven', 'event_zpoll_timeout_ms',
+		'_wake_sockets', '_wake_lock',
+		
+		# messages sent from threads other than the socket's poller, queued per poll role
+		'outbound_queues',
+		
+		# execute requests are run in order by a dedicated worker, 
+		# so the execution poller can keep serving the rest of shell
+		'execution_queue',
+		
+		# busy/idle updates, batched until flushed
+		'status_tracker',
 		
 		
 		# convenience functions for auto-resolving so stuff can't get mixed up
@@ -181,6 +223,9 @@ class JupyterKernelCore(
 	_EXECUTION_ROLES = ('shell', 'iopub', 'stdin',)
 	
 	_JUPYTER_ROLES = _PROCESS_ROLES + _EXECUTION_ROLES 
+	
+	# the kernel's own threads (as opposed to its sockets' roles)
+	_KERNEL_THREAD_ROLES = ('process', 'execution', 'worker', 'background',)
 
 	_SLOT_DEFAULTS = {
 			'kernel_name': 'ignition_kernel',
@@ -190,18 +235,34 @@ class JupyterKernelCore(
 			'username': 'kernel',
 			
 			'signature_scheme': 'hmac-sha256',
+			'trusted_loopback': False,
 			
 			'min_port_range': 30000,
 			'max_port_range': 32000,
 			
 			'loop_delay': 0.05,      # seconds
 			'lingering_delay': 0.35, # seconds
+			'teardown_timeout': 2.0, # seconds
+			'interrupt_grace_period': 0.5, # seconds before tracing a cell to a halt
+			
+			'history_max_entries': 100,
+			'history_max_bytes': 16 << 20, # characters of code and output
+			'history_folder': None, # system temp folder
+			'history_past_sessions': 4,
+			
+			'compile_cache_size': 256, # cells
+			'merged_namespace': True,
 			
 			'zpoll_timeout_ms': 10, # milliseconds
+			'poll_drain_budget': 64,
+			
+			'event_driven': True,
+			'event_zpoll_timeout_ms': 250, # signals wake the poller, so this can be long
 			
 			'default_logging_level': DEFAULT_LOGGING_LEVEL,
 			'live_reload': False,
 			'interrupted': False,
+			'pooled': False,
 			
 			# set to None 
 			'cardiac_arrest_timeout': timedelta(minutes=15),
@@ -285,6 +346,20 @@ class JupyterKernelCore(
 			self.key = str(uuid4())
 		assert self.key not in JupyterKernel, "Kernel %(kernel_id)s already started!" % self
 		
+		self.signer = MessageSigner(self.key, self.signature_scheme)
+		
+		self._wake_sockets = {}
+		self._wake_lock = Lock()
+		self.outbound_queues = {
+				'process':   ConcurrentLinkedQueue(), 
+				'execution': ConcurrentLinkedQueue(),
+			}
+		self.execution_queue = LinkedBlockingQueue()
+		self.status_tracker = StatusTracker(self)
+		self.past_histories = deque(maxlen=self.history_past_sessions or 0)
+		self._session_numbers = itertools.count(1)
+		self.compile_cache = CompileCache(self.compile_cache_size)
+		
 		if self.username is None:
 			self.username = SystemUtils.USER_NAME
 		
@@ -324,13 +399,15 @@ class JupyterKernelCore(
 		# know that Jupyter is no longer in contact with it!
 		# Under normal operations this would likely just leave it running and reconnect
 		# once Jupyter recovers or comes back online.
-		if self.cardiac_arrest_timeout:
+		# pooled kernels have nobody to hear from yet
+		if self.cardiac_arrest_timeout and not self.pooled:
 			if self.last_heartbeat < (datetime.now() - self.cardiac_arrest_timeout):
 				self.logger.warn('Cardiac arrest!')
 				raise CardiacArrest
 
 
 	def tear_down(self):
+		teardown_start = time()
 		try: # yes. I feel bad for doing this. 
 			try: # but I really want to make sure that the post_tear_down happens _strictly_ post
 				try: # AND I want to make sure that the zcontext properly is closed up
@@ -338,11 +415,21 @@ class JupyterKernelCore(
 					
 					self.logger.info('Tearing down kernel %(kernel_id)s...' % self)
 					
-					self.logger.debug('Stopping polling...')
-					self._stop_role('execution')
-					self._stop_role('process')
-					sleep((self.zpoll_timeout_ms/1000.0) *4)
-					self.logger.debug('polling roles should now be stopped')
+					# signal everything at once (signals wake the pollers and worker)
+					# and then wait for them to wind down together
+					self.logger.debug('Stopping polling and execution worker...')
+					if self.session:
+						# background tasks don't check signals, so they're interrupted outright
+						self.session.background_tasks.cancel_all()
+					try:
+						self._stop_roles(self._KERNEL_THREAD_ROLES, self.teardown_timeout)
+					except StopTimeout as error:
+						# a cell may well still be running, but the pollers must be done
+						# before their sockets can be closed out from under them
+						if self._has_threads('process') or self._has_threads('execution'):
+							raise
+						self.logger.warn('Execution worker or background tasks did not stop: %r' % (error,))
+					self.logger.debug('polling roles stopped')
 					
 					super(JupyterKernelCore, self).tear_down()
 					
@@ -375,11 +462,13 @@ class JupyterKernelCore(
 					
 					for attr in [attr for attr in self.__slots__ if attr.endswith('_port') or attr.endswith('_socket')]:
 						setattr(self, attr, None)
+					with self._wake_lock:
+						self._wake_sockets = {}
 				finally:
 					self.logger.debug('Destroying zcontext...')
+					# sockets are set to not linger, so this doesn't wait on unsent messages
 					self.zcontext.destroy()
-					sleep(1.5) # give everything a moment to settle, close, finallize, etc.
-					self.logger.info('Done. Good-bye!')
+					self.logger.info('Done in %0.3fs. Good-bye!' % (time() - teardown_start,))
 
 		finally:
 			# regardless of the success breaking down the kernel, 
@@ -403,6 +492,9 @@ class JupyterKernelCore(
 		# initialize a zcontext that will handle all the ZMQ sockets, polling, and messages
 		assert not self.is_launched, "ZContext already launched! HCF >_<"
 		self.zcontext = ZContext()
+		# tearing down shouldn't wait on messages nobody is around to receive
+		self.zcontext.setLinger(0)
+		self._bound_endpoints = {}
 		
 		# create and bind the ZMQ sockets we'll be using
 		for role in self._JUPYTER_ROLES:
@@ -423,8 +515,16 @@ class JupyterKernelCore(
 			   self[role + '_port'] = self.bind_random_port(self[role + '_socket'])
 			else:
 			   self.bind_selected_port(self[role + '_socket'], self[role + '_port'])
+			self._bound_endpoints[role] = socket.getLastEndpoint()
 			self.logger.trace('%-16s on port %d' % (role, self[role + '_port']))
 		
+		# Curve already authenticates and encrypts the transport, so if asked to
+		# trust that, skip re-checking the HMAC on every inbound message
+		self.signer.trusted = bool(self.trusted_loopback) and all(
+				self[role + '_socket'].getCurveServer() for role in self._JUPYTER_ROLES)
+		if self.signer.trusted:
+			self.logger.debug('Trusted loopback: inbound signatures will not be verified')
+		
 		# broadcast that the kernel is coming online now that we have sockets for it
 		declare_starting(self)
 
@@ -437,9 +537,16 @@ class JupyterKernelCore(
 		self.execution_zpoller = ZPoller(self.zcontext)
 		for socket in self.execution_sockets:
 			self.execution_zpoller.register(socket, ZPoller.POLLIN)
+		
+		if self.event_driven:
+			self.process_zpoller.register(self._new_wake_socket('process'), ZPoller.POLLIN)
+			self.execution_zpoller.register(self._new_wake_socket('execution'), ZPoller.POLLIN)
 
 		# create an execution context for us to run code inside
 		self.new_execution_session()
+		
+		# Java packages/classes for completion (loaded from disk, rebuilt only if needed)
+		refresh_java_class_index()
 
 		# start the zmq socket polling
 		# (but only if not already running)
@@ -447,6 +554,8 @@ class JupyterKernelCore(
 			self.poll_process()
 		if 'execution' not in self.active_roles:
 			self.poll_execution()
+		if 'worker' not in self.active_roles:
+			self.poll_worker()
 			#self.start_execution_context()
 		
 		# give everything a moment to settle and come online
@@ -457,11 +566,67 @@ class JupyterKernelCore(
 		
 		# announce that startup is complete
 		declare_idle(self)
+		self.status_tracker.flush()
 
 
 
+	def rebind_port(self, role, port):
+		"""Move the role's socket to another port (without disturbing anything else)."""
+		def rebind(kernel=self, role=role, port=port):
+			socket = kernel[role + '_socket']
+			socket.unbind(kernel._bound_endpoints[role])
+			kernel.bind_selected_port(socket, port)
+			kernel._bound_endpoints[role] = socket.getLastEndpoint()
+			kernel[role + '_port'] = port
+		self._call_on_poller(self._socket_poll_role(role), rebind)
+		self.logger.trace('%-16s moved to port %d' % (role, port))
+	
+	
+	# connection settings that can be changed on a kernel after it's launched
+	ADOPTABLE_SETTINGS = frozenset([
+		'kernel_id', 'key', 'signature_scheme',
+		'shell_port', 'iopub_port', 'stdin_port', 'control_port', 'hb_port',
+	])
+	
+	def adopt(self, kernel_id=None, key=None, signature_scheme=None, **ports):
+		"""
+		Take over a pooled (already launched and primed) kernel for a new connection.
+		
+		The kernel gets the requested id and HMAC key, and any ports requested
+		that differ from what it's already bound to are moved over.
+		"""
+		assert self.pooled, 'Only pooled kernels may be adopted'
+		
+		if signature_scheme:
+			self.signature_scheme = signature_scheme
+		if key:
+			self.key = key
+		trusted = self.signer.trusted
+		self.signer = MessageSigner(self.key, self.signature_scheme, trusted)
+		
+		for role in self._JUPYTER_ROLES:
+			port = ports.get(self._SLOT_ALIAS_BRIDGE.get(role + '_port', role + '_port'))
+			if port and port != self[role + '_port']:
+				self.rebind_port(role, port)
+		
+		# rename last, so it can't be looked up before it's ready
+		if kernel_id:
+			self._KERNEL_KEYS[kernel_id] = (self._server_public_key, self._server_secret_key)
+			self.kernel_id = kernel_id
+			self.identifier = kernel_id
+		
+		self.last_heartbeat = datetime.now()
+		self.pooled = False
+		self.logger.info('Adopted pooled kernel as [%(kernel_id)s]' % self)
+	
+	
 	def new_execution_session(self):
+		if self.session is not None:
+			# only the code is kept, for history requests
+			self.past_histories.append(self.session.history.index)
+			self.session.history.close()
 		self.session = ExecutionContext(self)
+		self.session.history.index.session = next(self._session_numbers)
 		try: # signal to the kernel provisioner that a new session is made
 			self.heartbeat_socket.send('restart')
 		except:
@@ -489,30 +654,175 @@ class JupyterKernelCore(
 		# create a new session inside this thread
 		self.new_execution_session()
 
+	def _drain_readable(self, zpoller, roles, sockets):
+		"""
+		Handle everything queued up on the readable sockets.
+		
+		Each socket is drained until empty, but only up to poll_drain_budget
+		messages so one chatty socket can't starve the others.
+		Returns how many messages were handled.
+		"""
+		handled = 0
+		for role, socket in zip(roles, sockets):
+			if not zpoller.isReadable(socket):
+				continue
+			# heartbeat is the only raw payload that isn't a message
+			if role == 'heartbeat':
+				handle = self._handle_zbytes
+			else:
+				handle = self._handle_zmessage
+			for _ in xrange(self.poll_drain_budget):
+				if self.interrupted or not handle(role, socket):
+					break
+				handled += 1
+		return handled
+	
+	
+	# WAKING
+	
+	def _new_wake_socket(self, role):
+		"""
+		Create the inproc PAIR for waking the role's poller. Returns the receiving end,
+		which is registered with the role's poller alongside the Jupyter sockets.
+		"""
+		address = 'inproc://kernel-%s-%s-wake' % (self.kernel_id, role)
+		receiver = self.zcontext.createSocket(SocketType.PAIR)
+		receiver.bind(address)
+		sender = self.zcontext.createSocket(SocketType.PAIR)
+		sender.connect(address)
+		with self._wake_lock:
+			self._wake_sockets[role] = (sender, receiver)
+		return receiver
+	
+	def wake(self, role):
+		"""Interrupt the role's blocking poll, if it's event driven."""
+		if role == 'worker':
+			self.execution_queue.offer(self._WORKER_WAKE)
+			return
+		with self._wake_lock:
+			# ZMQ sockets aren't thread safe, so sends are serialized by the lock
+			try:
+				sender, _ = self._wake_sockets[role]
+				sender.send('!', self.ZMQ_DONTWAIT)
+			except KeyError:
+				pass # not event driven (or torn down)
+			except (ZMQException, ZError, JavaException):
+				pass # a wake already queued is as good as this one
+	
+	def _drain_wake(self, zpoller, role):
+		"""Clear any wake-ups queued for the role. Returns True if woken."""
+		try:
+			_, receiver = self._wake_sockets[role]
+		except KeyError:
+			return False
+		if not zpoller.isReadable(receiver):
+			return False
+		while receiver.recv(self.ZMQ_DONTWAIT) is not None:
+			pass
+		return True
+	
+	def signal(self, role, message):
+		"""Signals are checked before each poll, so make sure the role gets around to it."""
+		super(JupyterKernelCore, self).signal(role, message)
+		self.wake(role)
+	
+	def _call_on_poller(self, poll_role, function, timeout=5.0):
+		"""
+		Run the function on the thread polling the role's sockets (and wait for it).
+		
+		Anything that touches a socket other than sending, like rebinding it,
+		has to happen on the socket's own thread.
+		"""
+		try:
+			polling_thread = self.role == poll_role
+		except KeyError:
+			polling_thread = False
+		if polling_thread or not self._has_threads(poll_role):
+			return function()
+		task = FutureTask(function)
+		self.outbound_queues[poll_role].offer(task)
+		self.wake(poll_role)
+		return task.get(long(timeout * 1000), TimeUnit.MILLISECONDS)
+	
+	@property
+	def _zpoll_timeout_ms(self):
+		return self.event_zpoll_timeout_ms if self.event_driven else self.zpoll_timeout_ms
+	
+	@property
+	def _event_loop_delay(self):
+		# when event driven the zpoll's block is the only wait needed
+		# (so long as there's a poller to block on)
+		if self.event_driven and not self.interrupted:
+			role = self.role
+			# the worker blocks on its queue instead
+			if role == 'worker':
+				return 0
+			zpoller = getattr(self, '%s_zpoller' % (role,), None)
+			if zpoller is not None:
+				return 0
+		return super(JupyterKernelCore, self)._event_loop_delay
+	
+	
 	@Context.poll('process')
 	def poll_process(self):
 		if self.interrupted or self.process_zpoller is None:
-			return
+			return False
 		with ZmqErrorCatcher(self) as catcher:
-			self.process_zpoller.poll(self.zpoll_timeout_ms)        
-			for role, socket in zip(self._PROCESS_ROLES, self.process_sockets):
-				if self.process_zpoller.isReadable(socket):
-					# heartbeat is the only raw payload that isn't a message
-					if role == 'heartbeat':
-						self._handle_zbytes(role, socket)
-					else:
-						self._handle_zmessage(role, socket)
+			self.process_zpoller.poll(self._zpoll_timeout_ms)        
+			woken = self._drain_wake(self.process_zpoller, 'process')
+			handled = self._drain_readable(self.process_zpoller, self._PROCESS_ROLES, self.process_sockets)
+			self.status_tracker.flush()
+			sent = self._drain_outbound('process')
+			return handled or sent or woken
 
 
 	@Context.poll('execution')
 	def poll_execution(self):
 		if self.interrupted or self.execution_zpoller is None:
-			return
+			return False
 		with ZmqErrorCatcher(self) as catcher:
-			self.execution_zpoller.poll(self.zpoll_timeout_ms)        
-			for role, socket in zip(self._EXECUTION_ROLES, self.execution_sockets):
-				if self.execution_zpoller.isReadable(socket):
-					self._handle_zmessage(role, socket)
+			self.execution_zpoller.poll(self._zpoll_timeout_ms)        
+			woken = self._drain_wake(self.execution_zpoller, 'execution')
+			handled = self._drain_readable(self.execution_zpoller, self._EXECUTION_ROLES, self.execution_sockets)
+			self.status_tracker.flush()
+			sent = self._drain_outbound('execution')
+			return handled or sent or woken
+	
+	
+	# EXECUTION WORKER
+	
+	_WORKER_WAKE = object()
+	
+	def defer_to_worker(self, handler, message):
+		"""
+		Queue the message to be handled by the execution worker, in order.
+		
+		Returns True, which tells the poller the message was deferred. The worker
+		declares idle for the message once handled.
+		"""
+		self.execution_queue.offer((handler, message))
+		return True
+	
+	@Context.poll('worker')
+	def poll_worker(self):
+		try:
+			entry = self.execution_queue.poll(self._zpoll_timeout_ms, TimeUnit.MILLISECONDS)
+		except InterruptedException:
+			# a stray interrupt (meant for a cell) mustn't take the worker down with it
+			Thread.interrupted()
+			self.logger.debug('Execution worker interrupted while waiting; carrying on.')
+			return True # check signals
+		if entry is None:
+			return False
+		if entry is self._WORKER_WAKE:
+			return True # check signals
+		handler, message = entry
+		try:
+			handler(self, message)
+		finally:
+			declare_idle(self, message)
+			self.status_tracker.flush()
+		return True
 
 
 	def reload_handlers(self):
@@ -0,0 +1,289 @@
+"""
+	JSON encoding tuned for message sections.
+
+	Serializing every outbound section via _asdict() and json.dumps means
+	the whole AdHocObject tree gets copied into dicts first, and then the
+	json module does its generic (and under Jython, slow) walk over it,
+	with anything unusual falling back to repr.
+
+	MessageEncoder instead walks AdHocObject, dict, list and Java collection
+	trees directly into a reusable per-thread chunk buffer. Java types that
+	show up in Ignition data are handled natively:
+	 - java.util.Date as ISO 8601 UTC (like the message header dates)
+	 - datasets as {"columns": [...], "rows": [[...], ...]}
+	 - boxed numbers (BigDecimal, AtomicLong, etc.) as JSON numbers
+
+	Key sorting is optional. The signature is computed over whatever bytes
+	were serialized, so it only needs to be consistent, not canonical.
+"""
+logger = shared.tools.jupyter.logging.Logger()
+
+
+__all__ = ['MessageEncoder', 'encode']
+
+
+from shared.data.types.adhoc import AdHocObject
+
+from java.lang import Number, Double, Float
+from java.math import BigDecimal
+from java.util import Date, Map, Collection
+from java.time import ZoneOffset
+from java.time.format import DateTimeFormatter
+from com.inductiveautomation.ignition.common import BasicDataset
+from com.inductiveautomation.ignition.common.script.builtin.DatasetUtilities import PyDataSet
+from org.python.core import PyArray
+
+import re
+import threading
+from datetime import datetime, date
+
+
+# same as the kernel's `now` (millisecond precision, UTC)
+ISO_DATE_FORMAT = DateTimeFormatter.ofPattern("yyyy-MM-dd'T'HH:mm:ss.SSS'Z'").withZone(ZoneOffset.UTC)
+
+
+# Only what JSON requires be escaped (as json.dumps with ensure_ascii=False)
+ESCAPE_PATTERN = re.compile(u'[\\x00-\\x1f\\\\"]')
+ESCAPE_REPLACEMENTS = dict((unichr(ix), u'\\u%04x' % ix) for ix in range(0x20))
+ESCAPE_REPLACEMENTS.update({
+	u'\\': u'\\\\', u'"': u'\\"',
+	u'\b': u'\\b', u'\f': u'\\f', u'\n': u'\\n', u'\r': u'\\r', u'\t': u'\\t',
+})
+
+def _escape_replacement(match):
+	return ESCAPE_REPLACEMENTS[match.group(0)]
+
+
+def encode_string(value):
+	"""JSON string literal for the text, escaping only if there's anything to escape."""
+	if isinstance(value, str):
+		try:
+			value = value.decode('utf-8')
+		except UnicodeDecodeError:
+			# raw byte strings still need to go out as something
+			value = value.decode('latin-1')
+	if ESCAPE_PATTERN.search(value) is None:
+		return u'"' + value + u'"'
+	return u'"' + ESCAPE_PATTERN.sub(_escape_replacement, value) + u'"'
+
+
+def encode_float(value):
+	if value != value:
+		return u'NaN'
+	if value in (float('inf'), float('-inf')):
+		return u'Infinity' if value > 0 else u'-Infinity'
+	return unicode(repr(value))
+
+
+
+class MessageEncoder(object):
+	"""
+	Serialize a message tree to JSON text.
+
+	Anything not otherwise understood is encoded as its `default` (repr, by
+	default - same as serialize_dictionary always did).
+	"""
+	__slots__ = ['sort_keys', 'default', '_buffers']
+
+	def __init__(self, sort_keys=False, default=repr):
+		self.sort_keys = sort_keys
+		self.default = default
+		self._buffers = threading.local()
+
+	def _buffer(self):
+		try:
+			chunks = self._buffers.chunks
+		except AttributeError:
+			chunks = self._buffers.chunks = []
+		return chunks
+
+	def encode(self, obj):
+		chunks = self._buffer()
+		if chunks:
+			# reentrant use (say, a default that encodes) gets a fresh buffer
+			chunks = []
+		try:
+			self._encode(obj, chunks.append)
+			return u''.join(chunks)
+		finally:
+			del chunks[:]
+
+	__call__ = encode
+
+
+	def _items(self, obj):
+		if isinstance(obj, AdHocObject):
+			items = obj._dict.items()
+		elif isinstance(obj, Map):
+			items = [(entry.getKey(), entry.getValue()) for entry in obj.entrySet()]
+		else:
+			items = obj.items()
+		if self.sort_keys:
+			items.sort()
+		return items
+
+	def _encode_key(self, key):
+		if isinstance(key, basestring):
+			return encode_string(key)
+		if key is True:
+			return u'"true"'
+		if key is False:
+			return u'"false"'
+		if key is None:
+			return u'"null"'
+		if isinstance(key, float):
+			return u'"' + encode_float(key) + u'"'
+		return encode_string(unicode(key))
+
+	def _encode_mapping(self, obj, append):
+		append(u'{')
+		first = True
+		for key, value in self._items(obj):
+			if first:
+				first = False
+			else:
+				append(u',')
+			append(self._encode_key(key))
+			append(u':')
+			self._encode(value, append)
+		append(u'}')
+
+	def _encode_sequence(self, obj, append):
+		append(u'[')
+		first = True
+		for value in obj:
+			if first:
+				first = False
+			else:
+				append(u',')
+			self._encode(value, append)
+		append(u']')
+
+	def _encode_dataset(self, dataset, append):
+		if isinstance(dataset, PyDataSet):
+			dataset = dataset.getUnderlyingDataset()
+		column_count = dataset.getColumnCount()
+		append(u'{"columns":')
+		self._encode_sequence(dataset.getColumnNames(), append)
+		append(u',"rows":[')
+		for rix in xrange(dataset.getRowCount()):
+			if rix:
+				append(u',')
+			self._encode_sequence([dataset.getValueAt(rix, cix) for cix in xrange(column_count)], append)
+		append(u']}')
+
+	def _encode(self, obj, append):
+		# roughly in order of how often they show up in messages
+		if isinstance(obj, basestring):
+			append(encode_string(obj))
+		elif obj is None:
+			append(u'null')
+		elif obj is True:
+			append(u'true')
+		elif obj is False:
+			append(u'false')
+		elif isinstance(obj, (int, long)):
+			append(unicode(obj))
+		elif isinstance(obj, float):
+			append(encode_float(obj))
+		elif isinstance(obj, AdHocObject):
+			# drop the placeholder AHOs, once for the whole tree
+			if not obj._clean:
+				obj._cull_empty()
+			self._encode_mapping(obj, append)
+		elif isinstance(obj, dict):
+			self._encode_mapping(obj, append)
+		elif isinstance(obj, (list, tuple, set, frozenset, PyArray)):
+			self._encode_sequence(obj, append)
+		elif isinstance(obj, Number):
+			if isinstance(obj, (Double, Float)):
+				append(encode_float(obj.doubleValue()))
+			elif isinstance(obj, BigDecimal):
+				append(unicode(obj.toString()))
+			else:
+				append(unicode(obj.longValue()))
+		elif isinstance(obj, Date):
+			append(u'"' + ISO_DATE_FORMAT.format(obj.toInstant()) + u'"')
+		elif isinstance(obj, (datetime, date)):
+			append(u'"' + obj.isoformat() + u'"')
+		elif isinstance(obj, (BasicDataset, PyDataSet)):
+			self._encode_dataset(obj, append)
+		elif isinstance(obj, Map):
+			self._encode_mapping(obj, append)
+		elif isinstance(obj, Collection):
+			self._encode_sequence(obj, append)
+		else:
+			append(encode_string(unicode(self.default(obj))))
+
+
+MESSAGE_ENCODER = MessageEncoder()
+
+def encode(obj):
+	return MESSAGE_ENCODER.encode(obj)
+
+
+
+def _run_tests():
+	from shared.tools.jupyter.encoder import MessageEncoder
+	from java.util import HashMap, ArrayList
+	from java.lang import Integer
+	import json
+
+	encoder = MessageEncoder(sort_keys=True)
+
+	simple = {'a': [1, 2.5, None, True, False], 'b': u'caf\xe9 "q"\n\\', 'c': {}, 3: 'x'}
+	assert json.loads(encoder.encode(simple)) == json.loads(
+		json.dumps(simple, sort_keys=True, ensure_ascii=False))
+	assert encoder.encode(simple) == json.dumps(simple, sort_keys=True, separators=(',',':'), ensure_ascii=False)
+
+	aho = AdHocObject({'x': 1})
+	aho.y.z = 'zed'
+	aho.placeholder
+	assert encoder.encode(aho) == u'{"x":1,"y":{"z":"zed"}}'
+
+	java_map = HashMap()
+	java_map.put('n', BigDecimal('1.25'))
+	java_list = ArrayList()
+	java_list.add(Integer(7))
+	java_map.put('l', java_list)
+	assert json.loads(encoder.encode(java_map)) == {'n': 1.25, 'l': [7]}
+
+	assert encoder.encode(Date(0)) == u'"1970-01-01T00:00:00.000Z"'
+	assert encoder.encode(float('nan')) == u'NaN'
+
+	_benchmark_encoder()
+
+
+def _benchmark_encoder(iterations=2000):
+	"""Compare serializing a typical execute_result through _asdict/json.dumps against MessageEncoder."""
+	from shared.tools.profile import convert_to_human_readable
+	from java.lang import System
+	import json
+
+	content = AdHocObject({
+		'execution_count': 42,
+		'data': {
+			'text/plain': u'<BasicDataset [100 rows, 3 cols]>\n' * 20,
+			'text/html': u'<table>%s</table>' % (u'<tr><td>1.5</td><td>"tag"</td></tr>' * 100,),
+		},
+		'metadata': {},
+		'transient': {'display_id': 'f6d16cd7-3bb7-4d1b-8148-96c15c1bb976'},
+		'values': [ix * 1.5 for ix in range(200)],
+	})
+
+	def legacy_encode(obj):
+		return json.dumps(obj._asdict(), sort_keys=True, separators=(',',':'),
+						  default=lambda obj: repr(obj), ensure_ascii=False)
+
+	results = {}
+	for label, serialize in (('before', legacy_encode),
+							 ('sorted', MessageEncoder(sort_keys=True).encode),
+							 ('after',  MessageEncoder().encode)):
+		start = System.nanoTime()
+		for _ in xrange(iterations):
+			_ = serialize(content)
+		elapsed = (System.nanoTime() - start) / 1e9
+		results[label] = iterations / elapsed
+		print '%-6s %10.0f messages/sec (%s per message)' % (
+			label, results[label], convert_to_human_readable(elapsed / iterations))
+	return results
@@ -0,0 +1,257 @@
+"""
+	Run code in the background, so the kernel can keep working.
+
+	A cell runs start to finish before the next can, so a long historian query
+	ties up the whole kernel. Instead, hand it to `background`:
+
+		task = background(system.tag.queryTagHistory, paths, startDate=start)
+		task = background('''
+			for row in slow_query():
+				print row
+		''')
+
+	Either way it runs on its own thread (tracked by the kernel under the
+	'background' role) and a BackgroundTask is returned right away. Output is
+	streamed to the cell that started it, and the task can be joined for its
+	result later (`task.result()`), much like a concurrent.futures.Future.
+
+	Code given as text runs in the session's namespace, like a cell would.
+
+	Each task's thread gets its own sys, otherwise its prints would land in
+	whatever cell happened to be running at the time.
+"""
+logger = shared.tools.jupyter.logging.Logger()
+
+
+__all__ = ['BackgroundTask', 'BackgroundTasks', 'TaskTimeout']
+
+
+from shared.tools.jupyter.catch import *
+from shared.tools.jupyter.execution.run import Executor
+from shared.tools.thread import async
+
+from org.python.core import Py, PySystemState
+
+from threading import Event, RLock
+from itertools import count
+from time import time
+import textwrap
+import sys
+
+
+
+class TaskTimeout(RuntimeError):
+	"""The background task did not finish in the time allowed."""
+
+
+
+def isolated_system_state(parent_sys):
+	"""A sys of its own (for I/O), sharing everything else with parent_sys."""
+	isolated = PySystemState()
+	isolated.modules = parent_sys.modules
+	isolated.path = parent_sys.path
+	isolated.meta_path = parent_sys.meta_path
+	isolated.path_hooks = parent_sys.path_hooks
+	isolated.path_importer_cache = parent_sys.path_importer_cache
+	isolated.builtins = parent_sys.builtins
+	isolated.setClassLoader(parent_sys.getClassLoader())
+	return isolated
+
+
+
+class BackgroundTask(object):
+	"""
+	Handle on something running in the background.
+
+	Mirrors the bits of concurrent.futures.Future that make sense here.
+	"""
+	__slots__ = ['task_id', 'description', 'thread',
+				 'stdout', 'stderr',
+				 'started', 'ended',
+				 '_result', '_exc_info', '_cancelled', '_finished',
+				]
+
+	def __init__(self, task_id, description):
+		self.task_id = task_id
+		self.description = description
+		self.thread = None
+		self.stdout = ''
+		self.stderr = ''
+		self.started = None
+		self.ended = None
+		self._result = None
+		self._exc_info = None
+		self._cancelled = False
+		self._finished = Event()
+
+
+	def done(self):
+		return self._finished.is_set()
+
+	def running(self):
+		return self.started is not None and not self.done()
+
+	def cancelled(self):
+		return self._cancelled
+
+	def cancel(self):
+		"""Interrupt the task. Returns False if it was already done."""
+		if self.done():
+			return False
+		self._cancelled = True
+		if self.thread is not None:
+			self.thread.interrupt()
+		return True
+
+	def join(self, timeout=None):
+		"""Wait for the task to finish. Returns True if it did."""
+		return self._finished.wait(timeout)
+
+	def exception(self, timeout=None):
+		"""The error the task raised (if any)."""
+		if not self.join(timeout):
+			raise TaskTimeout('%r did not finish in %0.3fs' % (self, timeout))
+		if self._exc_info:
+			return self._exc_info[1]
+		return None
+
+	def result(self, timeout=None):
+		"""Wait for (and return) the result, raising anything the task raised."""
+		if not self.join(timeout):
+			raise TaskTimeout('%r did not finish in %0.3fs' % (self, timeout))
+		if self._exc_info:
+			exc_type, exception, exc_tb = self._exc_info
+			raise exc_type, exception, exc_tb
+		return self._result
+
+	@property
+	def elapsed(self):
+		if self.started is None:
+			return 0.0
+		return (self.ended or time()) - self.started
+
+	@property
+	def state(self):
+		if self.cancelled() and self.done():
+			return 'cancelled'
+		if self.done():
+			return 'error' if self._exc_info else 'finished'
+		if self.running():
+			return 'running'
+		return 'pending'
+
+	def __repr__(self):
+		return '<BackgroundTask %d %s (%0.3fs): %s>' % (
+			self.task_id, self.state, self.elapsed, self.description)
+
+
+
+class BackgroundTasks(object):
+	"""
+	The session's background tasks. Calling it starts a new one.
+
+	Injected into scope as `background`.
+	"""
+	__slots__ = ['session', 'tasks', '_task_ids', '_lock']
+
+	DESCRIPTION_LIMIT = 60 # characters
+
+	def __init__(self, session):
+		self.session = session
+		self.tasks = []
+		self._task_ids = count(1)
+		self._lock = RLock()
+
+
+	def __call__(self, target, *args, **kwargs):
+		"""
+		Run the target in the background: either a callable (with the args given)
+		or code (as text) to run in the session's namespace.
+		"""
+		if isinstance(target, basestring):
+			assert not (args or kwargs), 'Code run in the background takes no arguments.'
+			target = textwrap.dedent(target).strip()
+			description = target.splitlines()[0] if target else ''
+		else:
+			assert callable(target), 'Background tasks run code (as text) or callables.'
+			description = getattr(target, '__name__', repr(target))
+		if len(description) > self.DESCRIPTION_LIMIT:
+			description = description[:self.DESCRIPTION_LIMIT-3] + '...'
+
+		with self._lock:
+			task = BackgroundTask(next(self._task_ids), description)
+			self.tasks.append(task)
+
+		# stream to the cell that started it (if it's streaming at all)
+		executor = self.session.active_executor
+		stream_publisher = executor.redirected_stdout.publisher if executor else None
+
+		task.thread = self._run(task, target, args, kwargs,
+								self.session._context_sys, stream_publisher)
+		return task
+
+
+	def _run(self, task, target, args, kwargs, parent_sys, stream_publisher):
+		kernel = self.session.kernel
+
+		@async(name='Jupyter-%s-background-%d' % (kernel.kernel_id, task.task_id,))
+		def run_task(self=self, task=task, target=target, args=args, kwargs=kwargs,
+					 parent_sys=parent_sys, stream_publisher=stream_publisher, kernel=kernel):
+			kernel._add_thread('background')
+			try:
+				Py.setSystemState(isolated_system_state(parent_sys))
+				task.started = time()
+				context = self.session._context
+				context['execution_location'] = '<Jupyter background %d>' % (task.task_id,)
+				with Executor(stream_publisher=stream_publisher, **context) as executor:
+					if isinstance(target, basestring):
+						executor.execute(target)
+						task._result = executor.display_object
+						task._exc_info = executor.last_error
+					else:
+						try:
+							task._result = target(*args, **kwargs)
+						except (Exception, KeyboardInterrupt, JavaException) as error:
+							task._exc_info = sys.exc_info()
+				task.stdout = executor.redirected_stdout.getvalue()
+				task.stderr = executor.redirected_stderr.getvalue()
+				if task._exc_info and stream_publisher:
+					stream_publisher('stderr', formatted_traceback(task._exc_info[1], task._exc_info[2]))
+			except (Exception, JavaException) as error:
+				task._exc_info = sys.exc_info()
+				logger.error('Background task %d failed: %r' % (task.task_id, error,))
+			finally:
+				task.ended = time()
+				task._finished.set()
+				kernel._remove_thread(interrupt_thread=False)
+
+		return run_task()
+
+
+	@property
+	def running(self):
+		return [task for task in self.tasks if not task.done()]
+
+	def cancel_all(self):
+		for task in self.running:
+			task.cancel()
+
+	def forget_finished(self):
+		"""Drop tasks that are done (their handles still work, of course)."""
+		with self._lock:
+			self.tasks = [task for task in self.tasks if not task.done()]
+
+	def __iter__(self):
+		return iter(list(self.tasks))
+
+	def __len__(self):
+		return len(self.tasks)
+
+	def __getitem__(self, task_id):
+		for task in self.tasks:
+			if task.task_id == task_id:
+				return task
+		raise KeyError(task_id)
+
+	def __repr__(self):
+		return '<BackgroundTasks %d running of %d>' % (len(self.running), len(self.tasks))
@@ -0,0 +1,290 @@
+"""
+	Index the Java packages and classes available, for completion.
+
+	Java packages can't be listed from Jython; resolving them is a matter of
+	trying names with getattr (which is slow, and only works for what's been
+	loaded already). Instead, the jars on the classpath (and the JDK's own
+	modules) are scanned for the classes they contain.
+
+	Scanning takes a while, so it's done in the background and the result is
+	saved to disk. Kernels load that first, and only rescan if the jars changed.
+	Class members (with their signatures) are only looked up once asked for.
+"""
+logger = shared.tools.jupyter.logging.Logger()
+
+
+__all__ = ['JavaClassIndex', 'java_class_index', 'refresh_java_class_index']
+
+
+from shared.tools.jupyter.catch import *
+from shared.tools.hotload import jar_class_paths, group_by_package
+from shared.tools.meta import getGatewayContext
+from shared.tools.thread import async
+
+from java.lang import System, Class, Thread
+from java.lang.reflect import Modifier
+from java.net import URI
+from java.nio.file import FileSystems, Files
+
+from bisect import bisect_left
+from threading import RLock
+import tempfile
+import json
+import os
+
+
+# folders (relative to the Ignition install) whose jars are indexed alongside the classpath
+JAR_FOLDERS = [
+	'lib/core/common',
+	'lib/core/gateway',
+	'user-lib/pylib',
+	'data/jar-cache',
+]
+
+CACHE_PATH = os.path.join(tempfile.gettempdir(), 'jupyter-java-class-index.json')
+
+CACHE_VERSION = 1
+
+
+
+def ignition_install_path():
+	"""
+	The folder Ignition is installed in (the gateway's data folder is in it).
+	Falls back to the working directory outside the gateway.
+	"""
+	try:
+		return getGatewayContext().getSystemManager().getDataDir().getAbsoluteFile().getParent()
+	except (Exception, JavaException) as error:
+		logger.warn('Could not find the Ignition install folder (using %r): %r' % (os.getcwd(), error,))
+		return os.getcwd()
+
+
+def classpath_jars(jar_folders=None):
+	"""Jar files on the JVM's classpath and in the jar folders (relative ones are in the Ignition install)."""
+	jar_paths = set()
+	for entry in (System.getProperty('java.class.path') or '').split(os.pathsep):
+		if entry.endswith('.jar') and os.path.isfile(entry):
+			jar_paths.add(os.path.abspath(entry))
+	install_path = ignition_install_path()
+	for folder in (JAR_FOLDERS if jar_folders is None else jar_folders):
+		for dirpath, _, filenames in os.walk(os.path.join(install_path, folder)):
+			for filename in filenames:
+				if filename.endswith('.jar'):
+					jar_paths.add(os.path.abspath(os.path.join(dirpath, filename)))
+	return sorted(jar_paths)
+
+
+def jdk_class_paths():
+	"""Dotted paths of the classes in the JDK's modules (Java 9+)."""
+	try:
+		jrt = FileSystems.getFileSystem(URI.create('jrt:/'))
+		modules = Files.newDirectoryStream(jrt.getPath('/modules'))
+	except (Exception, JavaException) as error:
+		return # older JVM: the JDK classes are on the classpath already
+	try:
+		for module in modules:
+			try:
+				walk = Files.walk(module)
+				try:
+					for path in walk.iterator():
+						path_name = str(module.relativize(path))
+						if path_name.endswith('.class') and not path_name.endswith('module-info.class'):
+							yield path_name[:-6].replace('/', '.')
+				finally:
+					walk.close()
+			except (Exception, JavaException) as error:
+				logger.warn('Could not index JDK module %s: %r' % (module, error,))
+	finally:
+		modules.close()
+
+
+def fingerprint(jar_paths):
+	"""Changes if any of the jars (or the JVM) do."""
+	return [System.getProperty('java.version')] + [
+		'%s:%d:%d' % (jar_path, os.path.getmtime(jar_path), os.path.getsize(jar_path))
+		for jar_path in jar_paths
+	]
+
+
+
+class JavaClassIndex(object):
+	"""
+	Packages and their classes, as found on the classpath.
+
+	Inner and anonymous classes ($ in the name) are left out, since they're
+	reached through their outer class.
+	"""
+	__slots__ = ['cache_path', 'fingerprint',
+				 'packages', 'subpackages',
+				 '_members', '_building', '_lock']
+
+	def __init__(self, cache_path=CACHE_PATH):
+		self.cache_path = cache_path
+		self.fingerprint = None
+		self.packages = {}    # package path: sorted class names
+		self.subpackages = {} # package path ('' for the roots): sorted child package names
+		self._members = {}    # class path: {member name: signature}
+		self._building = False
+		self._lock = RLock()
+
+
+	@property
+	def is_ready(self):
+		return bool(self.packages)
+
+	def _set_packages(self, packages, fingerprint):
+		subpackages = {}
+		for package_path in packages:
+			parts = package_path.split('.')
+			for ix in range(len(parts)):
+				parent = '.'.join(parts[:ix])
+				subpackages.setdefault(parent, set()).add(parts[ix])
+		with self._lock:
+			self.packages = dict((package_path, sorted(class_names))
+								 for package_path, class_names in packages.items())
+			self.subpackages = dict((parent, sorted(children))
+									for parent, children in subpackages.items())
+			self.fingerprint = fingerprint
+
+
+	def load(self):
+		"""Read the index from disk. Returns True if there was one to read."""
+		if not os.path.exists(self.cache_path):
+			return False
+		try:
+			with open(self.cache_path, 'rb') as cache_file:
+				cached = json.load(cache_file)
+			if cached.get('version') != CACHE_VERSION:
+				return False
+			self._set_packages(cached['packages'], cached['fingerprint'])
+			return True
+		except (Exception, JavaException) as error:
+			logger.warn('Could not read the Java class index cache: %r' % (error,))
+			return False
+
+	def save(self):
+		with self._lock:
+			cached = {
+				'version': CACHE_VERSION,
+				'fingerprint': self.fingerprint,
+				'packages': self.packages,
+			}
+		temp_path = self.cache_path + '.tmp'
+		with open(temp_path, 'wb') as cache_file:
+			json.dump(cached, cache_file, separators=(',',':'))
+		if os.path.exists(self.cache_path):
+			os.remove(self.cache_path)
+		os.rename(temp_path, self.cache_path)
+
+	def build(self, jar_paths=None):
+		"""Scan the jars and JDK for classes (slow, so best done in the background)."""
+		if jar_paths is None:
+			jar_paths = classpath_jars()
+
+		class_paths = set(jdk_class_paths())
+		for jar_path in jar_paths:
+			try:
+				class_paths.update(jar_class_paths(jar_path))
+			except (Exception, JavaException) as error:
+				logger.warn('Could not index %s: %r' % (jar_path, error,))
+
+		packages = group_by_package(
+			class_path for class_path in class_paths
+			if '$' not in class_path and '.' in class_path)
+		self._set_packages(packages, fingerprint(jar_paths))
+
+	def refresh(self):
+		"""Load from disk if possible, and rebuild (and save) if the classpath changed."""
+		with self._lock:
+			if self._building:
+				return
+			self._building = True
+		try:
+			if not self.is_ready:
+				self.load()
+			jar_paths = classpath_jars()
+			if self.fingerprint != fingerprint(jar_paths):
+				self.build(jar_paths)
+				self.save()
+				logger.debug('Java class index rebuilt: %d packages' % (len(self.packages),))
+		except (Exception, JavaException) as error:
+			logger.error('Java class index failed to build: %r' % (error,))
+		finally:
+			self._building = False
+
+
+	def is_package(self, dotted_path):
+		return dotted_path in self.subpackages or dotted_path in self.packages
+
+	def is_class(self, dotted_path):
+		package_path, _, class_name = dotted_path.rpartition('.')
+		class_names = self.packages.get(package_path, [])
+		ix = bisect_left(class_names, class_name)
+		return ix < len(class_names) and class_names[ix] == class_name
+
+	def children(self, package_path):
+		"""Subpackage and class names directly in the package ('' for the root packages)."""
+		return self.subpackages.get(package_path, []) + self.packages.get(package_path, [])
+
+	def complete(self, dotted_prefix):
+		"""Full dotted paths that could finish the prefix (like 'java.util.conc')."""
+		package_path, _, partial = dotted_prefix.rpartition('.')
+		if self.is_class(package_path):
+			names = sorted(self.members(package_path))
+		else:
+			names = self.children(package_path)
+		prefix = package_path + '.' if package_path else ''
+		return [prefix + name for name in names if name.startswith(partial)]
+
+
+	def members(self, class_path):
+		"""
+		Public members of the class, as {name: signature}.
+		Resolved on first request (and remembered).
+		"""
+		try:
+			return self._members[class_path]
+		except KeyError:
+			pass
+
+		members = {}
+		try:
+			java_class = Class.forName(class_path, False, Thread.currentThread().getContextClassLoader())
+		except (Exception, JavaException) as error:
+			return members # not loadable from here
+
+		for field in java_class.getFields():
+			members[field.getName()] = '%s%s %s' % (
+				'static ' if Modifier.isStatic(field.getModifiers()) else '',
+				field.getType().getSimpleName(), field.getName())
+
+		for method in java_class.getMethods():
+			signature = '%s%s %s(%s)' % (
+				'static ' if Modifier.isStatic(method.getModifiers()) else '',
+				method.getReturnType().getSimpleName(), method.getName(),
+				', '.join(parameter.getSimpleName() for parameter in method.getParameterTypes()))
+			if method.getName() in members:
+				# overloads
+				members[method.getName()] += '\n' + signature
+			else:
+				members[method.getName()] = signature
+
+		self._members[class_path] = members
+		return members
+
+	def __repr__(self):
+		return '<JavaClassIndex %d packages%s>' % (len(self.packages), ' (building)' if self._building else '')
+
+
+
+_JAVA_CLASS_INDEX = JavaClassIndex()
+
+
+def java_class_index():
+	"""The shared index (which may still be loading)."""
+	return _JAVA_CLASS_INDEX
+
+
+@async(name='Jupyter-JavaClassIndex-refresh')
+def refresh_java_class_index():
+	_JAVA_CLASS_INDEX.refresh()
@@ -16,6 +16,11 @@ logger = shared.tools.jupyter.logging.Logger()
 
 
 import re
+from bisect import bisect_left, insort
+from threading import RLock
+from weakref import WeakKeyDictionary
+
+from shared.tools.meta import isJavaObject
 
 
 def get_identifier_at_cursor(code_text, cursor_pos,
@@ -96,6 +101,35 @@ def get_object_from_identifier(object_identifier, global_scope=None, local_scope
 		return obj_root, ''
 
 
+# Java class: its instances' sorted dir() listing
+_JAVA_ATTRIBUTE_LISTINGS = WeakKeyDictionary()
+
+
+def attribute_listing_of(thing):
+	"""
+	Sorted dir() of the thing.
+	
+	dir() is slow on Java objects, and all instances of a Java class have the same 
+	attributes, so those are cached by class. (Reloading a class makes a new one,
+	so it won't get a stale listing.)
+	"""
+	if isinstance(thing, type) or not isJavaObject(thing):
+		return sorted(dir(thing))
+	thing_type = type(thing)
+	try:
+		return _JAVA_ATTRIBUTE_LISTINGS[thing_type]
+	except KeyError:
+		pass
+	except TypeError:
+		return sorted(dir(thing)) # can't be weakly referenced
+	listing = sorted(dir(thing))
+	try:
+		_JAVA_ATTRIBUTE_LISTINGS[thing_type] = listing
+	except TypeError:
+		pass
+	return listing
+
+
 def gather_reordered_attributes(thing, 
 		include_private=False, 
 		include_dunders=True, 
@@ -107,7 +141,7 @@ def gather_reordered_attributes(thing,
 	privates = []
 	
 	try:
-		attribute_listing = sorted(dir(thing))
+		attribute_listing = attribute_listing_of(thing)
 	except Exception as error:
 		try:
 			logger.warn('Object %(thing)r for attribute request is broken; could not dir() it!')
@@ -138,14 +172,103 @@ def gather_reordered_attributes(thing,
 	return attributes
 
 
+def scope_names(scope, load=True):
+	"""
+	All the names in scope, including any that are only loaded on lookup.
+	If not load, only what's been loaded so far.
+	"""
+	if scope is None:
+		return set()
+	try:
+		if load:
+			return scope.available_names()
+		else:
+			return scope.loaded_names()
+	except AttributeError:
+		return set(scope)
+
+
+
+class NamePrefixIndex(object):
+	"""
+	Names kept sorted, so those starting with a prefix are a bisect away.
+	
+	Updated from a snapshot of the names in scope: only what was added or
+	removed since the last snapshot is touched. Or revised for just the names
+	that could have changed, without a snapshot at all.
+	"""
+	__slots__ = ['_names', '_sorted', '_lock']
+	
+	def __init__(self, names=None):
+		self._names = set()
+		self._sorted = []
+		self._lock = RLock()
+		if names:
+			self.update(names)
+	
+	def update(self, names):
+		"""Make the index match the names given."""
+		names = set(name for name in names if isinstance(name, basestring))
+		with self._lock:
+			added = names - self._names
+			removed = self._names - names
+			if not (added or removed):
+				return
+			if len(added) + len(removed) > len(self._sorted) // 4:
+				self._sorted = sorted(names)
+			else:
+				for name in removed:
+					del self._sorted[bisect_left(self._sorted, name)]
+				for name in added:
+					insort(self._sorted, name)
+			self._names = names
+	
+	def revise(self, names, in_scope):
+		"""Re-check just the names given, keeping those in_scope(name) and dropping the rest."""
+		with self._lock:
+			for name in names:
+				if not isinstance(name, basestring):
+					continue
+				if in_scope(name):
+					if name not in self._names:
+						self._names.add(name)
+						insort(self._sorted, name)
+				elif name in self._names:
+					self._names.discard(name)
+					del self._sorted[bisect_left(self._sorted, name)]
+	
+	def matching(self, prefix):
+		"""Names starting with the prefix, sorted."""
+		with self._lock:
+			start = bisect_left(self._sorted, prefix)
+			end = start
+			while end < len(self._sorted) and self._sorted[end].startswith(prefix):
+				end += 1
+			return self._sorted[start:end]
+	
+	def __contains__(self, name):
+		return name in self._names
+	
+	def __len__(self):
+		return len(self._sorted)
+	
+	def __repr__(self):
+		return '<NamePrefixIndex %d names>' % (len(self._sorted),)
+
+
+
 def match_references(object_identifier, 
 		global_scope=None, local_scope=None,
 		return_keys_if_dict=False,
+		name_index=None,
 	):
 	"""
 	Return things that might fill out the identifier (if incomplete) given the scopes.
 	
 	If given a complete identifier, it will provide the next available options
+	
+	If given a name_index (a NamePrefixIndex of the scopes' names), names are
+	matched against that instead of gathering and filtering everything in scope.
 	"""
 	try:
 		obj_root, unmatched_identifier_remainder = get_object_from_identifier(
@@ -153,11 +276,13 @@ def match_references(object_identifier,
 									global_scope, local_scope, 
 									potentially_incomplete_chain=True)
 	except NameError as error: # find closest simple match
+		if name_index is not None:
+			return name_index.matching(object_identifier)
 		return sorted([
 			identifier 
 			for identifier 
 			in sorted(
-				set(global_scope) | set(local_scope)
+				scope_names(global_scope) | scope_names(local_scope)
 			)
 			if identifier.startswith(object_identifier)
 		])
@@ -187,4 +312,34 @@ def match_references(object_identifier,
 				matched_identifier + '.' + attribute
 				for attribute
 				in gather_reordered_attributes(obj_root)
-			]
\ No newline at end of file
+			]
+
+
+
+def _run_tests():
+	from shared.tools.jupyter.execution.coding import NamePrefixIndex, attribute_listing_of
+	from java.util import ArrayList
+	
+	index = NamePrefixIndex(['alpha', 'beta', 'alphabet', 'gamma'])
+	assert index.matching('alph') == ['alpha', 'alphabet']
+	assert index.matching('') == ['alpha', 'alphabet', 'beta', 'gamma']
+	
+	index.update(['alpha', 'beta', 'gamma', 'alpine'] + ['x%d' % ix for ix in range(20)])
+	assert index.matching('al') == ['alpha', 'alpine']
+	index.update(['alpha', 'beta', 'gamma', 'alpine'] + ['x%d' % ix for ix in range(19)])
+	assert 'x19' not in index and index.matching('x19') == []
+	
+	listing = attribute_listing_of(ArrayList())
+	assert 'add' in listing
+	assert attribute_listing_of(ArrayList()) is listing, 'Java listings should be cached by class'
+	
+	# only the names given are re-checked
+	index.revise(['alpine', 'delta', 'epsilon'], lambda name: name != 'alpine')
+	assert index.matching('al') == ['alpha'] and index.matching('d') == ['delta']
+	assert 'epsilon' in index and 'beta' in index
+	
+	from shared.tools.jupyter.execution.run import scope_bindings
+	import ast
+	names, global_names = scope_bindings(ast.parse('import os.path\nx, y = 1, 2\ndef f():\n\tglobal z\n\tz = 3\ndel w'))
+	assert set(['os', 'x', 'y', 'f', 'z', 'w']) <= names and global_names == set(['z'])
+	assert scope_bindings(ast.parse('from os import *')) is None
@@ -6,12 +6,17 @@
 logger = shared.tools.jupyter.logging.Logger()
 
 
-from shared.tools.jupyter.execution.results import ExecutionResults, ResultHistory
-from shared.tools.jupyter.execution.run import Executor
+from shared.tools.jupyter.execution.results import ExecutionResults, ResultHistory, HistoryStore
+from shared.tools.jupyter.execution.run import Executor, CompileCache
+from shared.tools.jupyter.catch import *
+from shared.tools.jupyter.execution.coding import NamePrefixIndex, scope_names
 from shared.tools.jupyter.execution.priming import ScopeMixin
+from shared.tools.jupyter.execution.background import BackgroundTasks
+from shared.tools.jupyter.execution.magics import Magics, MAGICS_NAME
 
 
 from uuid import uuid4
+import sys
 from org.python.core import Py
 from java.lang import Thread
 
@@ -24,9 +29,17 @@ class ExecutionContext(ScopeMixin):
 		'execution_count', 
 		'history',
 		'python_state_locals', 'python_state_globals',
+		'_name_index', '_name_index_loaded', # names in scope, for completion
+		'_declared_globals', # names functions run here may bind at any time
+		'_expression_cache', # compiled user_expressions
+		'active_executor', # running the current cell (if any)
+		'background_tasks',
+		'magics',
 	]
 	
-	def __init__(self, kernel, locals_dict=None, globals_dict=None, *args, **kwargs):
+	USER_EXPRESSION_FILENAME = '<Jupyter user expression>'
+	
+	def __init__(self, kernel, locals_dict=None, globals_dict=None, merged_namespace=None, *args, **kwargs):
 		self.kernel = kernel
 		self.id = str(uuid4())
 		
@@ -34,12 +47,39 @@ class ExecutionContext(ScopeMixin):
 		
 		self.execution_count = 0
 		
-		self.python_state_locals = locals_dict or {}
+		if merged_namespace is None:
+			merged_namespace = getattr(kernel, 'merged_namespace', True)
+		
 		self.python_state_globals = globals_dict or {}
+		if locals_dict is None and merged_namespace:
+			# run like a module: what's set at the top level is simply global
+			self.python_state_locals = self.python_state_globals
+		else:
+			# a copy, since the executor empties the locals after each statement
+			self.python_state_locals = dict(locals_dict or {})
+		
+		self.history = HistoryStore.for_session(self.id,
+			spill_folder=getattr(kernel, 'history_folder', None),
+			max_entries=getattr(kernel, 'history_max_entries', None),
+			max_bytes=getattr(kernel, 'history_max_bytes', None),
+		)
 		
-		self.history = {}
+		self.active_executor = None
+		self.background_tasks = BackgroundTasks(self)
 		
 		super(ExecutionContext, self).__init__(*args, **kwargs)
+		
+		# line magics are rewritten into calls on this
+		self.magics = Magics(self)
+		self.python_state_globals[MAGICS_NAME] = self.magics
+		
+		self._name_index = NamePrefixIndex()
+		self._name_index_loaded = False
+		self._declared_globals = set()
+		self.refresh_name_index()
+		
+		# kept apart from the cells' cache: expressions compile in eval mode
+		self._expression_cache = CompileCache(size=getattr(kernel, 'compile_cache_size', None) or 256)
 	
 	
 	@property
@@ -58,31 +98,117 @@ class ExecutionContext(ScopeMixin):
 		# ... but don't do that. That's just... I'm not even sure what that'd look like in theory.
 		return Py.getThreadState().systemState
 	
+	@property
+	def merged_namespace(self):
+		return self.python_state_locals is self.python_state_globals
+	
 	@property
 	def _context(self):
 		return {
 			'captured_sys': self._context_sys, 
 			'global_context': self.python_state_globals,
 			'local_context': self.python_state_locals,
+			'compile_cache': getattr(self.kernel, 'compile_cache', None),
+			'magics': self.magics,
 			# show where the next execution goes
 			'execution_location': '<Jupyter In[%d]>' % (self.execution_count + 1,),
 		}
 	
+	def refresh_name_index(self, load=False):
+		"""
+		Bring the index of names in scope up to date. 
+		Scope that's only loaded on lookup is only included if loaded (or load is set).
+		"""
+		names = scope_names(self.python_state_globals, load)
+		if not self.merged_namespace:
+			names |= scope_names(self.python_state_locals, load)
+		self._name_index.update(names)
+	
+	def update_name_index(self, bindings):
+		"""
+		Re-check only the names an execution may have bound (see run.scope_bindings),
+		along with any that functions declared global. If that isn't known (magics,
+		star imports and such), everything's rescanned instead.
+		"""
+		if bindings is None:
+			self.refresh_name_index()
+			return
+		names, global_names = bindings
+		self._declared_globals.update(global_names)
+		self._name_index.revise(names | self._declared_globals, self._in_scope)
+	
+	def _in_scope(self, name):
+		if name in self.python_state_globals:
+			return True
+		return not self.merged_namespace and name in self.python_state_locals
+	
+	@property
+	def name_index(self):
+		"""Names in scope, for completion. (The first use loads any lazy scope.)"""
+		if not self._name_index_loaded:
+			self.refresh_name_index(load=True)
+			self._name_index_loaded = True
+		return self._name_index
+	
 	def destroy(self):
+		self.background_tasks.cancel_all()
 		self.python_state_locals.clear()
 		self.python_state_globals.clear()
+		self.history.close()
 	
 	def __bool__(self):
 		return False # NOP
 
 
-	def execute(self, code, store_history=True, notebook_cell_id=None):
-		with Executor(notebook_cell_id=notebook_cell_id, **self._context) as executor:
-			executor.execute(code)
+	def execute(self, code, store_history=True, notebook_cell_id=None, stream_publisher=None):
+		with Executor(notebook_cell_id=notebook_cell_id, stream_publisher=stream_publisher,
+					  **self._context) as executor:
+			self.active_executor = executor
+			try:
+				executor.execute(code)
+			finally:
+				self.active_executor = None
 		
+		results = ExecutionResults(executor)
 		if store_history:
 			self.execution_count += 1		
-			self.history[self.execution_count] = ExecutionResults(executor)
+			self.history[self.execution_count] = results
+		
+		self.update_name_index(executor.bindings)
+		return results
+	
+	def evaluate_expressions(self, expressions):
+		"""
+		Evaluate the user_expressions of an execute_request in the current scope.
+		
+		Dashboards poll with the same expressions over and over, so each is compiled
+		once (by its text). Results are keyed the same as the expressions given, 
+		formatted like any other mime bundle (or error) in a reply.
+		"""
+		results = {}
+		for key, expression in (expressions or {}).items():
+			try:
+				code = self._expression_cache.get(expression)
+				if code is None:
+					code = compile(expression, self.USER_EXPRESSION_FILENAME, 'eval')
+					self._expression_cache.put(expression, [code])
+				else:
+					code = code[0]
+				value = eval(code, self.python_state_globals, self.python_state_locals)
+				results[key] = {
+					'status': 'ok',
+					'data': {'text/plain': str(shared.tools.pretty.prettify(value))},
+					'metadata': {},
+				}
+			except (Exception, JavaException) as error:
+				exc_type, exception, exc_tb = sys.exc_info()
+				results[key] = {
+					'status': 'error',
+					'ename': getattr(exc_type, '__name__', str(exc_type)),
+					'evalue': str(exception),
+					'traceback': formatted_traceback(exception, exc_tb).splitlines(),
+				}
+		return results
 	
 	def dump_output(self):
 		for i in range(1, self.execution_count):
@@ -1,128 +1,105 @@
 """
 	Interrupt cell execution
-	
-	Safely stop without risk of racing and missing the mark.
-	
-	WIP: This is pretty 
+
+	Stopping a cell is done in escalating steps, so the common case costs nothing:
+
+	 1. The executor's interrupt flag is set, which it checks between statements.
+	 2. Its thread is interrupted, which wakes anything blocked on something
+	    interruptible (sleeps, waits, queries, and such).
+	 3. If it's still running after a grace period (say, stuck in a tight loop in
+	    one statement), a trace is put on the frames of the running cell that
+	    raises KeyboardInterrupt on the next line it runs.
+
+	Cells that aren't interrupted never run traced.
 """
 logger = shared.tools.jupyter.logging.Logger()
 
 
-import functools
+from shared.tools.thread import getThreadFrame
+
 import sys
-from time import sleep
+from threading import Timer
 from java.lang import Thread
 
 
+# ExecutionContext has this hardcoded
+JUPYTER_FILENAME_PREFIX = '<Jupyter '
+
+DEFAULT_GRACE_PERIOD = 0.5 # seconds
+
+
 
 def executing_juypter_code(frame=None):
 	"""Returns true if the current execution stack is called from a Jupyter cell."""
 	if frame is None:
 		frame = sys._getframe()
 	while frame:
-		# ExecutionContext has this hardcoded
-		if frame.f_code.co_filename.startswith('<Jupyter '):
+		if frame.f_code.co_filename.startswith(JUPYTER_FILENAME_PREFIX):
 			return True
 		frame = frame.f_back
 	return False
 
 
-def interdict_and_interrupt(execution_context, timeout_ms=100):
-	
-	logger.warn('Interrupt requested! Checking... %r' % (Thread.currentThread(),))
-	
-	raise NotImplementedError('Remote interrupt not implemented. Kernel restart is required.')
-#	return # NOP
-	
-	ec_sys = execution_context._context_sys
-	
-	# create the block that will hold execution
-	# so long as this dict holds that value, it'll block
-	block_signal = {'block': True}
-	def continue_interdiction(signal=block_signal):
-		return signal.get('block', None)
-	
-	interdictor = functools.partial(trace_interdictor, continue_interdiction, timeout_ms)
-	
-	try:
-		logger.warn('installing interdiction on %r' % (ec_sys,))
-		# e-brake execution to determine if it's safe to interrupt
-		install_interdiction(ec_sys, interdictor)
-	
-		# check if interruption is needed now that execution has safely halted
-		if not executing_juypter_code(ec_sys._getframe()):
-			logger.info('Nothing to interrupt!')
-			return
-
-		# throw interrupt
-		assert execution_context.thread is not Thread.currentThread(), 'Only external threads can request interdiction.'
-		logger.warn('Interrupting: %r' % execution_context.thread)
-#		execution_context.thread.interrupt()
-		
-		# release e-brake and allow execution to resolve the interrupt
-		uninstall_interdiction(ec_sys)
-		block_signal.clear()
-		
-	finally:
-		# failsafe
-		uninstall_interdiction(ec_sys)
-		block_signal.clear()
-
-
-def trace_interdictor(continue_interdiction, timeout_ms, *trace_args, **trace_kwargs):
-	"""
-	Intercept settrace, but only for a limited time.
-	
-	This is done in context of another thread impinging on this one's execution,
-	so there's an assumption of this being a transient intercept.
-	
-	We'll depend on the context managers to complete the job of unwinding and signalling
-	for clean up after release.	
+def interdict_and_interrupt(execution_context, grace_period=None):
 	"""
-	# burn down a fuse
-	for fuse in reversed(range(timeout_ms)):
-		if not continue_interdiction():
-			# while this technically releases trace, note that 
-			# we install across the stack to ensure interception occurs
-			# even if the other thread's stack races us and moves on 
-			# while we install the settrace, so this only releases one frame's.
-			return None
-		sleep(0.001) # sleep for 1 ms
-	# fuse burned down!
-	else:
-		#crash the thread
-		sys.exit()
-
+	Interrupt whatever the execution context is running.
 
-
-def install_interdiction(sys_context, interdictor):
-	"""
-	Install the trace dispatcher to every level of the stack
-	and then set the trace machinery in motion.
-	
-	Taken from metatools' debugger
+	Returns False if there was nothing to interrupt. Escalation (if needed)
+	happens after the grace period on a timer, so this doesn't block.
 	"""
-	frame = sys_context._getframe()
-	while frame:
-		frame.f_trace = interdictor
-		frame = frame.f_back
+	executor = execution_context.active_executor
+	if executor is None or not executor.interrupt():
+		logger.info('Nothing to interrupt!')
+		return False
+
+	assert executor.thread is not Thread.currentThread(), 'Only external threads can request interruption.'
+	logger.warn('Interrupting: %r' % (executor.thread,))
+
+	if grace_period is None:
+		grace_period = DEFAULT_GRACE_PERIOD
+	escalation = Timer(grace_period, escalate_interrupt, args=(executor,))
+	escalation.setDaemon(True)
+	escalation.start()
+	return True
+
+
+def escalate_interrupt(executor):
+	"""If the executor still hasn't stopped, trace it into raising KeyboardInterrupt."""
+	if executor.finished or executor.interrupt_latency is not None:
+		return
+	try:
+		frame = getThreadFrame(executor.thread)
+	except Exception as error:
+		logger.error('Could not get the running frame to interrupt: %r' % (error,))
+		return
+	if frame is None or not executing_juypter_code(frame):
+		return # in Java (or between cells), so nothing a trace could catch
+	logger.warn('Execution did not stop in time; tracing it to a halt.')
+	install_interdiction(frame, executor)
 
-	# Trace is already initialized by this point, and setting
-	#  the frame's trace ensures dispatch will trigger on the
-	#  next line. That dispatch will call sys.settrace as well,
-	#  but strictly from within the target thread.
-	sys_context.settrace(interdictor)
 
+def install_interdiction(frame, executor):
+	"""
+	Trace the cell's frames (and everything it called) so the next line run raises.
 
-def uninstall_interdiction(sys_context):
-	"""Turn off trace and remove the trace dispatcher from every level
-	in the stack.
+	Only the frames from the cell on down are traced, so the executor itself is
+	left alone to handle the interrupt. It fires once: whichever frame runs a
+	line first raises, and the rest are released.
 	"""
-	sys_context.settrace(None)
+	fired = []
+	def interdictor(frame, event, arg, fired=fired, executor=executor):
+		if fired or executor.finished:
+			return None
+		if event == 'line':
+			fired.append(True)
+			raise KeyboardInterrupt('Interrupted by request')
+		return interdictor
+
+	# frames below the outermost cell frame belong to the cell
+	frames = []
+	while frame and executing_juypter_code(frame):
+		frames.append(frame)
+		frame = frame.f_back
 
-	frame = sys_context._getframe()
-	while frame:
-		# clear out any remnants of the previous trace attempt
-		if frame.f_trace:
-			del frame.f_trace
-		frame = frame.f_back
\ No newline at end of file
+	for frame in frames:
+		frame.f_trace = interdictor
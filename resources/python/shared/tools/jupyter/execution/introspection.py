@@ -0,0 +1,225 @@
+"""
+	Describe objects for inspection (Shift-Tab, `obj?` and such).
+
+	Rendering a full pdir() of an object walks every attribute, calling getters
+	and reflecting Java fields, which for something like a Perspective session
+	takes far too long for a tooltip. But most of that is the same for every
+	instance of a class: the signatures, docstrings and what members there are.
+
+	So that's worked out once per class and cached (TypeIntrospection). Only the
+	object's own repr (and any instance attributes) are rendered live. Members
+	are only worked out the first time they're shown, so a plain Shift-Tab
+	never has to walk them.
+
+	Detail level 0 is just the signature and docstring; 1 adds the object's
+	repr and its members.
+"""
+logger = shared.tools.jupyter.logging.Logger()
+
+
+__all__ = ['TypeIntrospection', 'introspect', 'render_inspection']
+
+
+from shared.tools.meta import getFunctionCallSigs
+from shared.tools.jupyter.execution.coding import attribute_listing_of
+
+from types import ModuleType, ClassType
+from weakref import WeakKeyDictionary
+import textwrap
+
+
+# class: TypeIntrospection of its instances
+_INSTANCE_INTROSPECTIONS = WeakKeyDictionary()
+# class: TypeIntrospection of the class itself
+_CLASS_INTROSPECTIONS = WeakKeyDictionary()
+
+
+ELLIPSIS_LIMIT = 120 # characters per line
+REPR_LINE_LIMIT = 20 # lines
+
+
+
+def type_name(thing_type):
+	return str(thing_type)[7:-2].partition('$')[0]
+
+
+def call_signature(thing):
+	try:
+		return getFunctionCallSigs(thing, '\n')
+	except Exception:
+		return None
+
+
+def first_doc_line(thing):
+	try:
+		return ' '.join(thing.__doc__.strip().splitlines()[:1])
+	except Exception:
+		return ''
+
+
+def clean_doc(thing):
+	doc = getattr(thing, '__doc__', None)
+	if not isinstance(doc, basestring) or not doc.strip():
+		return ''
+	lines = doc.strip().splitlines()
+	return '\n'.join([lines[0]] + textwrap.dedent('\n'.join(lines[1:])).splitlines())
+
+
+def ellipsize(text, limit=ELLIPSIS_LIMIT):
+	return text if len(text) <= limit else text[:limit-3] + '...'
+
+
+
+class TypeIntrospection(object):
+	"""
+	What inspection shows that doesn't depend on the particular object.
+
+	Members are (name, type name, signature, first line of the docstring),
+	taken from the class' attributes rather than the instance's, so no getters
+	are called to work it out (and no one instance's attributes end up listed
+	for all of them). They're left as None until load_members.
+	"""
+	__slots__ = ['type_name', 'signature', 'doc', 'members']
+
+	def __init__(self, thing):
+		self.type_name = type_name(type(thing))
+		self.signature = call_signature(thing) if callable(thing) else None
+		self.doc = clean_doc(thing)
+		self.members = None
+
+	def load_members(self, source):
+		"""Work out the members from source (the class, for instances). Only done once."""
+		if self.members is not None:
+			return self.members
+		members = []
+		for name in attribute_listing_of(source):
+			if name.startswith('_'):
+				continue
+			try:
+				member = getattr(source, name)
+			except Exception:
+				members.append((name, '?', '', ''))
+				continue
+			signature = (call_signature(member) or '') if callable(member) else ''
+			members.append((name, type_name(type(member)), signature, first_doc_line(member)))
+		self.members = members
+		return members
+
+	def __repr__(self):
+		if self.members is None:
+			return '<TypeIntrospection %s>' % (self.type_name,)
+		return '<TypeIntrospection %s: %d members>' % (self.type_name, len(self.members))
+
+
+
+def is_instance(thing):
+	"""Instances (as opposed to classes, modules and functions) share their class' introspection."""
+	return not (isinstance(thing, (type, ClassType, ModuleType)) or hasattr(thing, '__name__'))
+
+
+def member_source(thing):
+	"""Where the thing's members are listed from: its class, for instances (old style ones too)."""
+	if is_instance(thing):
+		return getattr(thing, '__class__', type(thing))
+	return thing
+
+
+def _cached(cache, key, factory):
+	try:
+		return cache[key]
+	except KeyError:
+		pass
+	except TypeError:
+		return factory() # not weakly referencable
+	introspection = factory()
+	try:
+		cache[key] = introspection
+	except TypeError:
+		pass
+	return introspection
+
+
+def introspect(thing):
+	"""The (cached, where possible) TypeIntrospection for the thing."""
+	if is_instance(thing):
+		return _cached(_INSTANCE_INTROSPECTIONS, member_source(thing), lambda: TypeIntrospection(thing))
+	if isinstance(thing, (type, ClassType)):
+		return _cached(_CLASS_INTROSPECTIONS, thing, lambda: TypeIntrospection(thing))
+	# modules and functions vary too much to be worth caching (and are quick anyhow)
+	return TypeIntrospection(thing)
+
+
+def render_inspection(thing, name=None, detail_level=0):
+	"""Plain text description of the thing for an inspect_reply."""
+	introspection = introspect(thing)
+
+	out = []
+	if introspection.signature:
+		for signature in introspection.signature.splitlines():
+			out.append('%s%s' % (name or '', signature))
+	else:
+		out.append('%s<%s>' % ((name + ' ') if name else '', introspection.type_name))
+
+	if introspection.doc:
+		out += ['', introspection.doc]
+
+	if not detail_level:
+		return '\n'.join(out)
+
+	# the live bits
+	try:
+		obj_repr = repr(thing).splitlines()
+	except Exception as error:
+		obj_repr = ['<repr failed: %r>' % (error,)]
+	if len(obj_repr) > REPR_LINE_LIMIT:
+		obj_repr = obj_repr[:REPR_LINE_LIMIT] + ['...']
+	out += ['', '-' * 20] + [ellipsize(line) for line in obj_repr] + ['-' * 20]
+
+	members = list(introspection.load_members(member_source(thing)))
+	if is_instance(thing):
+		member_names = set(member[0] for member in members)
+		for attribute, value in sorted(getattr(thing, '__dict__', {}).items()):
+			if attribute.startswith('_') or attribute in member_names:
+				continue
+			members.append((attribute, type_name(type(value)), '', ''))
+		members.sort()
+
+	if members:
+		name_width = max(len(member[0]) for member in members)
+		type_width = max(len(member[1]) for member in members)
+		pattern = '%%-%ds   %%-%ds   %%s' % (name_width, type_width)
+		out.append('')
+		for member_name, member_type, signature, doc in members:
+			detail = (signature.splitlines()[0] if signature else '')
+			if doc:
+				detail = (detail + '  ' + doc) if detail else doc
+			out.append(ellipsize(pattern % (member_name, member_type, detail)).rstrip())
+
+	return '\n'.join(out)
+
+
+
+def _run_tests():
+	from shared.tools.jupyter.execution.introspection import introspect, render_inspection
+	from java.util import ArrayList
+
+	assert introspect(ArrayList()) is introspect(ArrayList()), 'Instances should share their class introspection'
+	brief = render_inspection(ArrayList([1, 2]), 'things')
+	assert 'add' not in brief
+	detailed = render_inspection(ArrayList([1, 2]), 'things', detail_level=1)
+	assert '[1, 2]' in detailed and 'add' in detailed
+	assert any(member[0] == 'add' for member in introspect(ArrayList()).members)
+
+	# one instance's attributes aren't listed for the rest of its class
+	class Thing(object):
+		def method(self):
+			pass
+	first, second = Thing(), Thing()
+	first.only_first = 1
+	second.only_second = 2
+	render_inspection(first, 'first')
+	assert introspect(first).members is None, 'Members should only be worked out when shown'
+	render_inspection(first, 'first', detail_level=1)
+	detailed = render_inspection(second, 'second', detail_level=1)
+	assert 'only_first' not in detailed
+	assert 'only_second' in detailed and 'method' in detailed
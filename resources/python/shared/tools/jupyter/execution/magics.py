@@ -0,0 +1,266 @@
+"""
+	Magic commands, IPython style.
+
+	A cell starting with `%%name args` is handed to the cell magic whole, and
+	lines starting with `%name args` are rewritten into calls to the line magic
+	before the cell is parsed (they're not Python, after all).
+
+		%time  stmt        %%time           run once, and say how long it took
+		%timeit stmt       %%timeit [setup] time over many runs (-n iterations, -r rounds)
+		%prun stmt         %%prun           profile (-s sort column, -l rows shown)
+		                   %%background [name]  run the cell as a background task
+
+	Timing and profiling are done with shared.tools.profile, and the results
+	printed as tables (via shared.tools.pretty.p).
+
+	Code run by magics runs in the session's namespace.
+"""
+logger = shared.tools.jupyter.logging.Logger()
+
+
+__all__ = ['Magics', 'MagicError']
+
+
+from shared.tools.profile import time_it, profile_call, convert_to_human_readable
+from shared.tools.pretty import p
+
+from time import time
+import pstats
+import re
+
+
+CELL_MAGIC_PATTERN = re.compile(r'\A\s*%%(?P<name>\w+)[ \t]*(?P<line>[^\n]*)\n?(?P<cell>.*)\Z', re.S)
+LINE_MAGIC_PATTERN = re.compile(r'^(?P<indent>[ \t]*)%(?P<name>\w+)[ \t]*(?P<line>.*)$', re.M)
+OPTION_PATTERN = re.compile(r'-(?P<flag>[A-Za-z])[ \t]*(?P<value>[^\s]+)')
+
+# how line magics are called once rewritten
+MAGICS_NAME = '__magics__'
+
+
+
+class MagicError(ValueError):
+	"""Magic not found, or used wrong."""
+
+
+
+def render_table(headers, rows):
+	table = system.dataset.toDataSet(list(headers), [list(row) for row in rows])
+	return p(table, directPrint=False)
+
+
+
+class Magics(object):
+	"""
+	The magics available to a session.
+
+	Line magics are methods named `line_<name>` taking the rest of the line,
+	and cell magics `cell_<name>` taking the rest of the first line and the cell.
+	"""
+	__slots__ = ['session']
+
+	MAGICS_FILENAME = '<Jupyter magic>'
+
+	TIMEIT_ITERATIONS = 100
+	TIMEIT_ROUNDS = 3
+	PRUN_SORTING = 'tottime'
+	PRUN_LIMIT = 25 # rows
+
+	def __init__(self, session):
+		self.session = session
+
+
+	# recognizing magics
+
+	@staticmethod
+	def split_cell_magic(code):
+		"""(name, line, cell) if the code is a cell magic, else None."""
+		if not code or '%%' not in code:
+			return None
+		match = CELL_MAGIC_PATTERN.match(code)
+		if not match:
+			return None
+		return match.group('name'), match.group('line').strip(), match.group('cell')
+
+	def transform_line_magics(self, code):
+		"""
+		Rewrite `%name args` lines as calls to the session's line magics.
+		Only known magics are rewritten (a line in a string may well start with %s).
+		"""
+		if not code or '%' not in code:
+			return code
+		def rewrite(match):
+			if not hasattr(self, 'line_' + match.group('name')):
+				return match.group(0)
+			return '%s%s.run_line(%r, %r)' % (
+				match.group('indent'), MAGICS_NAME, match.group('name'), match.group('line').strip())
+		return LINE_MAGIC_PATTERN.sub(rewrite, code)
+
+
+	# dispatch
+
+	def run_line(self, name, line):
+		return self._magic('line', name)(line)
+
+	def run_cell(self, name, line, cell):
+		return self._magic('cell', name)(line, cell)
+
+	def _magic(self, kind, name):
+		try:
+			return getattr(self, '%s_%s' % (kind, name))
+		except AttributeError:
+			raise MagicError('%s magic not found: %s%s' % (kind.capitalize(), '%' if kind == 'line' else '%%', name))
+
+	@property
+	def available(self):
+		return sorted(
+			('%' if attribute.startswith('line_') else '%%') + attribute.partition('_')[2]
+			for attribute in dir(self)
+			if attribute.startswith(('line_', 'cell_'))
+		)
+
+
+	# running code in the session
+
+	def _compile(self, code):
+		"""Compile the code, as an expression if possible (so its value can be kept)."""
+		try:
+			return compile(code, self.MAGICS_FILENAME, 'eval'), True
+		except SyntaxError:
+			return compile(code, self.MAGICS_FILENAME, 'exec'), False
+
+	def _runner(self, code):
+		"""A function that runs the code in the session's namespace (returning its value, if an expression)."""
+		code_object, is_expression = self._compile(code)
+		global_context = self.session.python_state_globals
+		local_context = self.session.python_state_locals
+		if is_expression:
+			def run_code(code_object=code_object):
+				return eval(code_object, global_context, local_context)
+		else:
+			def run_code(code_object=code_object):
+				exec code_object in global_context, local_context
+		return run_code
+
+	@staticmethod
+	def _options(line, flags):
+		"""
+		Split the leading `-x value` options (for the flags given) off the line.
+		The rest is code, so it's returned exactly as written.
+		"""
+		options = {}
+		remainder = line.lstrip()
+		while True:
+			match = OPTION_PATTERN.match(remainder)
+			if not match or match.group('flag') not in flags:
+				return options, remainder
+			options['-' + match.group('flag')] = match.group('value')
+			remainder = remainder[match.end():].lstrip()
+
+	@staticmethod
+	def _int_option(options, flag, default):
+		try:
+			return int(options.get(flag, default))
+		except ValueError:
+			raise MagicError('Option %s takes a number, not %r' % (flag, options[flag]))
+
+
+	# %time
+
+	def line_time(self, line):
+		return self.cell_time('', line)
+
+	def cell_time(self, line, cell):
+		run_code = self._runner(cell)
+		start = time()
+		try:
+			return run_code()
+		finally:
+			print 'Wall time: %s' % (convert_to_human_readable(time() - start),)
+
+
+	# %timeit
+
+	def line_timeit(self, line):
+		options, statement = self._options(line, 'nr')
+		return self._timeit(statement, 'pass', options)
+
+	def cell_timeit(self, line, cell):
+		options, setup = self._options(line, 'nr')
+		return self._timeit(cell, setup or 'pass', options)
+
+	def _timeit(self, statement, setup, options):
+		iterations = self._int_option(options, '-n', self.TIMEIT_ITERATIONS)
+		rounds = self._int_option(options, '-r', self.TIMEIT_ROUNDS)
+
+		results = time_it(self._runner(statement), self._runner(setup), iterations, rounds)
+
+		rows = []
+		for key in ('statement avg', 'est statement std dev', 'round avg', 'round std dev'):
+			if results.get(key) is not None:
+				rows.append([key, convert_to_human_readable(results[key])])
+		rows.append(['iterations per round', str(iterations)])
+		rows.append(['rounds', str(rounds)])
+		print render_table(['timeit', 'value'], rows)
+
+
+	# %prun
+
+	def line_prun(self, line):
+		options, statement = self._options(line, 'sl')
+		return self._prun(statement, options)
+
+	def cell_prun(self, line, cell):
+		options, _ = self._options(line, 'sl')
+		return self._prun(cell, options)
+
+	def _prun(self, code, options):
+		sorting = options.get('-s', self.PRUN_SORTING)
+		limit = self._int_option(options, '-l', self.PRUN_LIMIT)
+
+		profiler, result = profile_call(self._runner(code))
+
+		stats = pstats.Stats(profiler)
+		stats.sort_stats(sorting)
+		rows = []
+		for function in stats.fcn_list[:limit]:
+			primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[function]
+			filename, line_number, function_name = function
+			rows.append([
+				str(calls) if calls == primitive_calls else '%d/%d' % (calls, primitive_calls),
+				convert_to_human_readable(total_time),
+				convert_to_human_readable(total_time / calls if calls else 0.0),
+				convert_to_human_readable(cumulative_time),
+				'%s:%d(%s)' % (filename, line_number, function_name),
+			])
+		print '%d calls in %s' % (stats.total_calls, convert_to_human_readable(stats.total_tt))
+		print render_table(['ncalls', 'tottime', 'percall', 'cumtime', 'function'], rows)
+		return result
+
+
+	# %%background
+
+	def cell_background(self, line, cell):
+		"""Run the cell as a background task. If a name's given, the task's put in scope by it."""
+		task = self.session.background_tasks(cell)
+		if line:
+			self.session.python_state_globals[line] = task
+		return task
+
+
+
+def _run_tests():
+	from shared.tools.jupyter.execution.magics import Magics
+
+	assert Magics.split_cell_magic('%%timeit -n 5\nx = 1\n') == ('timeit', '-n 5', 'x = 1\n')
+	assert Magics.split_cell_magic('x = 1 %% 2') is None
+
+	magics = Magics(None)
+	transformed = magics.transform_line_magics('for i in range(3):\n\t%time sum(range(i))\ny = 10 % 3')
+	assert transformed == "for i in range(3):\n\t__magics__.run_line('time', 'sum(range(i))')\ny = 10 % 3"
+	assert magics.transform_line_magics('%s = 1') == '%s = 1', 'Only known magics are rewritten'
+
+	# options come off the front, and the code is left as written
+	assert Magics._options('-n 10 d["a"] + 1', 'nr') == ({'-n': '10'}, 'd["a"] + 1')
+	assert Magics._options('-n10 -r 2 print \'it\\\'s\'', 'nr') == ({'-n': '10', '-r': '2'}, "print 'it\\'s'")
+	assert Magics._options('f("x  y")', 'sl') == ({}, 'f("x  y")')
+	assert Magics._options('-x + 1', 'nr') == ({}, '-x + 1')
@@ -20,6 +20,101 @@ logger = shared.tools.jupyter.logging.Logger()
 
 from shared.tools.jupyter.execution.results import ResultHistory
 
+from threading import Lock
+import __builtin__
+
+
+# names that are never project scripts, so misses on them shouldn't load anything
+# (every builtin lookup checks globals first)
+UNRESOLVED_NAMES = frozenset(dir(__builtin__))
+
+
+
+class LazyProjectGlobals(dict):
+	"""
+	Globals for the execution context that pull in project scripts on demand.
+	
+	Creating a project's locals map (and copying it all into scope) is the 
+	bulk of starting a session. Instead, the project is only loaded the first
+	time a name isn't found, and then only the names actually used are
+	cached into the globals themselves.
+	
+	Jython consults an overridden __getitem__ for global lookups in exec'd 
+	code, which is what makes this work. Builtins and dunder names are 
+	skipped without loading anything.
+	"""
+	__slots__ = ['_project_loaders', '_project_scopes', '_load_lock']
+	
+	def __init__(self, initial=None):
+		super(LazyProjectGlobals, self).__init__(initial or {})
+		self._project_loaders = [] # callables that return a project's locals map
+		self._project_scopes = []
+		self._load_lock = Lock()
+	
+	def add_project(self, loader):
+		self._project_loaders.append(loader)
+	
+	def _load_projects(self):
+		if not self._project_loaders:
+			return
+		with self._load_lock:
+			for loader in list(self._project_loaders):
+				try:
+					scope = loader()
+				except Exception as error:
+					# kept, so the next miss tries again
+					logger.error('Could not load project scope from %r: %r' % (loader, error,))
+					continue
+				self._project_loaders.remove(loader)
+				self._project_scopes.append(scope)
+	
+	def __getitem__(self, name):
+		try:
+			return dict.__getitem__(self, name)
+		except KeyError:
+			return self.__missing__(name)
+	
+	def __missing__(self, name):
+		if (not isinstance(name, basestring) 
+			or name in UNRESOLVED_NAMES or name.startswith('__')):
+			raise KeyError(name)
+		self._load_projects()
+		for scope in self._project_scopes:
+			try:
+				value = scope[name]
+			except KeyError:
+				continue
+			dict.__setitem__(self, name, value)
+			return value
+		raise KeyError(name)
+	
+	def get(self, name, default=None):
+		try:
+			return self[name]
+		except KeyError:
+			return default
+	
+	def __contains__(self, name):
+		"""Checks what's loaded already, without loading any projects."""
+		if dict.__contains__(self, name):
+			return True
+		return any(name in scope for scope in self._project_scopes)
+	
+	def loaded_names(self):
+		"""Everything that can be looked up without loading any projects."""
+		names = set(self.keys())
+		for scope in self._project_scopes:
+			names.update(scope.keys())
+		return names
+	
+	def available_names(self):
+		"""Everything that could be looked up (loads the projects, so best left to completion and such)."""
+		self._load_projects()
+		names = set(self.keys())
+		for scope in self._project_scopes:
+			names.update(scope.keys())
+		return names
+
 
 
 class ScopeMixin(object):
@@ -38,7 +133,7 @@ class ScopeMixin(object):
 		ec_locals['Out'] = ResultHistory(self, 'display_object')
 	
 	def inject_scope_metatools(self):
-		"""Inject metatools stuff, along with the kernel and Ignition context."""
+		"""Inject metatools stuff, along with the kernel, Ignition context and `background` (see .background)."""
 		ec_locals  = self.python_state_locals
 	
 		# helpful interactive bits
@@ -46,22 +141,36 @@ class ScopeMixin(object):
 		ec_locals['context'] = shared.tools.meta.getIgnitionContext()
 		ec_locals['p'] = shared.tools.pretty.p
 		ec_locals['pdir'] = shared.tools.pretty.pdir
+		ec_locals['background'] = self.background_tasks
 
 	def inject_scope_project(self, project_name):
-		"""Alias the scripts from another project into this kernel's scope."""	
-		ec_globals = self.python_state_globals
+		"""
+		Alias the scripts from another project into this kernel's scope.
 		
-		ignition_context = shared.tools.meta.getIgnitionContext()
+		The project is only actually loaded once a name is looked up that
+		isn't otherwise in scope (see LazyProjectGlobals).
+		"""	
+		ec_globals = self.python_state_globals
+		if not isinstance(ec_globals, LazyProjectGlobals):
+			merged = self.python_state_locals is ec_globals
+			ec_globals = self.python_state_globals = LazyProjectGlobals(ec_globals)
+			if merged:
+				self.python_state_locals = ec_globals
 		
-		try:
-			# first assume gateway scoping
-			project_manager = ignition_context.getProjectManager()
-			script_manager = project_manager.getProjectScriptManager(project_name)
-		except AttributeError:
-			assert project_name == ignition_context.getProjectName()
-			script_manager = ignition_context.getScriptManager()
+		def load_project_scope(project_name=project_name):
+			ignition_context = shared.tools.meta.getIgnitionContext()
+			
+			try:
+				# first assume gateway scoping
+				project_manager = ignition_context.getProjectManager()
+				script_manager = project_manager.getProjectScriptManager(project_name)
+			except AttributeError:
+				assert project_name == ignition_context.getProjectName()
+				script_manager = ignition_context.getScriptManager()
+			
+			return script_manager.createLocalsMap()
 		
-		ec_globals.update(script_manager.createLocalsMap())
+		ec_globals.add_project(load_project_scope)
 
 
 	def __init__(self, 
@@ -76,4 +185,28 @@ class ScopeMixin(object):
 			self.inject_scope_metatools()
 		self.inject_scope_history()
 	
-	
\ No newline at end of file
+	
+
+
+def _run_tests():
+	from shared.tools.jupyter.execution.priming import LazyProjectGlobals
+
+	attempts = []
+	def flaky_loader():
+		attempts.append(True)
+		if len(attempts) == 1:
+			raise IOError('project not ready')
+		return {'project_function': len}
+
+	lazy_globals = LazyProjectGlobals({'x': 1})
+	lazy_globals.add_project(flaky_loader)
+
+	assert 'x' in lazy_globals
+	assert 'project_function' not in lazy_globals, 'Membership checks should not load projects'
+	assert not attempts
+
+	# a failed load is kept and retried on the next miss
+	assert lazy_globals.get('project_function') is None
+	assert lazy_globals['project_function'] is len
+	assert len(attempts) == 2
+	assert 'project_function' in lazy_globals
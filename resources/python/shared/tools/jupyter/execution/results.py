@@ -11,12 +11,30 @@
 	that results of statements can also be retrieved from past executions.
 	Of course, exceptions are also logged, making going back and checking past
 	or erased stacktraces easier.
+
+	Only so much history is kept in memory, though. Past the HistoryStore's
+	limits, the oldest results are written out to a log file (as JSON lines)
+	and their display objects are only held weakly. Looking them up again
+	reads them back from disk, so In[] and Out[] work the same either way.
+
+	The code that was run is also indexed (HistoryIndex) for history requests,
+	so looking up ranges or searching doesn't mean reading everything back.
 """
 logger = shared.tools.jupyter.logging.Logger()
 
 
 from shared.tools.jupyter.catch import *
 
+from collections import OrderedDict
+from threading import RLock
+from bisect import bisect_left, insort
+import fnmatch
+import weakref
+import tempfile
+import json
+import os
+import re
+
 
 
 class ResultHistory(object):
@@ -99,6 +117,22 @@ class ExecutionResults(object):
 	def notebook_cell_id(self):
 		return self._notebook_cell_id
 	
+	@property
+	def text_size(self):
+		"""Roughly how much memory the text of the results take up (in characters)."""
+		return sum(len(text or '') for text in (self.code, self.stdin, self.stdout, self.stderr))
+	
+	def to_record(self):
+		"""The text of the results, as written to the history log."""
+		return {
+			'code': self.code,
+			'stdin': self.stdin,
+			'stdout': self.stdout,
+			'stderr': self.stderr,
+			'traceback': self.formatted_traceback if self.error else None,
+			'cell_id': self.notebook_cell_id,
+		}
+	
 	def __str__(self):
 		output = []
 		if self.stdin:
@@ -127,3 +161,327 @@ class ExecutionResults(object):
 		'>'] if x])
 
 
+
+class SpilledResults(ExecutionResults):
+	"""Results read back from the history log. The error is only its formatted traceback."""
+	__slots__ = ['_traceback_text', '_display_ref']
+	
+	def __init__(self, record, display_ref=None):
+		self._code   = record['code']
+		self._stdin  = record['stdin']
+		self._stdout = record['stdout']
+		self._stderr = record['stderr']
+		self._error  = None
+		self._notebook_cell_id = record['cell_id']
+		self._traceback_text = record['traceback']
+		self._display_ref = display_ref
+	
+	@property
+	def _display_object(self):
+		return self._display_ref() if self._display_ref is not None else None
+	
+	@property
+	def error(self):
+		return self._traceback_text
+	
+	@property
+	def formatted_traceback(self):
+		return self._traceback_text
+
+
+
+class HistoryStore(object):
+	"""
+	Execution results by execution count, keeping only the most recent in memory.
+	
+	Once there are more than max_entries results, or their text adds up to more
+	than max_bytes, the oldest are moved to the log at spill_path. The log is 
+	append-only, and an index of each entry's offset makes reading one back
+	a seek and a readline.
+	"""
+	__slots__ = [
+		'max_entries', 'max_bytes', 'spill_path',
+		'_entries', '_memory_size',
+		'_spilled', '_spill_end', '_display_refs',
+		'index',
+		'_lock',
+	]
+	
+	MAX_ENTRIES = 100
+	MAX_BYTES = 16 << 20 # characters, really
+	SPILL_FOLDER = os.path.join(tempfile.gettempdir(), 'jupyter-history')
+	
+	def __init__(self, spill_path=None, max_entries=None, max_bytes=None):
+		self.max_entries = self.MAX_ENTRIES if max_entries is None else max_entries
+		self.max_bytes = self.MAX_BYTES if max_bytes is None else max_bytes
+		self.spill_path = spill_path
+		
+		self._entries = OrderedDict()
+		self._memory_size = 0
+		self._spilled = {}      # execution count: offset in the log
+		self._spill_end = 0
+		self._display_refs = {} # execution count: weakref to a spilled entry's display object
+		self.index = HistoryIndex()
+		self._lock = RLock()
+	
+	@classmethod
+	def for_session(cls, session_id, spill_folder=None, **limits):
+		spill_folder = spill_folder or cls.SPILL_FOLDER
+		return cls(os.path.join(spill_folder, '%s.jsonl' % (session_id,)), **limits)
+	
+	
+	def __setitem__(self, execution_count, results):
+		with self._lock:
+			if execution_count in self._entries:
+				self._memory_size -= self._entries.pop(execution_count).text_size
+			self._entries[execution_count] = results
+			self._memory_size += results.text_size
+			self.index.add(execution_count, results.code)
+			self._evict()
+	
+	def __getitem__(self, execution_count):
+		with self._lock:
+			try:
+				return self._entries[execution_count]
+			except KeyError:
+				offset = self._spilled[execution_count]
+				display_ref = self._display_refs.get(execution_count)
+			with open(self.spill_path, 'rb') as spill:
+				spill.seek(offset)
+				record = json.loads(spill.readline().decode('utf-8'))
+			return SpilledResults(record, display_ref)
+	
+	def get(self, execution_count, default=None):
+		try:
+			return self[execution_count]
+		except KeyError:
+			return default
+	
+	def __contains__(self, execution_count):
+		return execution_count in self._entries or execution_count in self._spilled
+	
+	def __len__(self):
+		return len(self._entries) + len(self._spilled)
+	
+	def keys(self):
+		with self._lock:
+			return sorted(list(self._spilled) + list(self._entries))
+	
+	def __iter__(self):
+		return iter(self.keys())
+	
+	@property
+	def in_memory(self):
+		return len(self._entries)
+	
+	
+	def _over_limit(self):
+		if len(self._entries) <= 1:
+			return False # always keep the latest
+		return len(self._entries) > self.max_entries or self._memory_size > self.max_bytes
+	
+	def _evict(self):
+		if not self._over_limit():
+			return
+		evicted = []
+		while self._over_limit():
+			execution_count, results = self._entries.popitem(last=False)
+			self._memory_size -= results.text_size
+			evicted.append((execution_count, results))
+		
+		if self.spill_path is None:
+			return # nowhere to put it, so it's simply forgotten
+		
+		spill_folder = os.path.dirname(self.spill_path)
+		if spill_folder and not os.path.exists(spill_folder):
+			os.makedirs(spill_folder)
+		with open(self.spill_path, 'ab') as spill:
+			for execution_count, results in evicted:
+				line = (json.dumps(results.to_record(), separators=(',',':')) + '\n').encode('utf-8')
+				spill.write(line)
+				self._spilled[execution_count] = self._spill_end
+				self._spill_end += len(line)
+				
+				if results.display_object is not None:
+					try:
+						self._display_refs[execution_count] = weakref.ref(results.display_object)
+					except TypeError:
+						pass # can't be weakly referenced, so drop it
+	
+	def close(self):
+		"""Forget everything (but the index), removing the log."""
+		with self._lock:
+			self._entries.clear()
+			self._memory_size = 0
+			self._spilled.clear()
+			self._display_refs.clear()
+			self._spill_end = 0
+			if self.spill_path and os.path.exists(self.spill_path):
+				try:
+					os.remove(self.spill_path)
+				except OSError as error:
+					logger.warn('Could not remove history log %s: %r' % (self.spill_path, error,))
+	
+	def __repr__(self):
+		return '<HistoryStore %d in memory, %d spilled>' % (len(self._entries), len(self._spilled))
+
+
+
+# glob wildcards, as far as splitting out the literal parts of a pattern is concerned
+GLOB_WILDCARDS = re.compile(r'\*|\?|\[[^\]]*\]')
+
+
+class HistoryIndex(object):
+	"""
+	The code run in a session, indexed for history lookups.
+	
+	Entries are kept in execution order, so ranges are a bisect away.
+	Searches (by glob pattern) narrow down candidates first, either by the
+	sorted code (if the pattern starts with literal text) or by the trigrams 
+	of the longest literal part of the pattern. Only the candidates are
+	matched against the full pattern.
+	"""
+	__slots__ = ['session', '_counts', '_code', '_sorted_code', '_trigrams', '_lock']
+	
+	def __init__(self, session=0):
+		self.session = session
+		self._counts = []      # execution counts, ascending
+		self._code = []        # code, by position
+		self._sorted_code = [] # (code, position), sorted
+		self._trigrams = {}    # trigram: positions containing it, ascending
+		self._lock = RLock()
+	
+	def add(self, execution_count, code):
+		with self._lock:
+			if self._counts and execution_count <= self._counts[-1]:
+				return # already indexed
+			code = code or ''
+			position = len(self._counts)
+			self._counts.append(execution_count)
+			self._code.append(code)
+			insort(self._sorted_code, (code, position))
+			for trigram in set(code[ix:ix+3] for ix in xrange(len(code) - 2)):
+				self._trigrams.setdefault(trigram, []).append(position)
+	
+	def __len__(self):
+		return len(self._counts)
+	
+	def _entries(self, positions):
+		return [(self._counts[position], self._code[position]) for position in positions]
+	
+	def tail(self, n):
+		"""The last n entries, as (execution count, code)."""
+		with self._lock:
+			return self._entries(xrange(max(0, len(self._counts) - n), len(self._counts)))
+	
+	def range(self, start=None, stop=None):
+		"""Entries with execution counts from start up to (but not including) stop."""
+		with self._lock:
+			lower = 0 if start is None else bisect_left(self._counts, start)
+			upper = len(self._counts) if stop is None else bisect_left(self._counts, stop)
+			return self._entries(xrange(lower, upper))
+	
+	def _starting_with(self, prefix):
+		positions = []
+		for ix in xrange(bisect_left(self._sorted_code, (prefix,)), len(self._sorted_code)):
+			code, position = self._sorted_code[ix]
+			if not code.startswith(prefix):
+				break
+			positions.append(position)
+		return positions
+	
+	def _containing(self, text):
+		postings = []
+		for ix in xrange(len(text) - 2):
+			posting = self._trigrams.get(text[ix:ix+3])
+			if not posting:
+				return []
+			postings.append(posting)
+		postings.sort(key=len)
+		positions = set(postings[0])
+		for posting in postings[1:]:
+			positions.intersection_update(posting)
+		return positions
+	
+	def search(self, pattern='*', n=None, unique=False):
+		"""
+		The most recent n entries whose code matches the glob pattern, oldest first.
+		If unique, only the latest of any identical entries is included.
+		"""
+		matcher = re.compile(fnmatch.translate(pattern))
+		literals = [literal for literal in GLOB_WILDCARDS.split(pattern) if literal]
+		
+		with self._lock:
+			if literals and pattern.startswith(literals[0]):
+				candidates = self._starting_with(literals[0])
+			elif literals and max(len(literal) for literal in literals) >= 3:
+				candidates = self._containing(max(literals, key=len))
+			else:
+				candidates = xrange(len(self._counts))
+			
+			matches = []
+			seen = set()
+			for position in sorted(candidates, reverse=True):
+				code = self._code[position]
+				if not matcher.match(code):
+					continue
+				if unique:
+					if code in seen:
+						continue
+					seen.add(code)
+				matches.append(position)
+				if n and len(matches) >= n:
+					break
+			matches.reverse()
+			return self._entries(matches)
+	
+	def __repr__(self):
+		return '<HistoryIndex session %d: %d entries>' % (self.session, len(self._counts))
+
+
+
+def _run_tests():
+	from shared.tools.jupyter.execution.results import HistoryStore, HistoryIndex, ExecutionResults
+	
+	class FakeResults(ExecutionResults):
+		__slots__ = []
+		def __init__(self, code, display_object=None):
+			self._code = code
+			self._display_object = display_object
+			self._stdin = self._stderr = ''
+			self._stdout = code.upper()
+			self._error = None
+			self._notebook_cell_id = None
+	
+	class Displayed(object): pass
+	
+	store = HistoryStore.for_session('test-' + os.urandom(4).encode('hex'), max_entries=3, max_bytes=1000)
+	try:
+		kept = Displayed()
+		for ix in range(1, 11):
+			store[ix] = FakeResults(u'x = %d # caf\xe9' % ix, kept if ix == 2 else Displayed())
+		
+		assert store.in_memory == 3 and len(store) == 10
+		assert store.keys() == range(1, 11)
+		assert store[1].code == u'x = 1 # caf\xe9' and store[1].stdout == u'X = 1 # CAF\xc9'
+		assert store[2].display_object is kept, 'held weakly, but still referenced here'
+		assert store[10].code == u'x = 10 # caf\xe9'
+		
+		store[11] = FakeResults('y' * 2000) # over max_bytes alone
+		assert store.in_memory == 1 and store[10].code == u'x = 10 # caf\xe9'
+	finally:
+		store.close()
+	assert not os.path.exists(store.spill_path)
+	
+	index = store.index
+	assert index.range(3, 5) == [(3, u'x = 3 # caf\xe9'), (4, u'x = 4 # caf\xe9')]
+	assert [count for count, _ in index.tail(2)] == [10, 11]
+	
+	index = HistoryIndex()
+	for ix, code in enumerate(['print 1', 'x = 5', 'print x', 'x = 5', 'system.tag.readBlocking(paths)'], start=1):
+		index.add(ix, code)
+	assert [count for count, _ in index.search('print*')] == [1, 3]
+	assert [count for count, _ in index.search('x = *', unique=True)] == [4]
+	assert [count for count, _ in index.search('*tag.read*')] == [5]
+	assert [count for count, _ in index.search('*x*', n=2)] == [3, 4]
+	assert index.search('*nothing like it*') == []
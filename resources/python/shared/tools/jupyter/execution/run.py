@@ -9,6 +9,16 @@
 	context management as well as operating in its own thread isolates these
 	shenanigans safely, though. It's reversible with more than enough layers of
 	safety to keep it in line.
+
+	Compiling is expensive in Jython, so the statements compiled for a cell
+	are kept in a CompileCache (one per kernel). Running the same cell again
+	skips both parsing and compiling.
+	
+	Magics (see .magics) are picked out before any of that: cell magics are
+	run instead of the cell, and line magics rewritten into calls.
+	
+	Interrupts are checked between statements (just a flag, so it costs nothing
+	when there isn't one). See .interruption for when that isn't soon enough.
 """
 logger = shared.tools.jupyter.logging.Logger()
 
@@ -18,13 +28,136 @@ import ast
 
 
 from shared.tools.jupyter.catch import *
+from shared.tools.jupyter.execution.streaming import StreamingWriter
 
 from StringIO import StringIO
+from collections import OrderedDict
+from threading import Lock
+from time import time
+import hashlib
+
+from java.lang import Thread, InterruptedException
 
 
 
 DEFAULT_DISPLAYHOOK = shared.tools.pretty.displayhook
 
+# calls that can bind names without the code spelling them out
+INDIRECT_BINDING_CALLS = frozenset(['globals', 'locals', 'vars', 'execfile'])
+
+
+
+def scope_bindings(tree):
+	"""
+	What the parsed code may bind (or unbind) in the scope it's run in: the
+	names it assigns, defines, imports or deletes, and the names any functions
+	in it declare global (which they may bind whenever they're called).
+	
+	A superset is fine (it's only used to know what to re-check), so nested
+	scopes aren't told apart. Returns None if it can't be told from the code
+	alone, like star imports and exec.
+	"""
+	names = set()
+	global_names = set()
+	for node in ast.walk(tree):
+		if isinstance(node, ast.Name):
+			if not isinstance(node.ctx, ast.Load):
+				names.add(node.id)
+		elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+			names.add(node.name)
+		elif isinstance(node, (ast.Import, ast.ImportFrom)):
+			for alias in node.names:
+				if alias.name == '*':
+					return None
+				names.add(alias.asname or alias.name.partition('.')[0])
+		elif isinstance(node, ast.Global):
+			global_names.update(node.names)
+		elif isinstance(node, ast.Exec):
+			return None
+		elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+			  and node.func.id in INDIRECT_BINDING_CALLS):
+			return None
+	return frozenset(names), frozenset(global_names)
+
+
+
+class CompileCache(object):
+	"""
+	Least recently used cache of compiled cells, keyed by their source digest.
+	
+	Each cell is cached as its code objects, one per top level statement,
+	along with the names it binds (see scope_bindings).
+	
+	The filename is baked into the code objects (and so their tracebacks), so 
+	cells are compiled under a filename of their own source (see cell_filename)
+	rather than whichever In[n] they happened to be run as first. That way the
+	same code is labeled the same every time it's run, cached or not.
+	"""
+	__slots__ = ['size', 'hits', 'misses', '_entries', '_lock']
+	
+	CELL_FILENAME = '<Jupyter cell %s>'
+	
+	def __init__(self, size=256):
+		self.size = size
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict() # digest: (statements, bindings)
+		self._lock = Lock()
+	
+	@staticmethod
+	def digest(code):
+		if isinstance(code, unicode):
+			code = code.encode('utf-8')
+		return hashlib.sha1(code).hexdigest()
+	
+	def cell_filename(self, code):
+		"""The filename the code is compiled under (the same for the same source)."""
+		return self.CELL_FILENAME % (self.digest(code)[:12],)
+	
+	def get(self, code):
+		"""The compiled statements for the code (or None if not cached)."""
+		digest = self.digest(code)
+		with self._lock:
+			try:
+				entry = self._entries.pop(digest)
+			except KeyError:
+				self.misses += 1
+				return None
+			self._entries[digest] = entry # most recently used is last
+			self.hits += 1
+			return entry[0]
+	
+	def bindings(self, code):
+		"""The names the code binds, as cached with its statements (None if unknown)."""
+		with self._lock:
+			entry = self._entries.get(self.digest(code))
+		return entry[1] if entry else None
+	
+	def put(self, code, statements, bindings=None):
+		if self.size <= 0:
+			return
+		digest = self.digest(code)
+		with self._lock:
+			self._entries.pop(digest, None)
+			self._entries[digest] = (tuple(statements), bindings)
+			while len(self._entries) > self.size:
+				self._entries.popitem(last=False)
+	
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+	
+	@property
+	def stats(self):
+		return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'size': self.size}
+	
+	def __len__(self):
+		return len(self._entries)
+	
+	def __repr__(self):
+		return '<CompileCache %d/%d cells, %d hits, %d misses>' % (
+			len(self._entries), self.size, self.hits, self.misses)
+
 
 
 class Executor(object):
@@ -50,8 +183,13 @@ class Executor(object):
 		'interactive', 'continuous_interactive',
 		'filename',
 		'notebook_cell_id',
+		'compile_cache',
+		'magics',
+		'bindings',
 		
-		'_installed', '_done',
+		'thread', 'interrupt_requested', 'interrupt_latency',
+		
+		'_installed', '_done', '_interrupt_lock',
 		
 		'original_stdin',
 		'original_stdout',
@@ -65,6 +203,9 @@ class Executor(object):
 				 interactive=True, continuous_interactive=False,
 				 displayhook=None, execution_location=None,
 				 notebook_cell_id=None, # cell that requested execution
+				 stream_publisher=None, # called with (name, text) as output accumulates
+				 compile_cache=None,
+				 magics=None,
 				 ):
 		self.captured_sys = captured_sys
 		self.local_context = local_context
@@ -80,6 +221,7 @@ class Executor(object):
 		
 		self._installed = False
 		self._done = False
+		self._interrupt_lock = Lock() # finishing and interrupting mustn't interleave
 		
 		self.original_stdin       = None
 		self.original_stdout      = None
@@ -87,11 +229,18 @@ class Executor(object):
 		self.original_displayhook = None
 		
 		self.redirected_stdin  = StringIO()
-		self.redirected_stdout = StringIO()
-		self.redirected_stderr = StringIO()
+		self.redirected_stdout = StreamingWriter('stdout', stream_publisher)
+		self.redirected_stderr = StreamingWriter('stderr', stream_publisher)
 		self.redirected_displayhook = displayhook or DEFAULT_DISPLAYHOOK
 		
 		self.notebook_cell_id = notebook_cell_id
+		self.compile_cache = compile_cache
+		self.magics = magics
+		self.bindings = None # what the code binds in scope (None if unknown)
+		
+		self.thread = None
+		self.interrupt_requested = None # time requested
+		self.interrupt_latency = None   # seconds from request to stopping
 	
 	
 	def isolated_displayhook(self, obj):
@@ -112,13 +261,38 @@ class Executor(object):
 		assert self.installed, 'Execution should be done only when context is managed.'
 		assert self.code is None, 'Executor should not be used more than once'
 		self.code = code
+		self.thread = Thread.currentThread()
 		try:
 			if self.interactive:
 				self.run_interactive()
 			else:
 				self.run_script()
 		finally:
-			self._done = True
+			with self._interrupt_lock:
+				self._done = True
+				if self.interrupt_requested:
+					# don't leave the flag set for whatever this thread blocks on next
+					Thread.interrupted()
+	
+	def interrupt(self):
+		"""
+		Stop at the next statement (or sooner, if blocked on something interruptible).
+		Returns False if already done.
+		"""
+		with self._interrupt_lock:
+			if self._done:
+				return False
+			if not self.interrupt_requested:
+				self.interrupt_requested = time()
+			if self.thread is not None:
+				self.thread.interrupt()
+			return True
+	
+	def _interrupted(self):
+		self.last_error = sys.exc_info()
+		if self.interrupt_requested:
+			self.interrupt_latency = time() - self.interrupt_requested
+			logger.info('Interrupted %s %0.3fs after request' % (self.filename, self.interrupt_latency,))
 	
 	def run_script(self):
 		"""
@@ -146,38 +320,97 @@ class Executor(object):
 		generate results (or not). It's not actually terrible since Python would do
 		most of that anyhow, we're just interrupting the process a smidge. -ish.
 		"""
-		try:
-			ast_tree = ast.parse(self.code)
-		except Exception as error:
-			self.last_error = sys.exc_info()
-			return
+		if self.magics is not None:
+			cell_magic = self.magics.split_cell_magic(self.code)
+			if cell_magic:
+				self.run_cell_magic(*cell_magic)
+				return
 		
-		for node in ast_tree.body:
-			statement = ast.Module()
-			statement.body.append(node)
-			
-			try:
-				statement_code = compile(statement, filename=self.filename, mode='single')
-			except Exception as error:
-				self.last_error = sys.exc_info()
+		statements = None
+		filename = self.filename
+		if self.compile_cache is not None:
+			statements = self.compile_cache.get(self.code)
+			if statements is not None:
+				self.bindings = self.compile_cache.bindings(self.code)
+			filename = self.compile_cache.cell_filename(self.code)
+		if statements is None:
+			code = self.code
+			if self.magics is not None:
+				code = self.magics.transform_line_magics(code)
+			statements = self.compile_statements(code, filename)
+			if code != self.code:
+				self.bindings = None # line magics run code the parse can't see into
+			# only cache what compiled cleanly (errors should be raised fresh)
+			if self.compile_cache is not None and not any(isinstance(s, tuple) for s in statements):
+				self.compile_cache.put(self.code, statements, self.bindings)
+		
+		for statement_code in statements:
+			if isinstance(statement_code, tuple):
+				self.last_error = statement_code
 				return
 			
 			try:
-				if isinstance(statement, ast.Expr):
-					result = eval(statement_code, self.global_context, self.local_context)
-					self.isolated_displayhook(result)
-				else:
-					exec(statement_code, self.global_context, self.local_context)
+				# checkpoint
+				if self.interrupt_requested:
+					raise KeyboardInterrupt('Interrupted by request')
+				
+				exec(statement_code, self.global_context, self.local_context)
 				
 				# clobber global given locals so imports and such carry into function scopes
-				if isinstance(statement, ast.Module):
-					self._sync_local_changes_onto_global()
+				self._sync_local_changes_onto_global()
 				
 			except KeyboardInterrupt as error:
-				self.last_error = sys.exc_info()
+				self._interrupted()
+				break
 			except (Exception, JavaException) as error:
-				self.last_error = sys.exc_info()
+				# blocking Java calls wake from Thread.interrupt with an InterruptedException
+				if self.interrupt_requested and isinstance(error, InterruptedException):
+					self._interrupted()
+				else:
+					self.last_error = sys.exc_info()
 				break # stop processing nodes
+			finally:
+				# a statement boundary is a natural place to get output out
+				self.flush_output()
+	
+	def run_cell_magic(self, name, line, cell):
+		try:
+			self.isolated_displayhook(self.magics.run_cell(name, line, cell))
+		except (Exception, KeyboardInterrupt, JavaException) as error:
+			self.last_error = sys.exc_info()
+		finally:
+			self.flush_output()
+	
+	def compile_statements(self, code=None, filename=None):
+		"""
+		Parse and compile the code, one code object per top level statement.
+		
+		If something fails to compile, the statements before it are still run, 
+		so its exc_info takes its place (and ends the list).
+		
+		What the code binds is kept as the executor's bindings.
+		"""
+		try:
+			ast_tree = ast.parse(self.code if code is None else code)
+		except Exception as error:
+			self.bindings = (frozenset(), frozenset()) # nothing will run
+			return [sys.exc_info()]
+		self.bindings = scope_bindings(ast_tree)
+		
+		statements = []
+		for node in ast_tree.body:
+			statement = ast.Module()
+			statement.body.append(node)
+			try:
+				statements.append(compile(statement, filename=filename or self.filename, mode='single'))
+			except Exception as error:
+				statements.append(sys.exc_info())
+				break
+		return statements
+	
+	def flush_output(self):
+		self.redirected_stdout.flush()
+		self.redirected_stderr.flush()
 	
 	def _sync_local_changes_onto_global(self):
 		"""
@@ -188,9 +421,16 @@ class Executor(object):
 				local to a function without `global`, after all.)
 			As a result, anything executed as though module-level or from the interactive prompt is treated
 			as global. Any local changes clobber global scope in the execution context.	
+		
+		When the locals simply are the globals (the default), there's nothing to do.
+		Otherwise the locals are emptied after each statement, so they only ever hold
+		what the last statement set and only that gets copied over. (ExecutionContext
+		copies any locals it's given, so a caller's own dict is never emptied.)
 		"""
+		if self.local_context is self.global_context or not self.local_context:
+			return
 		self.global_context.update(self.local_context)
-		self.local_context = {}
+		self.local_context.clear()
 		
 	
 	@property
@@ -226,6 +466,10 @@ class Executor(object):
 	
 	
 	def uninstall(self):
+		# anything still pending goes out before the cell is considered done
+		self.redirected_stdout.close()
+		self.redirected_stderr.close()
+		
 		self.captured_sys.stdin       = self.original_stdin
 		self.captured_sys.stdout      = self.original_stdout
 		self.captured_sys.stderr      = self.original_stderr
@@ -0,0 +1,192 @@
+"""
+	Stream output while code runs.
+
+	Instead of collecting all of stdout/stderr and sending it once the cell
+	is done, a StreamingWriter publishes what's been written as it goes. Output
+	is batched up and flushed once enough has accumulated or enough time has
+	passed, so a print in a tight loop doesn't turn into a message per line.
+
+	It's thread-safe, since threads spawned by a cell share its sys.stdout.
+	Those can keep writing after the cell's done, so once closed each write
+	is published right away (there's no timer left to flush it later).
+
+	Only a bounded copy of the output is retained (for the execution history),
+	so printing a few hundred MB won't also hold it all in memory.
+"""
+logger = shared.tools.jupyter.logging.Logger()
+
+
+from threading import RLock, Timer
+from time import time
+
+
+__all__ = ['StreamingWriter']
+
+
+
+class StreamingWriter(object):
+	"""
+	A file-like object that publishes writes in batches.
+
+	The publisher is called with (name, text) for each batch. Batches are
+	flushed when flush_size characters are pending, or flush_interval seconds
+	after the first pending write (whichever is first), or when flushed explicitly.
+
+	Without a publisher, it just retains what was written (up to retain_limit).
+	"""
+	__slots__ = [
+		'name', 'publisher',
+		'flush_size', 'flush_interval', 'retain_limit',
+		'_pending', '_pending_size', '_first_pending',
+		'_retained', '_retained_size', '_truncated',
+		'_timer', '_lock', '_closed',
+		'softspace', # print statement bookkeeping
+	]
+
+	FLUSH_SIZE = 8192       # characters
+	FLUSH_INTERVAL = 0.1    # seconds
+	RETAIN_LIMIT = 1 << 20  # characters
+
+	def __init__(self, name='stdout', publisher=None,
+				 flush_size=None, flush_interval=None, retain_limit=None):
+		self.name = name
+		self.publisher = publisher
+		self.flush_size = flush_size or self.FLUSH_SIZE
+		self.flush_interval = flush_interval or self.FLUSH_INTERVAL
+		self.retain_limit = self.RETAIN_LIMIT if retain_limit is None else retain_limit
+
+		self._lock = RLock()
+		self._pending = []
+		self._pending_size = 0
+		self._first_pending = None
+		self._retained = []
+		self._retained_size = 0
+		self._truncated = 0
+		self._timer = None
+		self._closed = False
+		self.softspace = 0
+
+
+	def write(self, text):
+		if not text:
+			return
+		if not isinstance(text, basestring):
+			text = str(text)
+		with self._lock:
+			self._retain(text)
+			if self.publisher is None:
+				return
+			self._pending.append(text)
+			self._pending_size += len(text)
+			if self._closed or self._pending_size >= self.flush_size:
+				self._flush()
+			elif self._first_pending is None:
+				self._first_pending = time()
+				self._schedule()
+			elif time() - self._first_pending >= self.flush_interval:
+				self._flush()
+
+	def writelines(self, lines):
+		for line in lines:
+			self.write(line)
+
+	def _retain(self, text):
+		room = self.retain_limit - self._retained_size
+		if room >= len(text):
+			self._retained.append(text)
+			self._retained_size += len(text)
+		else:
+			if room > 0:
+				self._retained.append(text[:room])
+				self._retained_size += room
+			self._truncated += len(text) - max(room, 0)
+
+	def _schedule(self):
+		"""Make sure a lull after a write still gets flushed in time."""
+		if self._closed:
+			return
+		self._timer = Timer(self.flush_interval, self.flush)
+		self._timer.daemon = True
+		self._timer.start()
+
+	def _flush(self):
+		if self._timer is not None:
+			self._timer.cancel()
+			self._timer = None
+		self._first_pending = None
+		if not self._pending:
+			return
+		text = ''.join(self._pending)
+		self._pending = []
+		self._pending_size = 0
+		try:
+			self.publisher(self.name, text)
+		except Exception as error:
+			# the cell shouldn't fail just because its output couldn't be sent
+			logger.error('Failed to stream %s: %r' % (self.name, error,))
+
+	def flush(self):
+		# publish under the lock so batches stay in order across threads
+		with self._lock:
+			self._flush()
+
+	def close(self):
+		with self._lock:
+			self._flush()
+			self._closed = True
+
+
+	@property
+	def closed(self):
+		return self._closed
+
+	@property
+	def truncated(self):
+		"""Characters dropped from the retained copy."""
+		return self._truncated
+
+	def getvalue(self):
+		"""The retained output, noting how much was left out (if any)."""
+		with self._lock:
+			value = ''.join(self._retained)
+			if self._truncated:
+				value += '\n[... %d characters truncated ...]\n' % (self._truncated,)
+			return value
+
+	def isatty(self):
+		return False
+
+	def fileno(self):
+		raise IOError('StreamingWriter is not a real file')
+
+	def __repr__(self):
+		return '<StreamingWriter %s%s>' % (self.name, ' (streaming)' if self.publisher else '')
+
+
+
+def _run_tests():
+	from shared.tools.jupyter.execution.streaming import StreamingWriter
+	from time import sleep
+
+	published = []
+	writer = StreamingWriter('stdout', lambda name, text: published.append((name, text)),
+							 flush_size=10, flush_interval=0.05, retain_limit=15)
+
+	writer.write('abc')
+	assert not published
+	writer.write('defghijk')
+	assert published == [('stdout', 'abcdefghijk')]
+
+	writer.write('x')
+	sleep(0.2)
+	assert published[-1] == ('stdout', 'x'), 'timer should flush a lull'
+
+	writer.write('yz12345')
+	writer.close()
+	assert ''.join(text for _, text in published) == 'abcdefghijkxyz12345'
+	assert writer.truncated == 4
+	assert writer.getvalue().startswith('abcdefghijkxyz1\n[... 4 characters')
+
+	# threads the cell started may still write after it's closed
+	writer.write('late')
+	assert published[-1] == ('stdout', 'late')
@@ -53,13 +53,15 @@ def shutdown_request(kernel, message):
 
 @log_message_event
 def interrupt_request(kernel, message):
+	"""
+	Stop the running cell (see .execution.interruption).
 	
+	The reply goes out once the interrupt is requested, not once the cell stops;
+	the cell's execute_reply says when that happened.
+	"""
 	with kernel.control_message('interrupt_reply', message) as reply:
-		
-		# WIP - restart kernel to stop execution v_v -ARG
-		#interdict_and_interrupt(kernel.session)
-		#	pass # not implemented yet
-		#	# kernel.session.interrupt_execution()
+		if kernel.session is not None:
+			interdict_and_interrupt(kernel.session, kernel.interrupt_grace_period)
 		
 		reply.content.status = 'ok'
 
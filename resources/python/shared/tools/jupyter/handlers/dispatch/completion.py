@@ -12,6 +12,44 @@ logger = shared.tools.jupyter.logging.Logger()
 
 from shared.tools.jupyter.logging import log_message_event
 from shared.tools.jupyter.execution.coding import get_identifier_at_cursor, match_references, get_object_from_identifier
+from shared.tools.jupyter.execution.classpath import java_class_index
+
+from org.python.core import PyJavaPackage
+
+import re
+
+
+FROM_IMPORT_PATTERN = re.compile(r'^\s*from\s+([\w.]+)\s+import\s+(?:.*,\s*)?(\w*)$')
+
+
+def match_java_references(code_text, cursor_pos, object_identifier, execution_context):
+	"""
+	Complete Java packages and classes from the class index, if that's what's being typed.
+	Returns None if the identifier isn't (or isn't in) a Java package.
+	"""
+	index = java_class_index()
+	if not index.is_ready:
+		return None
+	
+	# from java.util import Conc...
+	line = code_text[:cursor_pos].rpartition('\n')[2]
+	from_import = FROM_IMPORT_PATTERN.match(line)
+	if from_import and index.is_package(from_import.group(1)):
+		package_path, partial = from_import.groups()
+		return [name for name in index.children(package_path) if name.startswith(partial)]
+	
+	# java.util.conc... (or import java.util.conc...)
+	root = object_identifier.partition('.')[0]
+	if not (root and index.is_package(root)):
+		return None
+	for scope in (execution_context.python_state_locals, execution_context.python_state_globals):
+		try:
+			if not isinstance(scope[root], PyJavaPackage):
+				return None # something else by that name
+			break
+		except KeyError:
+			pass
+	return index.complete(object_identifier)
 
 
 @log_message_event
@@ -28,12 +66,15 @@ def complete_request(kernel, message):
 	
 	object_identifier = get_identifier_at_cursor(code_text, cursor_pos, perfer_key_context=True)
 	
-	name_references = match_references(
-		object_identifier,
-		execution_context.python_state_globals,
-		execution_context.python_state_locals,
-		return_keys_if_dict=True,
-	)
+	name_references = match_java_references(code_text, cursor_pos, object_identifier, execution_context)
+	if name_references is None:
+		name_references = match_references(
+			object_identifier,
+			execution_context.python_state_globals,
+			execution_context.python_state_locals,
+			return_keys_if_dict=True,
+			name_index=execution_context.name_index,
+		)
 	
 	replacement_start = cursor_pos - len(object_identifier)
 	if replacement_start < 0: # pure sanity check...
@@ -21,6 +21,10 @@ def execute_request(kernel, message):
 	https://jupyter-protocol.readthedocs.io/en/latest/messaging.html#execution-results
 
 	It's run in multiple phases, as laid out by the code blocks.
+	
+	Any user_expressions are evaluated after the code (if it ran cleanly) 
+	and returned in the reply. Silent requests still get their reply, they 
+	just don't broadcast anything on IOPub.
 	"""
 	
 	execute_silently = message.content.silent
@@ -38,13 +42,12 @@ def execute_request(kernel, message):
 		with kernel.iopub_message('execute_input', message) as reply:
 			reply.content.execution_count = kernel.session.execution_count + 1
 			reply.content.code = ''
-		with kernel.iopub_message('execute_reply', message) as reply:
-			reply.ids = message.ids
+		with kernel.shell_message('execute_reply', message) as reply:
 			reply.content = {
 				'execution_count': kernel.session.execution_count,
 				'status': 'ok',
 				
-				'user_expressions' :{},
+				'user_expressions': kernel.session.evaluate_expressions(message.content.user_expressions),
 				'payload' : [],
 			}
 		return
@@ -62,30 +65,30 @@ def execute_request(kernel, message):
 			}
 			reply.metadata = message.metadata #.cellId = cell_id
 
-	kernel.session.execute(
+	# stream output back as it's printed (silent execution doesn't broadcast)
+	if execute_silently:
+		stream_publisher = None
+	else:
+		def stream_publisher(name, text, kernel=kernel, message=message):
+			with kernel.iopub_broadcast('stream', message) as reply:
+				reply.content = {
+					'name': name,
+					'text': text,
+				}
+	
+	results = kernel.session.execute(
 		message.content.code, 
 		store_history=store_history,
 		notebook_cell_id=cell_id,
+		stream_publisher=stream_publisher,
 	)
 	
-	# do not broadcast
-	if execute_silently:
-		return
-	
-	# If the execution had STDOUT side effects, broadcast it!
-	if kernel.session[-1].stdout:
-		with kernel.iopub_broadcast('stream', message) as reply:
-			reply.content = {
-		        'name': 'stdout',
-			    'text': kernel.session[-1].stdout,
-			}
-	
-	# reply with the error to STDERR, if there is one
-	if kernel.session[-1].error:
-		exception = kernel.session[-1].error
+	# reply with the error to STDERR, if there is one (silent execution doesn't broadcast)
+	if results.error and not execute_silently:
+		exception = results.error
 		with kernel.iopub_broadcast('stream', message) as reply:
 			reply.content.name = 'stderr'
-			reply.content.text = kernel.session[-1].formatted_traceback
+			reply.content.text = results.formatted_traceback
 	
 		with kernel.iopub_broadcast('error', message) as reply:
 			reply.content = {
@@ -95,27 +98,27 @@ def execute_request(kernel, message):
 			}
 	
 	# reply with the last display object, if any
-	if kernel.session[-1]._ is not None:
+	if results._ is not None and not execute_silently:
 		with kernel.iopub_broadcast('execute_result', message) as reply:
 			reply.content = {
 		        'execution_count': kernel.session.execution_count,
 			    'data': {'text/plain':
-			    	str(shared.tools.pretty.prettify(kernel.session[-1]._))
+			    	str(shared.tools.pretty.prettify(results._))
 			    },
 			    'metadata': {},
 			}
 	
 	with kernel.shell_message('execute_reply', message) as reply:
 		# reply with the results - error if any, otherwise OK
-		if kernel.session[-1].error:
-			traceback_lines = kernel.session[-1].formatted_traceback.splitlines()
+		if results.error:
+			traceback_lines = results.formatted_traceback.splitlines()
 			reply.content = {
 							'execution_count': kernel.session.execution_count,
-							'ename'    :kernel.session[-1].exception_type.__name__,
-							'evalue'   : kernel.session[-1].exception.message,
+							'ename'    :results.exception_type.__name__,
+							'evalue'   : results.exception.message,
 							'traceback': traceback_lines,
 						}
-			if isinstance(kernel.session[-1].exception, KeyboardInterrupt):
+			if isinstance(results.exception, KeyboardInterrupt):
 				# TODO: so this doesn't actually stop "RUN ALL CELLS" =/
 				reply.content.status = 'abort'
 			else:
@@ -127,7 +130,7 @@ def execute_request(kernel, message):
 				
             	"started": kernel.now,
 				
-				'user_expressions' :{},  # TODO: support user_expressions
+				'user_expressions': kernel.session.evaluate_expressions(message.content.user_expressions),
 				'payload' : [],          # TODO: support payloads, like for pagers
 			}
 
@@ -1,50 +1,88 @@
 """
 	Execution history lookup
-	
-	TODO: history lookup.
 
-	Note that the IPython-style In[x] and Out[x] variables are available,
-	so there's not a very strong need for this yet. Add that kernel.session
-	has a full record of everything it has run, and this is a low priority
-	feature.
+	https://jupyter-protocol.readthedocs.io/en/latest/messaging.html#history
+
+	Lookups go against each session's HistoryIndex (see execution.results),
+	not the results themselves, so only the output (if asked for) is read
+	from the session's history.
+
+	Sessions are numbered as the kernel starts them. Session 0 is the current
+	one, and negative numbers count back through the kernel's past sessions
+	(only their code is kept, so their output is always None).
+
+	Note that the IPython-style In[x] and Out[x] variables are also available.
 """
 
 logger = shared.tools.jupyter.logging.Logger()
 
 from shared.tools.jupyter.logging import log_message_event
 
+
+
+def resolve_history_index(kernel, session):
+	"""The HistoryIndex for the requested session, if it's still around."""
+	current = kernel.session.history.index
+	if not session or session == current.session:
+		return current
+	past = list(kernel.past_histories)
+	if session < 0:
+		try:
+			return past[session]
+		except IndexError:
+			return None
+	for index in past:
+		if index.session == session:
+			return index
+	return None
+
+
+def format_output(kernel, index, execution_count):
+	if index is not kernel.session.history.index:
+		return None
+	results = kernel.session.history.get(execution_count)
+	if results is None or results.display_object is None:
+		return None
+	return repr(results.display_object)
+
+
+@log_message_event
 def history_request(kernel, message):
-	raise NotImplementedError
-
-
-
-#
-#def history_request(kernel, message):
-#	
-#	
-#	
-#	
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#
-#HISTORY_DISPATCH = {
-#	'comm_msg': comm_msg,
-#	'comm_open': comm_open,
-#	'comm_close': comm_close,
-#	'comm_info_request': comm_info_request,
-#	'comm_info_reply': comm_info_reply,
-#}
\ No newline at end of file
+	content = message.content
+
+	access_type = content.hist_access_type
+	include_output = bool(content.get('output'))
+
+	index = resolve_history_index(kernel, content.get('session') or 0)
+
+	entries = []
+	if index is not None:
+		if access_type == 'tail':
+			entries = index.tail(content.get('n') or 10)
+		elif access_type == 'range':
+			entries = index.range(content.get('start') or None, content.get('stop') or None)
+		elif access_type == 'search':
+			entries = index.search(content.get('pattern') or '*',
+								   n=content.get('n') or None,
+								   unique=bool(content.get('unique')))
+		else:
+			logger.warn('Unknown history access type: %r' % (access_type,))
+
+	if include_output:
+		history = [(index.session, execution_count, (code, format_output(kernel, index, execution_count)))
+				   for execution_count, code in entries]
+	else:
+		history = [(index.session, execution_count, code)
+				   for execution_count, code in entries]
+
+	with kernel.shell_message('history_reply', message) as reply:
+		reply.content = {
+			'status': 'ok',
+			'history': history,
+		}
+
+
+
+HISTORY_DISPATCH = {
+	'history_request': history_request,
+}
@@ -15,39 +15,45 @@ logger = shared.tools.jupyter.logging.Logger()
 
 from shared.tools.jupyter.logging import log_message_event
 
-from shared.tools.pretty import pdir
-
-from shared.tools.jupyter.execution.coding import get_object_from_cursor, get_identifier_at_cursor
+from shared.tools.jupyter.execution.coding import get_object_from_identifier, get_identifier_at_cursor
+from shared.tools.jupyter.execution.introspection import render_inspection
 
 
 @log_message_event
 def inspect_request(kernel, message):
-	"""Object reference info"""
+	"""
+	Object reference info
+	
+	Detail level 0 (Shift-Tab, `obj?`) is just the signature and docstring;
+	1 (`obj??`) adds the object's repr and members.
+	"""
 	code_text = message.content.code
 	cursor_pos = message.content.cursor_pos
 	
-	detail_level = message.content.detail_level
+	detail_level = message.content.detail_level or 0
 	
 	obj_data = {}
 	obj_metadata = {}
 	
 	execution_context = kernel.session
 	
-	obj = None
+	identifier = get_identifier_at_cursor(code_text, cursor_pos, prefer_calling_context=True)
+	found = False
 	try:
-		obj, identifier_remainder = get_object_from_cursor(
-				code_text, cursor_pos,
+		obj, identifier_remainder = get_object_from_identifier(
+				identifier,
 				execution_context.python_state_globals,
 				execution_context.python_state_locals,
-				prefer_calling_context=True,
 			)
-		obj_data['text/plain'] = pdir(obj, directPrint=False)
+		# static parts are cached per class, so only the repr is worked out fresh
+		obj_data['text/plain'] = render_inspection(obj, identifier, detail_level)
+		found = True
 		
 	except (NameError, AttributeError) as error:
 		pass # not found
 	
 	with kernel.shell_message('inspect_reply', message) as reply:
-		if obj:
+		if found:
 			reply.content = {
 				'status': 'ok',
 				
@@ -56,8 +62,7 @@ def inspect_request(kernel, message):
 				'metadata': obj_metadata,		
 			}
 		else:
-			failed_identifier = get_identifier_at_cursor(code_text, cursor_pos)
-			logger.trace('Object not found: %(failed_identifier)r')
+			logger.trace('Object not found: %(identifier)r')
 			reply.content = {
 				'status': 'ok',
 				
@@ -17,6 +17,7 @@ from shared.tools.jupyter.handlers.dispatch.kernel import KERNEL_DISPATCH
 from shared.tools.jupyter.handlers.dispatch.execution import EXECUTION_DISPATCH
 from shared.tools.jupyter.handlers.dispatch.completion import COMPLETION_DISPATCH
 from shared.tools.jupyter.handlers.dispatch.inspection import INSPECTION_DISPATCH
+from shared.tools.jupyter.handlers.dispatch.history import HISTORY_DISPATCH
 
 
 SHELL_DISPATCH = {}
@@ -26,6 +27,7 @@ SHELL_DISPATCH.update(COMMS_DISPATCH)
 SHELL_DISPATCH.update(EXECUTION_DISPATCH)
 SHELL_DISPATCH.update(COMPLETION_DISPATCH)
 SHELL_DISPATCH.update(INSPECTION_DISPATCH)
+SHELL_DISPATCH.update(HISTORY_DISPATCH)
 
 
 
@@ -51,16 +53,25 @@ def live_load_dispatch():
 
 
 
+# run in order on the kernel's execution worker, so the rest of shell stays responsive
+WORKER_MESSAGE_TYPES = frozenset(EXECUTION_DISPATCH)
+
+
 def message_handler(kernel, message):
 	
 	logger.trace('[Dispatch] [%s]' % (message.header.msg_type,))
 	
-	(
+	handler = (
 		live_load_dispatch() if kernel.live_reload else SHELL_DISPATCH
 	).get(
 		message.header.msg_type, 
 		not_implemented_message_type
-	)(kernel, message)
+	)
+	
+	if message.header.msg_type in WORKER_MESSAGE_TYPES:
+		return kernel.defer_to_worker(handler, message)
+	
+	handler(kernel, message)
 
 
 
@@ -11,6 +11,7 @@
 logger = shared.tools.jupyter.logging.Logger()
 
 from shared.tools.jupyter.core import JupyterKernel, spawn_kernel
+from shared.tools.jupyter.pool import adopt_pooled_kernel, refill_pool
 
 from shared.tools.jupyter.handlers.web.core import SimpleREST, rest
 
@@ -46,7 +47,7 @@ def doGet(path):
 	if kernel_id:
 		return JupyterKernel[kernel_id].connection_file
 	else:
-		return [kernel.kernel_id for kernel in JupyterKernel]
+		return [kernel.kernel_id for kernel in JupyterKernel if not kernel.pooled]
 
 
 @rest
@@ -59,9 +60,13 @@ def doPost(payload):
 		kernel = JupyterKernel[kernel_id]
 		logger.warn('Kernel already running: [%(kernel_id)s]' % kernel)
 	except KeyError:
-		kernel = spawn_kernel(**payload)
-		logger.info('Launched [%(kernel_id)s]' % kernel)
+		# take one already warmed up, if possible
+		kernel = adopt_pooled_kernel(payload)
+		if kernel is None:
+			kernel = spawn_kernel(**payload)
+			logger.info('Launched [%(kernel_id)s]' % kernel)
 		logger.info('Kernel info: %r' % (kernel.connection_info,))
+		refill_pool()
 	
 	for key, value in payload.items():
 		if not kernel[key] == value:
@@ -18,11 +18,15 @@ __all__ = ['KernelMessagingMixin']
 
 
 from shared.tools.jupyter.base import JupyterKernelBaseMixin
-from shared.tools.jupyter.wire import WireMessage
+from shared.tools.jupyter.wire import WireMessage, add_frame, IDS_MSG_DELIMITER_BYTES
 from shared.tools.jupyter.zmq import SocketType, ZMsg
 from shared.tools.jupyter.status import declare_busy, declare_idle
+from shared.tools.jupyter.buffers import pack_columns
 
 from uuid import uuid4
+import functools
+
+from java.util.concurrent import FutureTask
 
 
 class ContextManagedMessage(WireMessage):
@@ -31,16 +35,20 @@ class ContextManagedMessage(WireMessage):
 		# initial value overrides, useful as kwargs
 		ids=None, header=None, parent_header=None, 
 		metadata=None, content=None, raw_data=None,
+		signer=None,
 	
 		topic_prefix='',       # can take the place of ids on broadcast
 		topic_broadcast=False, # broadcast instead of target socket IDs
 		socket=None,
+		dispatcher=None,       # takes over sending the packaged zMessage on the target socket
 		):
 		super(ContextManagedMessage, self).__init__(zMessage, key, signature_scheme,
 				ids, header, parent_header, metadata, content, raw_data,
+				signer=signer,
 			)
 		
 		self.target_socket = socket
+		self.dispatcher = dispatcher
 		
 		# for use in broadcast, prepends message type with this
 		self.topic_prefix = topic_prefix
@@ -53,8 +61,8 @@ class ContextManagedMessage(WireMessage):
 		else:
 			if self.ids:
 				for entry in self.ids:
-					zMessage.add(entry)
-		zMessage.add(self._MESSAGE_SPLITTING_DELIMITER_KEY_BETWEEN_IDS_AND_MESSAGE_PROPER)	
+					add_frame(zMessage, entry)
+		zMessage.add(IDS_MSG_DELIMITER_BYTES)	
 	
 	def __enter__(self):
 		return self
@@ -71,6 +79,10 @@ class ContextManagedMessage(WireMessage):
 		
 		zMessage = self.package()
 		
+		if self.dispatcher is not None and socket is self.target_socket:
+			assert self.dispatcher(socket, zMessage), 'failed to send message on %r' % (socket,)
+			return
+		
 		try:
 			assert zMessage.send(socket), 'failed to send message on %r: %r' % (socket, zMessage,)
 		except Exception as error:
@@ -89,9 +101,10 @@ class KernelMessagingMixin(JupyterKernelBaseMixin):
 	"""
 	# SENDING
 	
-	def _new_message(self, msg_type, target_socket=None, origin_message=None, topic_broadcast=False):
+	def _new_message(self, msg_type, target_socket=None, origin_message=None, topic_broadcast=False, role=None):
 		return ContextManagedMessage(
 			key = self.key,
+			signer = self.signer,
 			header = {
 				'date': self.now,
 				'msg_id': str(uuid4()),
@@ -107,46 +120,133 @@ class KernelMessagingMixin(JupyterKernelBaseMixin):
 			topic_prefix = 'kernel.%(kernel_id)s.' % self,
 			topic_broadcast = topic_broadcast,
 			socket = target_socket,
+			dispatcher = functools.partial(self._send_zmessage, role) if role else None,
 		)
 	
 	# most messages on IOPub will be broadcast based on the topic
 	def iopub_broadcast(self, msg_type, origin_message=None):
-		return self._new_message(msg_type, self.iopub_socket, origin_message, topic_broadcast=True)
+		if msg_type != 'status':
+			self.status_tracker.flush() # busy must go out before any output
+		return self._new_message(msg_type, self.iopub_socket, origin_message, topic_broadcast=True, role='iopub')
 	
 	# ensure replies for messages are handled and sent back to the requester
 	def iopub_message(self, msg_type, origin_message=None):
-		return self._new_message(msg_type, self.iopub_socket, origin_message, topic_broadcast=False)
+		if msg_type != 'status':
+			self.status_tracker.flush()
+		return self._new_message(msg_type, self.iopub_socket, origin_message, topic_broadcast=False, role='iopub')
 	
 	def shell_message(self, msg_type, origin_message=None):
-		return self._new_message(msg_type, self.shell_socket, origin_message)	
+		return self._new_message(msg_type, self.shell_socket, origin_message, role='shell')
 	
 	def control_message(self, msg_type, origin_message=None):
-		return self._new_message(msg_type, self.control_socket, origin_message)	
+		return self._new_message(msg_type, self.control_socket, origin_message, role='control')
 	
 	def stdin_message(self, msg_type, origin_message=None):
-		return self._new_message(msg_type, self.stdin_socket, origin_message)	
+		return self._new_message(msg_type, self.stdin_socket, origin_message, role='stdin')
+	
+	def binary_broadcast(self, msg_type, columns, origin_message=None, dtype=None):
+		"""
+		IOPub broadcast with columns of data shipped as packed binary buffers.
+		
+		Good for comm_msg and display_data carrying datasets or trend arrays,
+		where JSON would cost a round-trip per sample. The buffer descriptors
+		are put in the metadata so the frontend knows how to view each one:
+		
+			with kernel.binary_broadcast('comm_msg', history, message) as update:
+				update.content.comm_id = comm_id
+				update.content.data = {'method': 'update'}
+		"""
+		buffers, descriptors = pack_columns(columns, dtype)
+		message = self.iopub_broadcast(msg_type, origin_message)
+		message.raw_data = buffers
+		message.metadata.buffers = descriptors
+		return message
 
+	# ZMQ sockets are not thread safe, so only the thread polling a socket may use it.
+	# Messages sent from anywhere else (the execution worker, output streaming 
+	# timers, the process role's status updates on iopub, etc.) get queued up
+	# for the polling thread, which is woken to send them.
+	
+	def _socket_poll_role(self, role):
+		return 'process' if role in self._PROCESS_ROLES else 'execution'
+	
+	def _send_zmessage(self, role, socket, zMessage):
+		"""
+		Send the zMessage on the role's socket, or queue it for the thread that polls it.
+		The zMessage is consumed (destroyed once sent).
+		"""
+		poll_role = self._socket_poll_role(role)
+		try:
+			polling_thread = self.role == poll_role
+		except KeyError:
+			polling_thread = False # not one of the kernel's threads
+		
+		# before the pollers start (or after) there's no contention
+		if polling_thread or not self._has_threads(poll_role):
+			# anything already queued goes first
+			self._drain_outbound(poll_role)
+			try:
+				return zMessage.send(socket)
+			finally:
+				zMessage.destroy()
+		
+		self.outbound_queues[poll_role].offer((socket, zMessage))
+		self.wake(poll_role)
+		return True
+	
+	def _drain_outbound(self, poll_role):
+		"""Send everything queued for the poll role's sockets. Returns how many were sent."""
+		queue = self.outbound_queues[poll_role]
+		sent = 0
+		while True:
+			entry = queue.poll()
+			if entry is None:
+				return sent
+			# work that must be done on the polling thread (see _call_on_poller)
+			if isinstance(entry, FutureTask):
+				entry.run()
+				sent += 1
+				continue
+			socket, zMessage = entry
+			try:
+				if not zMessage.send(socket):
+					self.logger.error('Failed to send queued message on %r' % (socket,))
+			finally:
+				zMessage.destroy()
+			sent += 1
+	
+	
 	# RECIEVING
 	
 	def _handle_zmessage(self, role, socket):
 		"""
 		Consume a ZMQ message off the socket, if any, and then handle it based on the role.
+		
+		Returns True if there was a message, False if the socket had nothing queued.
 		"""
 		zMessage = ZMsg.recvMsg(socket, self.ZMQ_DONTWAIT)
-		if zMessage is not None:
-			message = WireMessage(zMessage, 
-					  key=self.key, 
-					  signature_scheme=self.signature_scheme
-				)
-			try:
-				declare_busy(self, message)
-				if self.ACTIVE_HANDLER_RELOAD:
-					reload_function(self[role + '_handler'])(self, message)
-				else:
-					self[role + '_handler'](self, message)
+		if zMessage is None:
+			return False
+		message = WireMessage(zMessage, 
+				  key=self.key, 
+				  signature_scheme=self.signature_scheme,
+				  signer=self.signer,
+			)
+		# handlers may defer the message to the execution worker, which
+		# then owns it (including its frames and declaring idle when done)
+		deferred = False
+		try:
+			declare_busy(self, message)
+			if self.ACTIVE_HANDLER_RELOAD:
+				deferred = reload_function(self[role + '_handler'])(self, message)
+			else:
+				deferred = self[role + '_handler'](self, message)
+			if not deferred:
 				zMessage.destroy()
-			finally:
+		finally:
+			if not deferred:
 				declare_idle(self, message)
+		return True
 
 	def _handle_zbytes(self, role, socket):
 		"""
@@ -155,4 +255,7 @@ class KernelMessagingMixin(JupyterKernelBaseMixin):
 		This is only used by the heartbeat role.
 		"""
 		payload = socket.recv(self.ZMQ_DONTWAIT)
+		if payload is None:
+			return False
 		self[role + '_handler'](self, payload)
+		return True
@@ -0,0 +1,141 @@
+"""
+	Keep a few kernels launched and waiting.
+
+	Starting a kernel means generating its Curve keys, binding its sockets,
+	priming the execution session (project scope and all) and letting its
+	threads spin up. That's seconds on a busy gateway. Instead, a pool of
+	kernels is kept ready and a new connection adopts one, only needing its
+	id, key and (maybe) ports changed.
+
+	The pool has no state of its own: pooled kernels are simply the running
+	kernels marked as `pooled`, so it survives script reloads just as well
+	as the kernels themselves do.
+
+	Set POOL_SIZE to 0 to turn pooling off. Call refill_pool() at gateway
+	startup to have kernels ready for the very first connection.
+"""
+logger = shared.tools.jupyter.logging.Logger()
+
+
+__all__ = ['adopt_pooled_kernel', 'refill_pool', 'pooled_kernels']
+
+
+from shared.tools.jupyter.core import JupyterKernel, spawn_kernel, random_id
+from shared.tools.thread import async
+
+from threading import Lock
+
+
+POOL_SIZE = 2
+
+# kernel settings pooled kernels are launched with
+POOL_KERNEL_KWARGS = {}
+
+_REFILL_LOCK = Lock()
+
+_CLAIM_LOCK = Lock()
+_CLAIMED = set() # pooled kernel ids mid-adoption
+
+
+
+def pooled_kernels():
+	return [kernel for kernel in JupyterKernel if kernel.pooled]
+
+
+def ready_kernels():
+	"""Pooled kernels that are fully up, session and all."""
+	return [kernel for kernel in pooled_kernels()
+			if kernel.is_launched and kernel.session is not None]
+
+
+def _can_adopt(kernel, payload):
+	for setting, value in payload.items():
+		if setting in kernel.ADOPTABLE_SETTINGS:
+			continue
+		# anything else has to already match
+		try:
+			if kernel[setting] != value:
+				return False
+		except (KeyError, AttributeError):
+			return False
+	return True
+
+
+def adopt_pooled_kernel(payload):
+	"""
+	Hand over a ready pooled kernel configured for the payload, if any.
+
+	Returns None if there isn't one (or the payload asks for something
+	a launched kernel can't change, like its interface).
+	"""
+	for kernel in ready_kernels():
+		if not _can_adopt(kernel, payload):
+			continue
+		pooled_id = kernel.kernel_id
+		with _CLAIM_LOCK:
+			if pooled_id in _CLAIMED:
+				continue # someone else got it first
+			_CLAIMED.add(pooled_id)
+		try:
+			kernel.adopt(**payload)
+			return kernel
+		except Exception as error:
+			logger.error('Failed to adopt pooled kernel [%s]: %r' % (pooled_id, error,))
+			JupyterKernel.SCRAM(kernel.kernel_id)
+		finally:
+			with _CLAIM_LOCK:
+				_CLAIMED.discard(pooled_id)
+	return None
+
+
+def refill_pool(size=None):
+	"""Top the pool back up in the background."""
+	if size is None:
+		size = POOL_SIZE
+	if size <= 0:
+		return
+	_refill(size)
+
+
+@async(name='Jupyter-KernelPool-refill')
+def _refill(size):
+	if not _REFILL_LOCK.acquire(False):
+		return # already on it
+	try:
+		for _ in range(size - len(pooled_kernels())):
+			kernel_kwargs = dict(POOL_KERNEL_KWARGS)
+			kernel_kwargs['kernel_id'] = 'pooled-' + random_id()
+			kernel_kwargs['pooled'] = True
+			kernel = spawn_kernel(**kernel_kwargs)
+			logger.debug('Pooled kernel [%s] launching' % (kernel.kernel_id,))
+	finally:
+		_REFILL_LOCK.release()
+
+
+
+def _run_tests():
+	from shared.tools.jupyter.core import JupyterKernel, spawn_kernel, random_id
+	from shared.tools.jupyter.pool import adopt_pooled_kernel, ready_kernels
+	from time import sleep
+
+	pooled_id = 'pooled-' + random_id()
+	kernel = spawn_kernel(kernel_id=pooled_id, pooled=True)
+	try:
+		for _ in range(100):
+			if any(ready is kernel for ready in ready_kernels()):
+				break
+			sleep(0.1)
+		else:
+			raise AssertionError('Pooled kernel [%s] never became ready' % (pooled_id,))
+
+		adopted_id = 'adopted-' + random_id()
+		assert adopt_pooled_kernel({'kernel_id': adopted_id}) is kernel
+		assert not kernel.pooled
+		assert kernel.identifier == adopted_id
+
+		# the threads follow the rename, so it's found by (and only by) its new name
+		assert kernel._all_threads, 'Renamed threads should be found under the new identifier'
+		assert JupyterKernel[adopted_id] is kernel
+		assert not list(JupyterKernel._find_threads(identifier=pooled_id))
+	finally:
+		JupyterKernel.SCRAM(kernel.identifier)
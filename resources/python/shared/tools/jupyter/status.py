@@ -2,30 +2,131 @@
 	Let the Jupyter kernel manager know what the state of the kernel is.
 
 	NOTE: v5.0 all message indicate busy/idle, so only Kernel polling core will perform starting
-	
+
 	https://jupyter-protocol.readthedocs.io/en/latest/messaging.html#kernel-status
+
+	Status updates are tracked rather than sent immediately. Each inbound
+	request still gets its busy and idle (frontends wait on the idle for
+	their request before considering it done), but they're only built and
+	sent when the tracker is flushed. That's either right before any other
+	IOPub message goes out (so busy always precedes a request's output) or
+	at the end of a poll iteration, batching up whatever was handled.
+
+	Widget chatter (comm_msg) is the exception: nothing waits on its status,
+	and a slider drag sends dozens of them, so back-to-back comm_msg brackets
+	are coalesced into one busy (for the first) and idle (for the last).
+	Requests that frontends do wait on (comm_info_request, kernel_info_request
+	and so on, even in the middle of chatter) keep their own brackets, since
+	JupyterLab only considers them done once their idle arrives.
 """
 logger = shared.tools.jupyter.logging.Logger()
 
 
+from threading import RLock
+
+
 EXECUTION_STATES = set(('busy', 'idle', 'starting'))
 
 
-__all__ = ['declare_busy', 'declare_idle']
+__all__ = ['declare_busy', 'declare_idle', 'StatusTracker']
+
+
+
+class StatusTracker(object):
+	"""
+	Collects busy/idle transitions for the kernel until flushed.
+
+	Transitions are skipped where nobody's listening for them:
+	 - replies coming back in (input_reply on stdin, for example)
+	 - a kernel-wide (parentless) state that's already been declared
+	and chatter between them is coalesced when flushed.
+	"""
+	__slots__ = ['kernel', '_pending', '_kernel_state', '_lock']
+
+	# inbound messages that aren't requests, so no frontend waits on their status
+	QUIET_MESSAGE_TYPES = frozenset([
+		'input_reply',
+	])
+
+	# inbound messages frontends send without waiting on their idle
+	CHATTER_MESSAGE_TYPES = frozenset([
+		'comm_msg',
+	])
+
+	def __init__(self, kernel):
+		self.kernel = kernel
+		self._pending = []
+		self._kernel_state = None
+		self._lock = RLock()
+
+	def _is_quiet(self, message):
+		msg_type = message.header.msg_type
+		return msg_type in self.QUIET_MESSAGE_TYPES or msg_type.endswith('_reply')
+
+	def _is_chatter(self, message):
+		return message is not None and message.header.msg_type in self.CHATTER_MESSAGE_TYPES
+
+	def declare(self, status, message=None):
+		assert status in EXECUTION_STATES
+		with self._lock:
+			if message is None:
+				if status == self._kernel_state:
+					return
+				self._kernel_state = status
+			elif self._is_quiet(message):
+				return
+			self._pending.append((status, message))
+
+	def busy(self, message=None):
+		self.declare('busy', message)
+
+	def idle(self, message=None):
+		self.declare('idle', message)
+
+	def _coalesced(self, pending):
+		"""
+		Drop the idle/busy between back-to-back chatter, so the kernel just stays
+		busy from the first until the last is done.
+		"""
+		coalesced = []
+		for status, message in pending:
+			if (status == 'busy' and self._is_chatter(message) and coalesced
+				and coalesced[-1][0] == 'idle' and self._is_chatter(coalesced[-1][1])):
+				coalesced.pop()
+				continue
+			coalesced.append((status, message))
+		return coalesced
+
+	def flush(self):
+		"""Send pending status updates, in order. Returns how many were sent."""
+		with self._lock:
+			if not self._pending:
+				return 0
+			pending, self._pending = self._coalesced(self._pending), []
+			for status, message in pending:
+				with self.kernel.iopub_broadcast('status', message) as update:
+					update.content.execution_state = status
+			return len(pending)
+
+	def __len__(self):
+		return len(self._pending)
+
+	def __repr__(self):
+		return '<StatusTracker %d pending>' % (len(self._pending),)
+
 
 
 def update_status(status, kernel, message=None):
-	assert status in EXECUTION_STATES
-	with kernel.iopub_broadcast('status', message) as update:
-		update.content.execution_state = status
+	kernel.status_tracker.declare(status, message)
 
 
 def declare_starting(kernel):
 	update_status('starting', kernel)
+	kernel.status_tracker.flush()
 
 def declare_busy(kernel, message=None):
 	update_status('busy', kernel, message)
-	
+
 	if message and message.header.msg_type in kernel.traps.get('message_type', []):
 		logger.trace('[%s] %r' % (message.header.msg_type, message.dump()))
 
@@ -33,3 +134,52 @@ def declare_idle(kernel, message=None):
 	update_status('idle', kernel, message)
 
 
+
+def _run_tests():
+	from shared.tools.jupyter.status import StatusTracker
+	from shared.data.types.adhoc import AdHocObject
+
+	class Kernel(object):
+		def __init__(self):
+			self.sent = []
+		def iopub_broadcast(self, msg_type, message):
+			kernel = self
+			class Update(object):
+				def __enter__(self):
+					self.content = AdHocObject()
+					return self
+				def __exit__(self, *exc_info):
+					kernel.sent.append((self.content.execution_state, message.header.msg_id))
+			return Update()
+
+	def message(msg_type, msg_id):
+		return AdHocObject({'header': {'msg_type': msg_type, 'msg_id': msg_id}})
+
+	kernel = Kernel()
+	tracker = StatusTracker(kernel)
+
+	# a burst of widget chatter: 20 status messages uncoalesced
+	chatter = [message('comm_msg', 'c%d' % i) for i in range(10)]
+	for comm_msg in chatter:
+		tracker.busy(comm_msg)
+		tracker.idle(comm_msg)
+	assert tracker.flush() == 2
+	assert kernel.sent == [('busy', 'c0'), ('idle', 'c9')]
+
+	# requests in the middle of chatter keep their own bracket
+	kernel.sent = []
+	info = message('comm_info_request', 'i')
+	for entry in (chatter[0], info, chatter[1]):
+		tracker.busy(entry)
+		tracker.idle(entry)
+	assert tracker.flush() == 6
+
+	# a busy already sent still gets its idle
+	kernel.sent = []
+	tracker.busy(chatter[0])
+	tracker.flush()
+	tracker.idle(chatter[0])
+	tracker.busy(chatter[1])
+	tracker.idle(chatter[1])
+	tracker.flush()
+	assert kernel.sent == [('busy', 'c0'), ('idle', 'c1')]
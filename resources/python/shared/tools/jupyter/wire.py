@@ -10,23 +10,301 @@
 """
 logger = shared.tools.jupyter.logging.Logger()
 
-from shared.tools.jupyter.zmq import ZMsg
+from shared.tools.jupyter.zmq import ZMsg, ZFrame
 from shared.data.types.adhoc import AdHocObject
+from shared.tools.jupyter.encoder import MESSAGE_ENCODER
 
 import json
 import hmac, hashlib
 from uuid import uuid4
 import datetime
+from java.nio import ByteBuffer
 from java.nio.charset import Charset
+from java.lang import String, CloneNotSupportedException
+from java.util import Arrays
+from java.security import MessageDigest
+from javax.crypto import Mac
+from javax.crypto.spec import SecretKeySpec
+from org.python.core.util import StringUtil
+from binascii import hexlify
+import jarray
 
 import struct
 
 
+STRING_ENCODING = 'UTF-8'
+UTF8_CHARSET = Charset.forName(STRING_ENCODING)
+
+
+
+# Frame handling
+#
+# Inbound frames are handled as the raw byte[] JeroMQ already holds for them.
+# ZFrame.getData() hands back the frame's own array, so nothing here copies
+# unless the frame actually needs to become a Python string.
+
+IDS_MSG_DELIMITER = bytes('<IDS|MSG>')
+IDS_MSG_DELIMITER_BYTES = String(IDS_MSG_DELIMITER).getBytes(UTF8_CHARSET)
+IDS_MSG_DELIMITER_LENGTH = len(IDS_MSG_DELIMITER_BYTES)
+
+
+def is_delimiter_frame(frame):
+	"""Check the frame against the pre-encoded delimiter. Length first, since that's nearly free."""
+	return (frame.size() == IDS_MSG_DELIMITER_LENGTH
+			and Arrays.equals(frame.getData(), IDS_MSG_DELIMITER_BYTES))
+
+
+def split_frames(zMessage):
+	"""
+	Partition a ZMsg into the routing identities and the message body.
+
+	Identities and the body (starting with the signature) are each frame's
+	byte[], not copies. The ZFrames themselves aren't kept, since destroying the
+	ZMsg nulls their data and replies may well go out after that.
+	"""
+	identities = []
+	body = None
+	for frame in zMessage:
+		if body is not None:
+			body.append(frame.getData())
+		elif is_delimiter_frame(frame):
+			body = []
+		else:
+			identities.append(frame.getData())
+	assert body is not None, 'Message is missing the %r delimiter' % (IDS_MSG_DELIMITER,)
+	return identities, body
+
+
+def frame_text(frame_bytes):
+	"""Decode the frame straight from its byte buffer (or pass thru if already text)."""
+	if isinstance(frame_bytes, unicode):
+		return frame_bytes
+	if isinstance(frame_bytes, str):
+		return frame_bytes.decode(STRING_ENCODING)
+	return UTF8_CHARSET.decode(ByteBuffer.wrap(frame_bytes)).toString()
+
+
+def add_frame(zMessage, entry):
+	"""
+	Add an entry to an outbound ZMsg.
+	
+	ZFrames get their data re-wrapped rather than added directly: sending a ZMsg 
+	destroys its frames, and an inbound identity frame may be used for several replies.
+	"""
+	if isinstance(entry, ZFrame):
+		zMessage.add(entry.getData())
+	else:
+		zMessage.add(entry)
+
+
+
+def frame_bytes(entry):
+	"""
+	Coerce a frame entry to the byte[] that goes on the wire.
+
+	Raw frames are passed thru as-is. Text is UTF-8 encoded, like ZMsg.add would.
+	"""
+	if isinstance(entry, unicode):
+		return String(entry).getBytes(UTF8_CHARSET)
+	if isinstance(entry, str):
+		return StringUtil.toBytes(entry)
+	return entry
+
+
+def buffer_bytes(buffer):
+	"""
+	Coerce a raw data buffer to byte[] for the wire.
+
+	Buffers are binary, so they must never go thru ZMsg.add(String) - a str
+	is taken byte for byte, not encoded. A byte[] is added as-is, and a
+	ByteBuffer only gets copied if it isn't exactly its own backing array.
+	"""
+	if isinstance(buffer, ByteBuffer):
+		if (buffer.hasArray() and buffer.arrayOffset() == 0 and buffer.position() == 0
+				and buffer.remaining() == len(buffer.array())):
+			return buffer.array()
+		data = jarray.zeros(buffer.remaining(), 'b')
+		buffer.duplicate().get(data)
+		return data
+	if isinstance(buffer, (bytearray, memoryview)):
+		return StringUtil.toBytes(bytes(buffer))
+	return frame_bytes(buffer)
+
+
+
+# Signing
+#
+# The HMAC is keyed once per kernel (well, per key) and each message clones
+# that keyed state instead of redoing the key schedule every time.
+
+HMAC_ALGORITHMS = {
+	'md5':    'HmacMD5',
+	'sha1':   'HmacSHA1',
+	'sha224': 'HmacSHA224',
+	'sha256': 'HmacSHA256',
+	'sha384': 'HmacSHA384',
+	'sha512': 'HmacSHA512',
+}
+
+
+class MessageSigner(object):
+	"""
+	Signs and verifies the wire protocol's HMAC for a given key.
+	
+	Set `trusted` to skip verifying inbound messages. This is only meant for when
+	the transport itself is authenticated (the kernel's Curve-encrypted sockets); 
+	outbound messages are always signed.
+	"""
+	__slots__ = ['key', 'signature_scheme', 'trusted', '_keyed_mac', '_cloneable']
+	
+	def __init__(self, key, signature_scheme='sha256', trusted=False):
+		if signature_scheme.startswith('hmac-'):
+			signature_scheme = signature_scheme[5:]
+		assert signature_scheme in HMAC_ALGORITHMS, 'Signature scheme is not in supported list: %r' % (sorted(HMAC_ALGORITHMS),)
+		
+		self.key = key if isinstance(key, bytes) else key.encode('ascii') # ('UTF-8')
+		self.signature_scheme = signature_scheme
+		self.trusted = trusted
+		
+		self._cloneable = True
+		self._keyed_mac = self._new_keyed_mac() if self.key else None
+	
+	def _new_keyed_mac(self):
+		algorithm = HMAC_ALGORITHMS[self.signature_scheme]
+		mac = Mac.getInstance(algorithm)
+		mac.init(SecretKeySpec(StringUtil.toBytes(self.key), algorithm))
+		return mac
+	
+	def _mac(self):
+		if self._cloneable:
+			try:
+				return self._keyed_mac.clone()
+			except CloneNotSupportedException:
+				self._cloneable = False # provider won't, so stop asking
+		return self._new_keyed_mac()
+	
+	def sign(self, entries):
+		# an empty key can't key a JCE Mac, but the protocol still signs with it
+		if not self.key:
+			hmac_payload = hmac.HMAC(self.key, digestmod=getattr(hashlib, self.signature_scheme))
+			for entry in entries:
+				if not isinstance(entry, basestring):
+					entry = entry.tostring() # raw frame byte[]
+				hmac_payload.update(entry)
+			return hmac_payload.hexdigest()
+		
+		mac = self._mac()
+		for entry in entries:
+			mac.update(frame_bytes(entry))
+		return hexlify(mac.doFinal().tostring())
+	
+	def verify(self, signature, entries):
+		"""Check the signature against the entries (constant time). Always passes if trusted."""
+		if self.trusted:
+			return True
+		return MessageDigest.isEqual(
+				frame_bytes(signature), 
+				frame_bytes(self.sign(entries)),
+			)
+	
+	def __repr__(self):
+		return '<MessageSigner %s%s>' % (self.signature_scheme, ' (trusted)' if self.trusted else '')
+
+
+_SIGNERS = {}
+
+def get_signer(key, signature_scheme='sha256'):
+	"""Signers are cached, so even ad hoc messages only key the HMAC once."""
+	try:
+		return _SIGNERS[(key, signature_scheme)]
+	except KeyError:
+		signer = MessageSigner(key, signature_scheme)
+		_SIGNERS[(key, signature_scheme)] = signer
+		return signer
+
+
 def sign(key, signature_scheme, entries):
-	hmac_payload = hmac.HMAC(key, digestmod=getattr(hashlib, signature_scheme))
-	for entry in entries:
-		hmac_payload.update(entry)
-	return hmac_payload.hexdigest()
+	return get_signer(key, signature_scheme).sign(entries)
+
+
+
+class MessageSection(AdHocObject):
+	"""
+	An AdHocObject for a message section (header, content, etc.) that holds onto
+	its serialized JSON until something in it changes.
+
+	Changes anywhere in the section are signalled up the _parent chain via
+	_signal_dirty, clearing the cached serialization along the way. Serializing
+	culls (and so cleans) the whole tree, which means while the cache is valid
+	any change is guaranteed to propagate up.
+	
+	A list (or any other mutable value that isn't one of its own sections) can
+	be changed in place long after it was read, without anything noticing. So
+	once one has been handed out, the section (and the ones it's in) stops
+	caching and is serialized fresh every time.
+	"""
+	__slots__ = ['_serialized', '_cacheable']
+	
+	_SLOTTED_ATTRIBUTES = frozenset(AdHocObject.__slots__ + __slots__)
+	
+	# values that can't be changed behind our back once read
+	_IMMUTABLE_TYPES = (basestring, bool, int, long, float, type(None))
+	
+	
+	def __init__(self, initial_source=None, strict=False, parent=None):
+		self._serialized = None
+		self._cacheable = True
+		super(MessageSection, self).__init__(initial_source, strict, parent)
+	
+	def __setattr__(self, attr, value):
+		# AdHocObject checks against self.__slots__, which is only ours here
+		if attr in self._SLOTTED_ATTRIBUTES:
+			object.__setattr__(self, attr, value)
+		else:
+			self._pass_thru_setter(attr, value)
+	
+	def _signal_dirty(self):
+		section = self
+		while section is not None:
+			section._serialized = None
+			section = section._parent
+		super(MessageSection, self)._signal_dirty()
+	
+	def _stop_caching(self):
+		section = self
+		while section is not None:
+			section._cacheable = False
+			section = section._parent
+		self._signal_dirty()
+	
+	def _pass_thru_getter(self, key):
+		value = super(MessageSection, self)._pass_thru_getter(key)
+		# lists and such (or some other object's AHO) can be mutated in place
+		# at any time after, so assume the worst once they're handed out
+		if not isinstance(value, self._IMMUTABLE_TYPES):
+			if not (isinstance(value, AdHocObject) and value._parent is self):
+				self._stop_caching()
+		return value
+	
+	def _pass_thru_setter(self, key, value):
+		super(MessageSection, self)._pass_thru_setter(key, value)
+		self._signal_dirty()
+	
+	def __delitem__(self, key):
+		super(MessageSection, self).__delitem__(key)
+		self._signal_dirty()
+	
+	def update(self, source):
+		super(MessageSection, self).update(source)
+		self._signal_dirty()
+	
+	def serialize(self):
+		"""The section's JSON, only actually serialized if changed since last time (or if it can't tell)."""
+		if not self._cacheable:
+			return serialize_dictionary(self, assume_ad_hoc=True)
+		if self._serialized is None:
+			self._serialized = serialize_dictionary(self, assume_ad_hoc=True)
+		return self._serialized
 
 
 
@@ -34,16 +312,11 @@ def serialize_dictionary(some_dict, assume_ad_hoc=False):
 	"""
 	Normalized object serialization for messages. 
 
-	This forces adhoc objects to use their interface for dumping contents.
+	AdHocObjects (and Java types) are walked directly by the MessageEncoder,
+	so there's no need to _asdict them first. Keys aren't sorted: the signature
+	is over the serialized bytes, so it only needs to be consistent.
 	"""
-	if assume_ad_hoc or isinstance(some_dict, AdHocObject):
-		if hasattr(some_dict, '_asdict'):
-			some_dict = some_dict._asdict()
-	
-	return json.dumps(some_dict, sort_keys=True, separators=(',',':'),
-					  default = lambda obj: repr(obj),
-					  ensure_ascii=False, # in case something like 0xFF is in a byte string
-		)
+	return MESSAGE_ENCODER.encode(some_dict)
 
 
 def deserialize_dictionary(some_string, make_ad_hoc=False):
@@ -52,9 +325,9 @@ def deserialize_dictionary(some_string, make_ad_hoc=False):
 
 	Will return an AdHocObject if desired instead of a plain old dictionary.
 	"""
-	somejson = json.loads(some_string.decode('UTF-8'))
+	somejson = json.loads(frame_text(some_string))
 	if make_ad_hoc:
-		return AdHocObject(somejson)
+		return MessageSection(somejson)
 	else:
 		return somejson
 
@@ -74,56 +347,58 @@ class WireMessage(object):
 	components. That's in the ContextManagedMessage class.
 	"""
 	
-	_MESSAGE_SPLITTING_DELIMITER_KEY_BETWEEN_IDS_AND_MESSAGE_PROPER = bytes('<IDS|MSG>')
+	_MESSAGE_SPLITTING_DELIMITER_KEY_BETWEEN_IDS_AND_MESSAGE_PROPER = IDS_MSG_DELIMITER
 	# note that in Jython the `bytes` part here is completely superfluous, but is technically
 	# more correct because we'll be using it to partition the raw bytes in the parser
 
-	STRING_ENCODING = 'UTF-8'
-	UTF8_CHARSET = Charset.forName(STRING_ENCODING)
+	STRING_ENCODING = STRING_ENCODING
+	UTF8_CHARSET = UTF8_CHARSET
 	
 	AD_HOC_INTERFACE = True
 	
+	# Keep the raw frames and only decode a section when it's actually read.
+	# Routing only ever needs the header, so most of the payload can stay as bytes.
+	LAZY_DECODING = True
+	
 	WIRE_PROTOCOL_VERSION = '5.3'
 	
+	_SECTIONS = ('header', 'parent_header', 'metadata', 'content')
+	
 	
 	def __init__(self, zMessage=None, key='', signature_scheme='sha256', 
 				# initial value overrides, useful as kwargs
 				ids=None, header=None, parent_header=None, 
 				metadata=None, content=None, raw_data=None,
+				lazy_decoding=None, signer=None,
 			):
 		"""
 		A WireMessage can be started off directly from the payload from a ZMQ message,
 		initialized with values, or some combination.
+		
+		If lazy_decoding is set (defaults to LAZY_DECODING) the JSON sections are 
+		kept as raw bytes until first accessed.
+		
+		Kernels should pass in their MessageSigner. Otherwise one is looked up
+		for the key and signature_scheme.
 		"""
+		self.lazy_decoding = self.LAZY_DECODING if lazy_decoding is None else lazy_decoding
+		
 		if zMessage:
-			self.message_parts = []
-			id_delim_found = False
-			for frame in zMessage:
-				if id_delim_found:
-					self.message_parts.append(frame.getString(self.UTF8_CHARSET))
-				else:
-					data = frame.getData()
-
-					try:
-						ascii_data = ''.join(chr(x) for x in data)
-					except:
-						ascii_data = None
-					
-					if ascii_data == self._MESSAGE_SPLITTING_DELIMITER_KEY_BETWEEN_IDS_AND_MESSAGE_PROPER:
-						id_delim_found = True
-						self.message_parts.append(self._MESSAGE_SPLITTING_DELIMITER_KEY_BETWEEN_IDS_AND_MESSAGE_PROPER)
-					else:
-						self.message_parts.append(frame.duplicate())
+			# body frames are kept as raw bytes - signature is checked on these and
+			# the JSON is only decoded if the section is read
+			self._identity_frames, self.message_parts = split_frames(zMessage)
 		else:
+			self._identity_frames = []
 			self.message_parts = []
 		
-		self.key = key if isinstance(key, bytes) else key.encode('ascii') # ('UTF-8')
+		if signer is None:
+			signer = get_signer(key, signature_scheme)
+		self.signer = signer
+		self.key = signer.key
+		self.signature_scheme = signer.signature_scheme
 		
-		if signature_scheme.startswith('hmac-'):
-			signature_scheme = signature_scheme[5:]
-			
-		assert signature_scheme in hashlib.algorithms, 'Signature scheme is not in supported list: %r' % (hashlib.algorithms,)
-		self.signature_scheme = signature_scheme
+		# (contents, signature) last signed, so it's not recomputed for the same frames
+		self._last_signed = None
 		
 		# parse and initialize what's been captured first.
 		self.parse()
@@ -140,10 +415,7 @@ class WireMessage(object):
 		if content is not None:
 			self.content = content
 		if raw_data is not None:
-			if isinstance(raw_data, list):
-				self._raw_data_buffers = raw_data
-			else:
-				self._raw_data_buffers = [raw_data]
+			self.raw_data = raw_data
 	
 	def __bool__(self):
 		# NOTE: consider validating here?
@@ -151,7 +423,30 @@ class WireMessage(object):
 	
 	
 	def sign(self, entries):
-		return sign(self.key, self.signature_scheme, entries)
+		return self.signer.sign(entries)
+	
+	
+	@property
+	def raw_data(self):
+		"""
+		The binary buffers that trail the signed sections.
+		
+		Inbound these are the frames' own byte[] (no decode, no copy).
+		"""
+		return self._raw_data_buffers
+	
+	@raw_data.setter
+	def raw_data(self, buffers):
+		if isinstance(buffers, tuple):
+			buffers = list(buffers)
+		elif not isinstance(buffers, list):
+			buffers = [buffers]
+		self._raw_data_buffers = buffers
+	
+	def buffer_views(self):
+		"""Read-only ByteBuffer views over the binary buffers, sharing their bytes."""
+		return [ByteBuffer.wrap(buffer_bytes(buffer)).asReadOnlyBuffer()
+				for buffer in self._raw_data_buffers]
 
 	@property
 	def _signed_contents(self):
@@ -162,39 +457,89 @@ class WireMessage(object):
 				self._serialized_content,
 			]
 	
+	def _signed_frames(self):
+		"""
+		Serialize the sections once and sign them, returning (signature, frames).
+		
+		The frames are exactly what was signed, so package() sends those bytes.
+		If every section comes back as the very same object as last time (like
+		untouched raw frames) the previous signature is reused.
+		"""
+		contents = self._signed_contents
+		if self._last_signed:
+			last_contents, last_frames, signature = self._last_signed
+			if all(entry is last_entry for entry, last_entry in zip(contents, last_contents)):
+				return signature, last_frames
+		frames = [frame_bytes(entry) for entry in contents]
+		signature = self.sign(frames)
+		self._last_signed = (contents, frames, signature)
+		return signature, frames
+	
 	@property
 	def signature(self):
-		return self.sign(self._signed_contents)
+		return self._signed_frames()[0]
 
 	# helper properties to wrap these message fields to make sure they're AdHoc, if desired
 	# (that way they can't be set as a dict and then throw errors for being treaded like an object)
+	#
+	# Sections captured off the wire may still be raw frame bytes (see LAZY_DECODING).
+	# Those are decoded on first access and the raw frame is dropped once decoded.
+	def _decoded_section(self, section):
+		raw_frame = self._raw_frames.get(section)
+		if raw_frame is not None:
+			decoded = deserialize_dictionary(raw_frame, self.AD_HOC_INTERFACE)
+			# the raw frame is already a perfectly good serialization of it
+			if isinstance(decoded, MessageSection):
+				decoded._serialized = raw_frame
+			setattr(self, '_' + section, decoded)
+			del self._raw_frames[section]
+		return getattr(self, '_' + section)
+	
+	def _set_section(self, section, value):
+		self._raw_frames.pop(section, None)
+		# sections are kept as-is (not rewrapped) so reused ones, like the 
+		# parent_header echoed from the origin message, share their cached JSON
+		if not (self.AD_HOC_INTERFACE and isinstance(value, MessageSection)):
+			value = self._attr_type_interface(value)
+		setattr(self, '_' + section, value)
+	
+	def _serialize_section(self, section):
+		# an untouched raw frame is already exactly what it would serialize to
+		raw_frame = self._raw_frames.get(section)
+		if raw_frame is not None:
+			return raw_frame
+		section_value = getattr(self, '_' + section)
+		if isinstance(section_value, MessageSection):
+			return section_value.serialize()
+		return serialize_dictionary(section_value, self.AD_HOC_INTERFACE)
+	
 	@property
 	def header(self):
-		return self._header
+		return self._decoded_section('header')
 	@header.setter
 	def header(self, header):
-		self._header = self._attr_type_interface(header)
+		self._set_section('header', header)
 
 	@property
 	def parent_header(self):
-		return self._parent_header
+		return self._decoded_section('parent_header')
 	@parent_header.setter
 	def parent_header(self, parent_header):
-		self._parent_header = self._attr_type_interface(parent_header)
+		self._set_section('parent_header', parent_header)
 
 	@property
 	def content(self):
-		return self._content
+		return self._decoded_section('content')
 	@content.setter
 	def content(self, content):
-		self._content = self._attr_type_interface(content)
+		self._set_section('content', content)
 	
 	@property
 	def metadata(self):
-		return self._metadata
+		return self._decoded_section('metadata')
 	@metadata.setter
 	def metadata(self, metadata):
-		self._metadata = self._attr_type_interface(metadata)
+		self._set_section('metadata', metadata)
 	
 	
 	# serialization wrappers
@@ -203,31 +548,39 @@ class WireMessage(object):
 	# some binary nonsense that's a pain to deal with.
 	@property
 	def _serialized_header(self):
-		return serialize_dictionary(self.header, self.AD_HOC_INTERFACE)
+		return self._serialize_section('header')
 	@_serialized_header.setter
 	def _serialized_header(self, frame_bytes):
-		self.header = deserialize_dictionary(frame_bytes, self.AD_HOC_INTERFACE)
+		self._load_section('header', frame_bytes)
 
 	@property
 	def _serialized_parent_header(self):
-		return serialize_dictionary(self.parent_header, self.AD_HOC_INTERFACE)
+		return self._serialize_section('parent_header')
 	@_serialized_parent_header.setter
 	def _serialized_parent_header(self, frame_bytes):
-		self.parent_header = deserialize_dictionary(frame_bytes, self.AD_HOC_INTERFACE)
+		self._load_section('parent_header', frame_bytes)
 
 	@property
 	def _serialized_metadata(self):
-		return serialize_dictionary(self.metadata, self.AD_HOC_INTERFACE)
+		return self._serialize_section('metadata')
 	@_serialized_metadata.setter
 	def _serialized_metadata(self, frame_bytes):
-		self.metadata = deserialize_dictionary(frame_bytes, self.AD_HOC_INTERFACE)
+		self._load_section('metadata', frame_bytes)
 
 	@property
 	def _serialized_content(self):
-		return serialize_dictionary(self.content, self.AD_HOC_INTERFACE)
+		return self._serialize_section('content')
 	@_serialized_content.setter
 	def _serialized_content(self, frame_bytes):
-		self.content = deserialize_dictionary(frame_bytes, self.AD_HOC_INTERFACE)
+		self._load_section('content', frame_bytes)
+	
+	def _load_section(self, section, frame_bytes):
+		"""Take a raw frame for the section, deferring the JSON decode if lazy."""
+		if self.lazy_decoding:
+			setattr(self, '_' + section, None)
+			self._raw_frames[section] = frame_bytes
+		else:
+			self._set_section(section, deserialize_dictionary(frame_bytes, self.AD_HOC_INTERFACE))
 
 	
 	def set_header_defaults(self):
@@ -242,7 +595,7 @@ class WireMessage(object):
 	
 	@property
 	def _attr_type_interface(self):
-		return (AdHocObject if self.AD_HOC_INTERFACE else dict)
+		return (MessageSection if self.AD_HOC_INTERFACE else dict)
 
 
 	def parse(self):
@@ -250,6 +603,9 @@ class WireMessage(object):
 		Call this to consume the set message parts and dole them into their
 		respective attributes.
 		"""
+		# raw (not yet decoded) frames for each section, if any
+		self._raw_frames = {}
+		
 		# initialize empty, though use an AdHocObject for interactive convenience.
 		if not self.message_parts:
 			self.ids = []
@@ -260,40 +616,29 @@ class WireMessage(object):
 			self._raw_data_buffers = []
 			return
 		
-		self.ids = []
-		for ix, entry in enumerate(self.message_parts):
-			if entry == self._MESSAGE_SPLITTING_DELIMITER_KEY_BETWEEN_IDS_AND_MESSAGE_PROPER:
-				break
-			if entry:
-				self.ids.append(entry)
+		self.ids = list(self._identity_frames)
 		
 		# validate the message parts
-		signature = self.message_parts[ix + 1]
-		assert signature == sign(self.key, self.signature_scheme,
-								 self.message_parts[ix + 2:]), (
-								 	  'Message signature mismatch!' 
-								 	+ '\n' + signature
-								 	+ '\n' + sign(self.key, self.signature_scheme,
-								 					self.message_parts[ix + 2:]))
+		# (only the signed sections - buffers are not part of the HMAC)
+		signature = self.message_parts[0]
+		assert self.signer.verify(signature, self.message_parts[1:5]), (
+								 	'Message signature mismatch! %s' % (frame_text(signature),))
 		
-		self._serialized_header         = self.message_parts[ix + 2]
-		self._serialized_parent_header  = self.message_parts[ix + 3]
-		self._serialized_metadata       = self.message_parts[ix + 4]
-		self._serialized_content        = self.message_parts[ix + 5]
+		self._serialized_header         = self.message_parts[1]
+		self._serialized_parent_header  = self.message_parts[2]
+		self._serialized_metadata       = self.message_parts[3]
+		self._serialized_content        = self.message_parts[4]
 		
 		#assert signature == self.signature # no need to calculate if already done on raw
 		
-		if len(self.message_parts) > ix + 5:
-			self._raw_data_buffers      = self.message_parts[ix + 6:]
-		else:
-			self._raw_data_buffers = []
+		self._raw_data_buffers = self.message_parts[5:]
 
 	
 	def _add_ids_to_zMessage(self, zMessage):
 		if self.ids:
 			for entry in self.ids:
-				zMessage.add(entry)
-		zMessage.add(self._MESSAGE_SPLITTING_DELIMITER_KEY_BETWEEN_IDS_AND_MESSAGE_PROPER)	
+				add_frame(zMessage, entry)
+		zMessage.add(IDS_MSG_DELIMITER_BYTES)	
 
 	def package(self):
 		"""
@@ -305,14 +650,14 @@ class WireMessage(object):
 		zMessage = ZMsg()
 		self._add_ids_to_zMessage(zMessage)
 		
-		signed_contents = self._signed_contents
+		signature, signed_frames = self._signed_frames()
 		
-		zMessage.add(self.sign(signed_contents))
-		for entry in signed_contents:
+		zMessage.add(signature)
+		for entry in signed_frames:
 			zMessage.add(entry)
 		
 		for entry in self._raw_data_buffers:
-			zMessage.add(entry)
+			zMessage.add(buffer_bytes(entry))
 		
 		return zMessage
 	
@@ -340,7 +685,7 @@ class WireMessage(object):
 
 def _run_tests():
 	# simple examples just to verify basic construction
-	from shared.tools.jupyter.wire import WireMessage, ZMsg
+	from shared.tools.jupyter.wire import WireMessage, MessageSigner, ZMsg
 
 	raw_frames = [
 		b'd53feddf-67f3-44e9-8b66-229af1719e77', 
@@ -361,13 +706,111 @@ def _run_tests():
 	
 	wire_message = WireMessage(zMessage, key=kernel_id)
 	
+	# the keyed JCE signer agrees with plain old hmac
+	reference_hmac = hmac.HMAC(kernel_id, digestmod=hashlib.sha256)
+	for frame in raw_frames[3:7]:
+		reference_hmac.update(frame)
+	assert raw_frames[2] == reference_hmac.hexdigest()
+	assert raw_frames[2] == MessageSigner(kernel_id).sign(raw_frames[3:7])
+	
 	# verify the loop
 	assert repr(zMessage) == repr(wire_message.package())
 	
+	# nothing needed decoding to repackage the message
+	assert set(wire_message._raw_frames) == set(WireMessage._SECTIONS)
+	assert wire_message.header.msg_type == 'comm_msg'
+	assert 'header' not in wire_message._raw_frames
+	assert 'content' in wire_message._raw_frames
+	
 	# test that signature mutation happens
 	wire_message.header.username = 'myself'
 	
 	assert repr(zMessage) != repr(wire_message.package())
+	
+	# serialization is cached until the section changes
+	content = wire_message.content
+	serialized = wire_message._serialized_content
+	assert serialized is wire_message._serialized_content
+	content.data.method = 'something_else'
+	assert serialized is not wire_message._serialized_content
+	assert 'something_else' in wire_message._serialized_content
+	serialized = wire_message._serialized_content
+	content.data.more = ['a']
+	content.data.more.append('b')
+	assert '"b"' in wire_message._serialized_content
+	# even if the list was read before serializing and changed after
+	more = content.data.more
+	signature = wire_message.signature
+	more.append('c')
+	assert '"c"' in wire_message._serialized_content
+	assert signature != wire_message.signature
+	
+	# identities are kept as the frames' own byte[] (not copies), which outlive the ZMsg
+	from java.lang.System import identityHashCode
+	assert identityHashCode(wire_message.ids[0]) == identityHashCode(list(zMessage)[0].getData())
+	identity = StringUtil.fromBytes(wire_message.ids[0])
+	destroyed = ZMsg()
+	for part in raw_frames:
+		_ = destroyed.add(part)
+	kept = WireMessage(destroyed, key=kernel_id)
+	destroyed.destroy()
+	assert StringUtil.fromBytes(list(kept.package())[0].getData()) == identity
+
+	# binary buffers survive the round trip byte for byte
+	binary = ''.join(chr(x) for x in range(256))
+	wire_message.raw_data = [binary, ByteBuffer.wrap(StringUtil.toBytes(binary), 128, 128)]
+	echo = WireMessage(wire_message.package(), key=kernel_id)
+	assert len(echo.raw_data) == 2
+	assert StringUtil.fromBytes(echo.raw_data[0]) == binary
+	assert StringUtil.fromBytes(echo.raw_data[1]) == binary[128:]
+	assert echo.buffer_views()[0].get(255) == -1
+
+	_benchmark_frame_scan(raw_frames)
+
+
+def _benchmark_frame_scan(raw_frames, identity_count=16, iterations=5000):
+	"""Compare the old per-byte string building identity scan against split_frames."""
+	from shared.tools.profile import convert_to_human_readable
+	from java.lang import System
+	
+	zMessage = ZMsg()
+	for ix in range(identity_count):
+		_ = zMessage.add('%032x' % ix)
+	for part in raw_frames[1:]:
+		_ = zMessage.add(part)
+	frame_count = zMessage.size()
+	
+	def legacy_scan(zMessage):
+		parts = []
+		id_delim_found = False
+		for frame in zMessage:
+			if id_delim_found:
+				parts.append(frame.getString(UTF8_CHARSET))
+			else:
+				data = frame.getData()
+				try:
+					ascii_data = ''.join(chr(x) for x in data)
+				except:
+					ascii_data = None
+				if ascii_data == IDS_MSG_DELIMITER:
+					id_delim_found = True
+					parts.append(IDS_MSG_DELIMITER)
+				else:
+					parts.append(frame.duplicate())
+		return parts
+	
+	results = {}
+	for label, scan in (('before', legacy_scan), ('after', split_frames)):
+		start = System.nanoTime()
+		for _ in xrange(iterations):
+			_ = scan(zMessage)
+		elapsed = (System.nanoTime() - start) / 1e9
+		results[label] = (frame_count * iterations) / elapsed
+		print '%-6s %12.0f frames/sec (%s per message)' % (
+			label, results[label], convert_to_human_readable(elapsed / iterations))
+	
+	zMessage.destroy()
+	return results
 
 
 
@@ -11,7 +11,7 @@ logger = shared.tools.jupyter.logging.Logger()
 
 
 # splitting here for ease of copy/paste =/
-__all__ = 'SocketType ZMQ ZMsg ZPoller ZContext ZMQException ZError Curve'.split()
+__all__ = 'SocketType ZMQ ZMsg ZFrame ZPoller ZContext ZMQException ZError Curve'.split()
 
 
 from shared.tools.hotload import JarClassLoader
@@ -110,7 +110,7 @@ def load_jars(libraries, jar_folder=JAR_FOLDER):
 	logger.debug('{library_names} added to path.', library_names=[l['library'] for l in libraries])
 
 try:
-	from org.zeromq import SocketType, ZMQ, ZMsg, ZPoller, ZContext, ZMQException
+	from org.zeromq import SocketType, ZMQ, ZMsg, ZFrame, ZPoller, ZContext, ZMQException
 	from zmq import ZError
 	from zmq.io.mechanism.curve import Curve
 
@@ -118,7 +118,7 @@ except ImportError:
 
 	load_jars(libraries)
 
-	from org.zeromq import SocketType, ZMQ, ZMsg, ZPoller, ZContext, ZMQException
+	from org.zeromq import SocketType, ZMQ, ZMsg, ZFrame, ZPoller, ZContext, ZMQException
 	from zmq import ZError
 	from zmq.io.mechanism.curve import Curve
 